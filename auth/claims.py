@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from shared.digest import digest
+from shared.metrics import CacheStats
+
+'''
+Cache of verified access tokens:
+Each authenticated request used to verify the JWT signature (HMAC), parse the claims, look the user up and build a UserInDB.
+Clients send the same token thousands of times, so ClaimsCache keeps the user that a token was verified for,
+keyed by a 16 byte digest of the token (the token itself is never stored), until the token's exp.
+A hit is one hash of the token and a dict lookup.
+
+It's bounded: at most max_entries tokens, the least recently used go first.
+The cached user can go stale, so the app reports what changes it:
+    invalidate_user(username)  the user was disabled, deleted or changed their password: every token of theirs is dropped
+Revoked tokens are not the cache's business: each entry keeps the token's jti, and a hit asks `revocations`
+(a RevocationList, auth/revocation.py) first, so a token revoked by any path stops hitting right away.
+The same race as in heroes/cache.py applies: a request verifies a token, the user is disabled, then the request caches it.
+So get_generation() is read before the verification, and put() drops the entry if an invalidation happened in between.
+'''
+
+
+class ClaimsCache:
+    def __init__(self, max_entries: int = 100_000, revocations=None):
+        self.max_entries = max_entries
+        self.revocations = revocations
+        self.stats = CacheStats()
+        # token digest -> (exp, username, user, jti)
+        self._entries: OrderedDict[bytes, tuple[float, str, object, str | None]] = OrderedDict()
+        self._by_user: dict[str, set[bytes]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def get(self, token: str):
+        claims = self.get_claims(token)
+        return None if claims is None else claims[0]
+
+    def get_claims(self, token: str) -> tuple[object, str | None, float] | None:
+        '''The (user, jti, exp) the token was verified with, or None.'''
+        key = digest(token.encode())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        # The revocation check doesn't need our lock, the other tokens' lookups don't wait for it.
+        jti = entry[3]
+        if jti is not None and self.revocations is not None and self.revocations.is_revoked(jti):
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._remove(key)
+                self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return entry[2], jti, entry[0]
+
+    def put(self, token: str, username: str, user, exp: float, generation: int | None = None, jti: str | None = None):
+        key = digest(token.encode())
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if exp <= time.time():
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (exp, username, user, jti)
+            self._by_user.setdefault(username, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            self._generation += 1
+            self.stats.invalidations += 1
+            for key in self._by_user.pop(username, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_user.clear()
+
+    def info(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "users": len(self._by_user),
+            **self.stats.as_dict(),
+        }
+
+    def _remove(self, key: bytes):
+        _, username, _, _ = self._entries.pop(key)
+        keys = self._by_user.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[username]
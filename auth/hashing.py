@@ -0,0 +1,104 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+from shared.metrics import Histogram
+
+'''
+A bounded pool for password hashing:
+bcrypt is slow on purpose (~250 ms per check at cost 12). Called from an `async def` endpoint it freezes the event loop,
+and every other request of the worker waits behind it. Sent to FastAPI's default threadpool it takes threads
+that the `def` endpoints and dependencies need.
+HashingPool runs it on its own small set of threads instead. bcrypt releases the GIL while it works,
+so the threads really run in parallel with the event loop, and no process pool (and no pickling) is needed.
+
+The pool is bounded: at most `workers` hashes run at once and `max_queue` more wait for a thread.
+Beyond that run() fails right away with 503 and a Retry-After header, estimated from how long hashes take.
+Queueing more wouldn't help anyway: a login that waits 20 s is a failed login for the user, and it keeps a request open.
+
+render() gives the metrics in the Prometheus text format: how long jobs waited for a thread, how long they ran,
+and the in-flight, rejected and completed counts.
+'''
+
+HASHING_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class HashingPool:
+    def __init__(self, workers: int | None = None, max_queue: int | None = None, name: str = "password_hashing"):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = 4 * self.workers if max_queue is None else max_queue
+        self.name = name
+        self.in_flight = 0
+        self.rejected = 0
+        self.completed = 0
+        self.wait_seconds = Histogram(f"{name}_wait_seconds", "Time a job waited for a hashing thread.", HASHING_SECONDS_BUCKETS, label="job")
+        self.run_seconds = Histogram(f"{name}_run_seconds", "Time a job ran on a hashing thread.", HASHING_SECONDS_BUCKETS, label="job")
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._run_total = 0.0
+
+    def retry_after(self) -> int:
+        # Seconds until the jobs ahead are done: the queue length in rounds of `workers`, times the average run time.
+        average = self._run_total / self.completed if self.completed else 1.0
+        return max(1, math.ceil(self.in_flight / self.workers * average))
+
+    def is_full(self) -> bool:
+        return self.in_flight >= self.workers + self.max_queue
+
+    def _finished(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += not future.cancelled()
+
+    async def run(self, job: str, function, *args):
+        '''Runs function(*args) on the pool and waits for it without blocking the event loop.'''
+        with self._lock:
+            if self.is_full():
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many logins in progress, try again later",
+                    headers={"Retry-After": str(self.retry_after())},
+                )
+            self.in_flight += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            self.wait_seconds.observe(job, started - submitted)
+            try:
+                return function(*args)
+            finally:
+                seconds = time.perf_counter() - started
+                self.run_seconds.observe(job, seconds)
+                with self._lock:
+                    self._run_total += seconds
+
+        future = self._executor.submit(timed)
+        # Counted down when the job is done (or cancelled before it started), not when this request stops waiting for it.
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+
+    def info(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
+
+    def render(self) -> str:
+        lines = [*self.wait_seconds.render(), *self.run_seconds.render()]
+        for key, kind in (("in_flight", "gauge"), ("rejected", "counter"), ("completed", "counter")):
+            metric = f"{self.name}_{key}" + ("_total" if kind == "counter" else "")
+            lines += [f"# TYPE {metric} {kind}", f"{metric} {getattr(self, key)}"]
+        return "\n".join(lines) + "\n"
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,141 @@
+import math
+import threading
+import time
+
+from fastapi import HTTPException, status
+
+'''
+Login rate limiting:
+Every POST /token attempt for a known user costs a bcrypt check (~250 ms of CPU), so a credential-stuffing burst
+turns straight into CPU exhaustion. LoginLimiter answers 429 with Retry-After before any hashing happens when:
+    the password pool is already full      the global cap, at most workers + max_queue checks in flight (auth/hashing.py)
+    the client IP is over its bucket       one address trying many usernames
+    the username is over its bucket        many addresses trying one account
+The IP is checked before the username, so attempts that are refused for their IP don't use up the account's bucket.
+
+The buckets are token buckets: `burst` attempts right away, then `rate` more per second.
+They're stored the GCRA way (generic cell rate algorithm): a single float per key, the time at which the bucket would be full again,
+so a check is one dict lookup and a bit of arithmetic, a couple of microseconds (benchmarks/bench_login_limit.py).
+A key whose bucket is full again is the same as no key, so TokenBuckets drops those when it holds more than max_keys,
+and if an attacker spraying addresses still keeps it full, the oldest keys go (their buckets start over, full).
+
+TokenBuckets lives in the process. RemoteTokenBuckets keeps the same float in redis and updates it in a Lua script,
+so all the workers share the buckets. Both have the same methods, create_buckets() picks one from a URL like create_cache().
+'''
+
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.limit = (burst - 1) * self.interval
+        self.max_keys = max_keys
+        self._full_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        '''Takes one token from the bucket of key, returns 0, or the seconds to wait for a token when the bucket is empty.'''
+        now = time.monotonic()
+        with self._lock:
+            full_at = max(self._full_at.get(key, now), now)
+            # full_at - now is how long until the tokens taken so far are back, one more fits while that's at most burst - 1 intervals.
+            wait = full_at - now - self.limit
+            if wait > 0:
+                return wait
+            self._full_at[key] = full_at + self.interval
+            if len(self._full_at) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now: float):
+        self._full_at = {key: full_at for key, full_at in self._full_at.items() if full_at > now}
+        excess = len(self._full_at) - self.max_keys // 2
+        if excess > 0:
+            for key in list(self._full_at)[:excess]:
+                del self._full_at[key]
+
+    def info(self) -> dict:
+        return {"backend": "memory", "keys": len(self._full_at), "max_keys": self.max_keys}
+
+
+# KEYS[1] the bucket, ARGV: now, interval, burst. Returns 0 or the seconds to wait, as a string (Lua numbers become integers).
+ACQUIRE_LUA = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local wait = full_at - now - (tonumber(ARGV[3]) - 1) * interval
+if wait > 0 then
+    return tostring(wait)
+end
+full_at = full_at + interval
+redis.call('SET', KEYS[1], tostring(full_at), 'PX', math.ceil((full_at - now) * 1000))
+return '0'
+"""
+
+
+class RemoteTokenBuckets:
+    def __init__(self, client, rate: float, burst: int, prefix: str = "login:"):
+        self.client = client
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self.prefix = prefix
+        self._acquire = client.register_script(ACQUIRE_LUA)
+
+    def acquire(self, key: str) -> float:
+        # Wall clock time: the workers may be on different hosts, their monotonic clocks don't agree.
+        return float(self._acquire(keys=[f"{self.prefix}{key}"], args=[time.time(), self.interval, self.burst]))
+
+    def info(self) -> dict:
+        return {"backend": type(self.client).__name__}
+
+
+def create_buckets(url: str | None, rate: float, burst: int, prefix: str = "login:", **options):
+    '''
+    None or "memory://"  -> TokenBuckets in this process
+    "redis://..."        -> RemoteTokenBuckets over redis (pip install redis), shared by every worker
+    '''
+    if not url or url.startswith("memory://"):
+        return TokenBuckets(rate, burst, **options)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// rate limit URL needs the redis package: pip install redis")
+        return RemoteTokenBuckets(redis.Redis.from_url(url), rate, burst, prefix)
+    raise ValueError(f"Unsupported rate limit URL: {url}")
+
+
+class LoginLimiter:
+    def __init__(self, per_ip, per_user, pool=None):
+        self.per_ip = per_ip
+        self.per_user = per_user
+        self.pool = pool
+        self.allowed = 0
+        self.limited = {"pool": 0, "ip": 0, "user": 0}
+
+    def _refuse(self, reason: str, wait: float):
+        self.limited[reason] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+
+    def check(self, username: str, client_ip: str | None):
+        if self.pool is not None and self.pool.is_full():
+            self._refuse("pool", self.pool.retry_after())
+        wait = self.per_ip.acquire(f"ip:{client_ip}")
+        if wait:
+            self._refuse("ip", wait)
+        wait = self.per_user.acquire(f"user:{username}")
+        if wait:
+            self._refuse("user", wait)
+        self.allowed += 1
+
+    def info(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "limited": dict(self.limited),
+            "per_ip": self.per_ip.info(),
+            "per_user": self.per_user.info(),
+        }
@@ -0,0 +1,276 @@
+import heapq
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy.pool import NullPool
+from sqlmodel import create_engine
+
+from shared.migrations import migrate
+from shared.sqlite import DEFAULT_PRAGMAS
+
+logger = logging.getLogger("auth.revocation")
+
+'''
+Token revocation by jti:
+Every token full_oauth2.py issues has a jti claim, a random id. Revoking a token puts its jti in RevocationList until the token's exp
+(after that the token is refused for being expired anyway), and every authenticated request asks is_revoked(jti).
+Almost no token is revoked, so that check has to be cheap for the ones that aren't.
+
+In front of the exact set (a dict jti -> exp) sits a Bloom filter: a bit array where each revoked jti sets `hashes` bits.
+A jti with any of its bits at 0 was never revoked, that's the answer for nearly every request: a few bit tests,
+no lock, and the positions come from hash(jti), which Python computes once and keeps in the str, no digest is built.
+When all the bits are set it may be revoked, or it's a false positive (error_rate of them, 0.1% by default), and the dict decides.
+
+A Bloom filter can't forget, so expired jtis would leave their bits behind and the false positives would grow.
+The entries sit in a heap by exp too: prune() drops the expired ones, and once a quarter of what the filter holds has expired,
+a new filter is built from what's left and swapped in. It also grows (2x) when more jtis are revoked than it was sized for.
+prune() runs on revoke() and in the sync thread, never in is_revoked(): that one takes no lock and does no I/O.
+
+The filter and the dict live in the process, but a refresh token lives 14 days, across restarts and on every worker.
+So with a store (SQLiteRevocationStore, a revoked_token table) revoke() writes the jti there first, and the list syncs from it:
+everything at startup (create_revocation_list), then a background thread reads what was added since, found by the row id,
+every sync_interval seconds, and deletes the expired rows after a rebuild.
+A token revoked on one worker is refused by all of them within sync_interval. Refresh token rotation doesn't wait for that:
+revoke() says whether this call is the one that revoked the jti (an INSERT OR IGNORE), so a refresh token replayed on another
+worker finds it already used. The store is a file, the workers of one host share it.
+'''
+
+
+class BloomFilter:
+    __slots__ = ("bits", "size", "hashes", "capacity")
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: str):
+        value = hash(item)
+        step = (value >> 32) & 0xFFFFFFFF | 1
+        position = value & 0xFFFFFFFF
+        for _ in range(self.hashes):
+            bit = position % self.size
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+            position += step
+
+    def __contains__(self, item: str) -> bool:
+        value = hash(item)
+        step = (value >> 32) & 0xFFFFFFFF | 1
+        position = value & 0xFFFFFFFF
+        bits, size = self.bits, self.size
+        for _ in range(self.hashes):
+            bit = position % size
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+            position += step
+        return True
+
+
+class RevocationList:
+    def __init__(self, capacity: int = 10_000, error_rate: float = 0.001, store=None, sync_interval: float = 1.0):
+        self.error_rate = error_rate
+        self.filter = BloomFilter(capacity, error_rate)
+        self.store = store
+        self.sync_interval = sync_interval
+        self.rebuilds = 0
+        self.maybe = 0
+        self.false_positives = 0
+        self._expires: dict[str, float] = {}
+        self._by_exp: list[tuple[float, str]] = []
+        self._expired_since_build = 0
+        self._synced_id = 0
+        self._store_prune_due = False
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def revoke(self, jti: str, exp: float) -> bool:
+        '''Returns True when this call revoked the jti, False when it was revoked already (or is expired).'''
+        if exp <= time.time():
+            return False
+        # The store before the process: once it's there, every worker will refuse the token.
+        revoked = self.store.add(jti, exp) if self.store is not None else None
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            added = self._add(jti, exp, now)
+        return added if revoked is None else revoked
+
+    def is_revoked(self, jti: str) -> bool:
+        # Runs on every request, on the event loop: no lock and no I/O, a few bit tests and, rarely, a dict lookup.
+        if jti not in self.filter:
+            return False
+        self.maybe += 1
+        if jti in self._expires:
+            return True
+        self.false_positives += 1
+        return False
+
+    def sync(self):
+        '''Adds the jtis revoked in the store since the last sync, all of them the first time.'''
+        if self.store is None:
+            return
+        with self._sync_lock:
+            rows = self.store.since(self._synced_id)
+            with self._lock:
+                now = time.time()
+                for _, jti, exp in rows:
+                    self._add(jti, exp, now)
+            if rows:
+                self._synced_id = rows[-1][0]
+
+    def start(self):
+        '''Starts the thread that syncs from the store every sync_interval seconds (nothing to do without a store).'''
+        with self._lock:
+            if self.store is None or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._sync_loop, args=(self._stopping,), name="revocation-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 5):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _sync_loop(self, stopping: threading.Event):
+        while not stopping.wait(self.sync_interval):
+            try:
+                self.sync()
+                self.prune()
+                if self._store_prune_due:
+                    self._store_prune_due = False
+                    self.store.prune(time.time())
+            except Exception:
+                logger.exception("Revocation sync failed, retrying")
+
+    def _add(self, jti: str, exp: float, now: float) -> bool:
+        if exp <= now or jti in self._expires:
+            return False
+        # The dict before the filter: a reader that sees the bits always finds the entry.
+        self._expires[jti] = exp
+        heapq.heappush(self._by_exp, (exp, jti))
+        if len(self._expires) > self.filter.capacity:
+            self._rebuild(2 * self.filter.capacity)
+        else:
+            self.filter.add(jti)
+        return True
+
+    def prune(self):
+        with self._lock:
+            self._prune(time.time())
+
+    def _prune(self, now: float):
+        by_exp = self._by_exp
+        while by_exp and by_exp[0][0] <= now:
+            _, jti = heapq.heappop(by_exp)
+            del self._expires[jti]
+            self._expired_since_build += 1
+        if self._expired_since_build and self._expired_since_build * 4 >= len(self._expires) + self._expired_since_build:
+            self._rebuild(self.filter.capacity)
+            # The file is pruned by the sync thread, revoke() doesn't wait for it.
+            self._store_prune_due = self.store is not None
+
+    def _rebuild(self, capacity: int):
+        bloom = BloomFilter(capacity, self.error_rate)
+        for jti in self._expires:
+            bloom.add(jti)
+        self.filter = bloom
+        self._expired_since_build = 0
+        self.rebuilds += 1
+
+    def info(self) -> dict:
+        return {
+            "backend": "memory" if self.store is None else self.store.info(),
+            "revoked": len(self._expires),
+            "capacity": self.filter.capacity,
+            "filter_bytes": len(self.filter.bits),
+            "hashes": self.filter.hashes,
+            "rebuilds": self.rebuilds,
+            "maybe": self.maybe,
+            "false_positives": self.false_positives,
+        }
+
+
+def create_revoked_token_table(connection):
+    # AUTOINCREMENT: ids are never reused, even after the newest rows are pruned, so sync() can't miss a row.
+    connection.exec_driver_sql(
+        '''
+        CREATE TABLE IF NOT EXISTS revoked_token (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti TEXT NOT NULL UNIQUE,
+            exp REAL NOT NULL
+        )
+        '''
+    )
+    connection.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_revoked_token_exp ON revoked_token (exp)")
+
+
+REVOCATION_MIGRATIONS = [
+    create_revoked_token_table,
+]
+
+
+class SQLiteRevocationStore:
+    def __init__(self, path: str, pragmas: dict | None = None):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        for name, value in (DEFAULT_PRAGMAS if pragmas is None else pragmas).items():
+            self._connection.execute(f"PRAGMA {name}={value}")
+        self._lock = threading.Lock()
+
+    def migrate(self) -> int:
+        engine = create_engine(f"sqlite:///{self.path}", poolclass=NullPool)
+        try:
+            return migrate(engine, REVOCATION_MIGRATIONS)
+        finally:
+            engine.dispose()
+
+    def add(self, jti: str, exp: float) -> bool:
+        with self._lock:
+            cursor = self._connection.execute("INSERT OR IGNORE INTO revoked_token (jti, exp) VALUES (?, ?)", (jti, exp))
+            return cursor.rowcount > 0
+
+    def since(self, last_id: int) -> list[tuple[int, str, float]]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT id, jti, exp FROM revoked_token WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+
+    def prune(self, now: float):
+        with self._lock:
+            self._connection.execute("DELETE FROM revoked_token WHERE exp <= ?", (now,))
+
+    def info(self) -> dict:
+        return {"backend": "sqlite", "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def create_revocation_list(path: str | None = None, **options) -> RevocationList:
+    '''
+    path given -> a RevocationList over a SQLiteRevocationStore on that file (migrated here), loaded with what's revoked in it
+    otherwise  -> a RevocationList in this process only
+    options are RevocationList's capacity, error_rate and sync_interval.
+    '''
+    store = None
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        store = SQLiteRevocationStore(path)
+        store.migrate()
+    revocations = RevocationList(store=store, **options)
+    revocations.sync()
+    revocations.start()
+    return revocations
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.pool import NullPool
+from sqlmodel import create_engine
+
+from shared.metrics import CacheStats
+from shared.migrations import migrate
+from shared.sqlite import DEFAULT_PRAGMAS
+
+'''
+User store for the auth modules (full_oauth2.py, simple_oauth2.py):
+get_user used to build a UserInDB (a full Pydantic validation) from a dict on every authenticated request,
+and the users only lived in the hardcoded fake_users_db. Now the auth code asks a repository for a UserRecord,
+a plain object with __slots__ (~90 bytes, no validation), and the Pydantic User is only built for the response.
+
+Two repositories with the same methods (get, add, set_disabled, info), the app doesn't care which one it gets:
+    InMemoryUserRepository  over a dict like fake_users_db, the tutorial setup
+    SQLiteUserRepository    a user table keyed by username, for real numbers of users (millions)
+The user table is WITHOUT ROWID with username as its primary key, so a lookup is one B-tree search that ends on the row itself,
+not a search in an index and then another one in the table. Each thread keeps its own read connection, and sqlite3 keeps
+the compiled lookup statement in that connection's statement cache, so a lookup doesn't parse any SQL either.
+
+CachedUserRepository goes in front of either one: an LRU of records, bounded by max_entries, entries expire after ttl seconds
+(other workers may change a user, that's how long we can miss it). Changes made through it invalidate the user right away,
+with the same generation guard as heroes/cache.py. Misses are not cached, a new user can log in right after being added.
+'''
+
+USER_BY_NAME_SQL = "SELECT username, email, full_name, disabled, hashed_password FROM user WHERE username = ?"
+
+
+class UserRecord:
+    # Treat it as read-only: the same record is handed to every request that hits the cache.
+    __slots__ = ("username", "email", "full_name", "disabled", "hashed_password")
+
+    def __init__(self, username: str, email: str | None, full_name: str | None, disabled: bool, hashed_password: str):
+        self.username = username
+        self.email = email
+        self.full_name = full_name
+        self.disabled = disabled
+        self.hashed_password = hashed_password
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserRecord":
+        return cls(data["username"], data.get("email"), data.get("full_name"), bool(data.get("disabled")), data["hashed_password"])
+
+    @classmethod
+    def from_row(cls, row) -> "UserRecord":
+        username, email, full_name, disabled, hashed_password = row
+        return cls(username, email, full_name, bool(disabled), hashed_password)
+
+    def as_row(self) -> tuple:
+        return self.username, self.email, self.full_name, int(self.disabled), self.hashed_password
+
+
+class InMemoryUserRepository:
+    def __init__(self, users: dict[str, dict]):
+        self.users = users
+
+    def get(self, username: str) -> UserRecord | None:
+        data = self.users.get(username)
+        return None if data is None else UserRecord.from_dict(data)
+
+    def add(self, user: UserRecord):
+        self.users[user.username] = {name: getattr(user, name) for name in UserRecord.__slots__}
+
+    def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        data = self.users.get(username)
+        if data is None:
+            return False
+        data["disabled"] = disabled
+        return True
+
+    def info(self) -> dict:
+        return {"backend": "memory", "users": len(self.users)}
+
+
+def create_user_table(connection):
+    connection.exec_driver_sql(
+        '''
+        CREATE TABLE IF NOT EXISTS user (
+            username TEXT NOT NULL PRIMARY KEY,
+            email TEXT,
+            full_name TEXT,
+            disabled INTEGER NOT NULL DEFAULT 0,
+            hashed_password TEXT NOT NULL
+        ) WITHOUT ROWID
+        '''
+    )
+
+
+USER_MIGRATIONS = [
+    create_user_table,
+]
+
+
+class SQLiteUserRepository:
+    def __init__(self, path: str, pragmas: dict | None = None):
+        self.path = path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer_lock = threading.Lock()
+
+    def _connect(self, query_only: bool = False) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name}={value}")
+        if query_only:
+            connection.execute("PRAGMA query_only=ON")
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def migrate(self) -> int:
+        engine = create_engine(f"sqlite:///{self.path}", poolclass=NullPool)
+        try:
+            return migrate(engine, USER_MIGRATIONS)
+        finally:
+            engine.dispose()
+
+    def get(self, username: str) -> UserRecord | None:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect(query_only=True)
+        row = connection.execute(USER_BY_NAME_SQL, (username,)).fetchone()
+        return None if row is None else UserRecord.from_row(row)
+
+    def add(self, user: UserRecord):
+        self.add_many([user])
+
+    def add_many(self, users):
+        '''Inserts (or replaces) users in one transaction, users can be any iterable of records, for loading millions of them.'''
+        with self._writer_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.executemany(
+                    "INSERT OR REPLACE INTO user (username, email, full_name, disabled, hashed_password) VALUES (?, ?, ?, ?, ?)",
+                    (user.as_row() for user in users),
+                )
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        with self._writer_lock:
+            cursor = self._writer.execute("UPDATE user SET disabled = ? WHERE username = ?", (int(disabled), username))
+            return cursor.rowcount > 0
+
+    def info(self) -> dict:
+        with self._writer_lock:
+            users = self._writer.execute("SELECT count(*) FROM user").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "users": users}
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class CachedUserRepository:
+    def __init__(self, repository, max_entries: int = 100_000, ttl: float = 60.0):
+        self.repository = repository
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[float, UserRecord]] = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> UserRecord | None:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None:
+                if entry[0] >= time.monotonic():
+                    self._entries.move_to_end(username)
+                    self.stats.hits += 1
+                    return entry[1]
+                del self._entries[username]
+            self.stats.misses += 1
+            generation = self._generation
+        user = self.repository.get(username)
+        if user is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[username] = (time.monotonic() + self.ttl, user)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.stats.evictions += 1
+        return user
+
+    def add(self, user: UserRecord):
+        self.repository.add(user)
+        self.invalidate(user.username)
+
+    def set_disabled(self, username: str, disabled: bool = True) -> bool:
+        changed = self.repository.set_disabled(username, disabled)
+        self.invalidate(username)
+        return changed
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._generation += 1
+            self.stats.invalidations += 1
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def info(self) -> dict:
+        return {
+            **self.repository.info(),
+            "cached": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            **self.stats.as_dict(),
+        }
+
+
+def create_user_store(path: str | None = None, users: dict | None = None, **options) -> CachedUserRepository:
+    '''
+    path given -> SQLiteUserRepository on that file (migrated here)
+    otherwise  -> InMemoryUserRepository over `users`
+    Either way behind a CachedUserRepository, options are its max_entries and ttl.
+    '''
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        repository = SQLiteUserRepository(path)
+        repository.migrate()
+    else:
+        repository = InMemoryUserRepository({} if users is None else users)
+    return CachedUserRepository(repository, **options)
@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import run_load, seed_heroes, use_temp_dir
+
+'''
+Threadpool (def) vs async (async def + aiosqlite) hero endpoints.
+Run: python benchmarks/bench_async_vs_threadpool.py --concurrency 500 --requests 20000
+Both paths read random heroes from the same seeded database, the only difference is the session type.
+Requests that fail (for example QueuePool timeouts when the pool is too small) are counted as "errors".
+Use --paths async (or threadpool) to run only one side.
+'''
+
+
+async def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    heroes_app.create_db_and_tables()
+    seed_heroes(heroes_app.sqlite_file_name, args.heroes)
+
+    def reader(prefix):
+        async def make_request(client, i):
+            return await client.get(f"{prefix}/heroes/{i % args.heroes + 1}")
+        return make_request
+
+    results = {}
+    paths = {"threadpool": "", "async": "/async"}
+    for name in args.paths.split(","):
+        prefix = paths[name]
+        # Warm up connections and caches before measuring.
+        await run_load(heroes_app.app, reader(prefix), args.concurrency, args.concurrency)
+        results[name] = await run_load(heroes_app.app, reader(prefix), args.concurrency, args.requests)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heroes", type=int, default=10_000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--paths", default="threadpool,async")
+    asyncio.run(main(parser.parse_args()))
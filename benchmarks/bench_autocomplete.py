@@ -0,0 +1,64 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import seeded_copy, use_temp_dir
+from heroes.analytics import HeroSnapshot
+from heroes.autocomplete import NameIndex
+
+'''
+GET /heroes/autocomplete without HTTP: how long a lookup takes, with and without the hero_change check, and how much memory the names take.
+Run: python benchmarks/bench_autocomplete.py --heroes 1000000 --lookups 20000
+'''
+
+PREFIXES = ("h", "hero 0005", "Hero 000123", "HERO 00099999", "x")
+
+
+def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    seeded_copy(heroes_app.sqlite_file_name, args.heroes, heroes_app.HERO_MIGRATIONS)
+    snapshot = HeroSnapshot(heroes_app.read_engine)
+    index = NameIndex(snapshot)
+
+    started = time.perf_counter()
+    snapshot.refresh()
+    loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    index.sync()
+    built = time.perf_counter() - started
+
+    lookups = {}
+    for prefix in PREFIXES:
+        started = time.perf_counter()
+        for _ in range(args.lookups):
+            index.complete(prefix, args.limit)
+        lookups[prefix] = round((time.perf_counter() - started) / args.lookups * 1e6, 1)
+
+    started = time.perf_counter()
+    for _ in range(args.lookups):
+        snapshot.refresh()
+        index.complete("hero 0005", args.limit)
+    with_refresh = (time.perf_counter() - started) / args.lookups
+
+    print(json.dumps({
+        "heroes": args.heroes,
+        "snapshot_load_s": round(loaded, 2),
+        "index_build_s": round(built, 2),
+        "lookup_us": lookups,
+        "refresh_and_lookup_us": round(with_refresh * 1e6, 1),
+        "memory": index.info(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heroes", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--limit", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlmodel import Session
+
+from benchmarks.common import use_temp_dir
+
+'''
+GET /heroes/changes with many idle subscribers.
+Run: python benchmarks/bench_changes.py --subscribers 5000 --idle 5 --changes 20
+Subscribers read ChangeFeed.stream() directly (no HTTP), so we see what the feed itself costs:
+memory per subscriber, CPU used while nothing happens, and how long one change takes to reach all of them.
+'''
+
+
+async def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    heroes_app.create_db_and_tables()
+    feed = heroes_app.hero_changes
+    await feed.start()
+    received = 0
+    all_received = asyncio.Event()
+
+    async def subscriber():
+        nonlocal received
+        async for frame in feed.stream():
+            if frame.startswith(b"id:"):
+                received += 1
+                if received == args.subscribers:
+                    all_received.set()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tasks = [asyncio.create_task(subscriber()) for _ in range(args.subscribers)]
+    await asyncio.sleep(0.5)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu = time.process_time()
+    await asyncio.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu
+
+    fanout = []
+    for i in range(args.changes):
+        received = 0
+        all_received.clear()
+        started = time.perf_counter()
+        with Session(heroes_app.engine) as session:
+            heroes_app.run_write(session, lambda s: heroes_app.add_hero(s, heroes_app.HeroCreate(name=f"Hero {i}", secret_name="x")))
+        await all_received.wait()
+        fanout.append(time.perf_counter() - started)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await feed.stop()
+    fanout.sort()
+    print(json.dumps({
+        "subscribers": args.subscribers,
+        "bytes_per_subscriber": round((after - before) / args.subscribers),
+        "idle_cpu_percent": round(idle_cpu / args.idle * 100, 2),
+        "fanout_p50_ms": round(fanout[len(fanout) // 2] * 1000, 2),
+        "fanout_max_ms": round(fanout[-1] * 1000, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--idle", type=float, default=5)
+    parser.add_argument("--changes", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from benchmarks.common import run_load, seeded_copy, use_temp_dir
+from heroes.pagination import encode_cursor
+
+'''
+The hero CRUD endpoints of sec_ver_SQLModel.py under load, on seeded databases of any size.
+Run: python benchmarks/bench_crud.py --heroes 10000 1000000 --concurrency 16 --requests 2000 --output crud.json
+Then after a change: python benchmarks/bench_crud.py ... --output crud-new.json --compare crud.json
+
+For each database size we start from a fresh copy of a seeded file (benchmarks/common.py seeded_copy, built once and cached)
+and drive every operation through the app in-process (httpx.ASGITransport), `concurrency` clients at a time:
+    create              POST /heroes/
+    read_hero           GET /heroes/{id}, random ids (the hero cache is on, like in production)
+    read_heroes         GET /heroes/?limit=100, the first page
+    read_heroes_offset  GET /heroes/?offset=<half the heroes>&limit=100, a deep page the slow way
+    read_heroes_cursor  GET /heroes/?cursor=<half the heroes>&limit=100, the same deep page with a cursor
+    update_hero         PATCH /heroes/{id}
+    delete_hero         DELETE /heroes/{id}
+Each one reports requests per second and p50/p95/p99 latency (client side, in ms).
+Then `--alloc-requests` more of each run one at a time under tracemalloc: the peak memory a request allocates
+on top of what was there before (alloc_peak_kib), and what it leaves behind (retained_bytes, should stay close to 0).
+tracemalloc slows everything down, that's why it's a separate pass that doesn't touch the latencies.
+
+The JSON output has the commit, the Python and SQLite versions and the arguments next to the numbers,
+--compare prints the change of req/s and p99 per operation against an older file.
+'''
+
+
+def make_operations(heroes: int, requests: int, rng: random.Random) -> dict:
+    # update and delete each get their own ids, so every delete finds its hero.
+    ids = rng.sample(range(1, heroes + 1), min(heroes, 2 * requests))
+    update_ids, delete_ids = ids[: len(ids) // 2], ids[len(ids) // 2:]
+    middle = heroes // 2
+    middle_cursor = encode_cursor("id", False, middle, middle)
+
+    return {
+        "create": lambda client, i: client.post(
+            "/heroes/", json={"name": f"Bench Hero {i}", "secret_name": "x", "age": i % 100}
+        ),
+        "read_hero": lambda client, i: client.get(f"/heroes/{rng.randint(1, heroes)}"),
+        "read_heroes": lambda client, i: client.get("/heroes/", params={"limit": 100}),
+        "read_heroes_offset": lambda client, i: client.get("/heroes/", params={"offset": middle, "limit": 100}),
+        "read_heroes_cursor": lambda client, i: client.get("/heroes/", params={"cursor": middle_cursor, "limit": 100}),
+        "update_hero": lambda client, i: client.patch(f"/heroes/{update_ids[i % len(update_ids)]}", json={"age": i % 100}),
+        "delete_hero": lambda client, i: client.delete(f"/heroes/{delete_ids[i % len(delete_ids)]}"),
+    }
+
+
+async def measure_allocations(app, make_request, requests: int) -> dict:
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await make_request(client, 0)  # warm up: imports, caches, the first connection
+        peaks, retained = [], []
+        tracemalloc.start()
+        try:
+            for i in range(1, requests + 1):
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                await make_request(client, i)
+                after, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - before)
+                retained.append(after - before)
+        finally:
+            tracemalloc.stop()
+    return {
+        "alloc_peak_kib": round(sum(peaks) / len(peaks) / 1024, 1),
+        "retained_bytes": round(sum(retained) / len(retained)),
+    }
+
+
+def reset_app(heroes_app):
+    # A new database file under the same name: drop the open connections and whatever was cached from the old one.
+    heroes_app.engine.dispose()
+    heroes_app.read_engine.dispose()
+    heroes_app.hero_cache.clear()
+
+
+def run_size(heroes_app, heroes: int, args) -> dict:
+    reset_app(heroes_app)
+    seconds = seeded_copy(heroes_app.sqlite_file_name, heroes, heroes_app.HERO_MIGRATIONS, args.seed_dir)
+    print(f"{heroes} heroes ready in {seconds:.1f}s", file=sys.stderr)
+    results = {}
+    for name, make_request in make_operations(heroes, args.requests + args.alloc_requests + 1, random.Random(args.seed)).items():
+        if args.only and name not in args.only:
+            continue
+        result = asyncio.run(run_load(heroes_app.app, make_request, args.concurrency, args.requests))
+        if args.alloc_requests:
+            # Continue with the next ids, the update and delete ids used above are gone.
+            shifted = lambda client, i, make_request=make_request: make_request(client, args.requests + i)
+            result.update(asyncio.run(measure_allocations(heroes_app.app, shifted, args.alloc_requests)))
+        results[name] = result
+        print(f"  {name}: {result}", file=sys.stderr)
+    return results
+
+
+def environment(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+    }
+
+
+def compare(old: dict, new: dict):
+    print(f"{'heroes':>9} {'operation':<20} {'req/s':>10} {'change':>8} {'p99 ms':>9} {'change':>8}")
+    for heroes, operations in new["results"].items():
+        for name, result in operations.items():
+            before = old["results"].get(heroes, {}).get(name)
+            if before is None:
+                continue
+            rate = (result["req_per_s"] / before["req_per_s"] - 1) * 100 if before["req_per_s"] else 0.0
+            p99 = (result["p99_ms"] / before["p99_ms"] - 1) * 100 if before["p99_ms"] else 0.0
+            print(f"{heroes:>9} {name:<20} {result['req_per_s']:>10} {rate:>+7.1f}% {result['p99_ms']:>9} {p99:>+7.1f}%")
+
+
+def main(args):
+    # use_temp_dir() changes the current directory, the paths given on the command line are relative to the old one.
+    output, baseline = (Path(path).resolve() if path else None for path in (args.output, args.compare))
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    report = {
+        "environment": environment(args),
+        "results": {str(heroes): run_size(heroes_app, heroes, args) for heroes in args.heroes},
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text + "\n")
+    else:
+        print(text)
+    if baseline:
+        compare(json.loads(baseline.read_text()), report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heroes", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--alloc-requests", type=int, default=200)
+    parser.add_argument("--only", nargs="+", help="Run only these operations")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--seed-dir", type=lambda path: str(Path(path).resolve()), help="Where the seeded databases are kept (default: <tmp>/hero-bench-seeds)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="An older JSON results file to compare with")
+    main(parser.parse_args())
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import seed_heroes, use_temp_dir
+
+'''
+GET /heroes/export throughput and memory.
+Run: python benchmarks/bench_export.py --heroes 1000000 --format ndjson
+The app is called as a plain ASGI callable and the body chunks are counted and dropped,
+(httpx.ASGITransport would keep the whole body in memory and hide what the endpoint itself uses).
+Peak RSS is reported after seeding and after the export. Note that RSS also counts the database pages SQLite reads through mmap
+(mmap_size in heroes/db.py), so it grows with the file size even though the Python heap doesn't: python_heap_peak_mib
+(tracemalloc, measured on a second full export) is the number that must stay flat as the table grows.
+'''
+
+
+def peak_rss_mib() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def export(app, format: str, stop_after_bytes: int | None = None) -> dict:
+    stats = {"status": None, "chunks": 0, "bytes": 0, "lines": 0}
+    disconnected = asyncio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            stats["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            stats["chunks"] += 1
+            stats["bytes"] += len(body)
+            stats["lines"] += body.count(b"\n")
+            if stop_after_bytes is not None and stats["bytes"] >= stop_after_bytes:
+                disconnected.set()
+                raise OSError("client went away")
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/heroes/export", "raw_path": b"/heroes/export",
+        "query_string": f"format={format}".encode(), "headers": [], "server": ("bench", 80),
+        "client": ("bench", 1234), "root_path": "",
+    }
+    try:
+        await app(scope, receive, send)
+    except OSError:
+        pass
+    return stats
+
+
+async def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    heroes_app.create_db_and_tables()
+    seed_heroes(heroes_app.sqlite_file_name, args.heroes)
+    rss_before = peak_rss_mib()
+
+    started = time.perf_counter()
+    stats = await export(heroes_app.app, args.format)
+    elapsed = time.perf_counter() - started
+    rows = stats["lines"] - (1 if args.format == "csv" else 0)
+
+    tracemalloc.start()
+    await export(heroes_app.app, args.format)
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    aborted = await export(heroes_app.app, args.format, stop_after_bytes=1_000_000)
+    print(json.dumps({
+        "format": args.format,
+        "rows": rows,
+        "megabytes": round(stats["bytes"] / 1e6, 1),
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(rows / elapsed),
+        "peak_rss_mib_before_export": rss_before,
+        "peak_rss_mib_after_export": peak_rss_mib(),
+        "python_heap_peak_mib": round(heap_peak / 2**20, 2),
+        "disconnect_after_1mb_sent_bytes": aborted["bytes"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--heroes", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,71 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlmodel import Session, SQLModel
+
+from benchmarks.common import use_temp_dir
+from heroes.db import create_reader_writer_engines
+from heroes.writer import GroupCommitWriter
+from shared.sqlite import DEFAULT_PRAGMAS
+
+'''
+Sustained hero creates per second: one transaction per create vs group commit.
+Run: python benchmarks/bench_group_commit.py --threads 64 --ops 5000 --synchronous FULL
+synchronous=FULL makes every commit wait for fsync, that's where group commit helps the most.
+retried_batches counts the batches that had a failing operation and ran again with a SAVEPOINT per operation (see heroes/writer.py).
+'''
+
+
+def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    pragmas = {**DEFAULT_PRAGMAS, "synchronous": args.synchronous}
+    results = {}
+    for mode in ("per_request", "group_commit"):
+        engine, _ = create_reader_writer_engines(f"{mode}.db", readers=1, pragmas=pragmas)
+        SQLModel.metadata.create_all(engine)
+        writer = GroupCommitWriter(engine, max_batch=args.max_batch, max_delay_ms=args.max_delay_ms)
+
+        def create(i):
+            operation = lambda session: heroes_app.add_hero(
+                session, heroes_app.HeroCreate(name=f"Hero {i}", secret_name="x")
+            )
+            if mode == "group_commit":
+                return writer.run(operation)
+            with Session(engine, expire_on_commit=False) as session:
+                hero = operation(session)
+                session.commit()
+                return hero
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(create, range(args.ops)))
+        elapsed = time.perf_counter() - started
+        writer.stop()
+        results[mode] = {
+            "ops": args.ops,
+            "seconds": round(elapsed, 3),
+            "ops_per_s": round(args.ops / elapsed, 1),
+            "transactions": writer.batches if mode == "group_commit" else args.ops,
+            "retried_batches": writer.retried_batches,
+        }
+        engine.dispose()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-delay-ms", type=float, default=2.0)
+    parser.add_argument("--synchronous", default="FULL")
+    main(parser.parse_args())
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import run_load, use_temp_dir
+from heroes.idempotency import IdempotencyStore
+
+'''
+What an Idempotency-Key costs on the happy path (a new key every time) and what a replay costs.
+Run: python benchmarks/bench_idempotency.py --ops 100000 --requests 3000 --concurrency 32
+First the store alone (claim + complete, µs per key, bytes per key when full), then POST /heroes/ through the app:
+without the header, with a new key per request, and replays of keys that are already stored.
+'''
+
+BODY = b'{"name":"Deadpond","age":null,"secret_name":"Dive Wilson"}'
+RESPONSE = b'{"name":"Deadpond","age":null,"id":123456}'
+
+
+def bench_store(ops: int) -> dict:
+    store = IdempotencyStore(max_entries=ops // 2)
+    keys = [f"key-{i:012d}" for i in range(ops)]
+
+    started = time.perf_counter()
+    for key in keys:
+        _, entry, _ = store.claim(key, BODY)
+        store.complete(entry, 200, RESPONSE)
+    new_keys = time.perf_counter() - started
+
+    replayed = keys[-(ops // 2):]
+    started = time.perf_counter()
+    for key in replayed:
+        store.claim(key, BODY)
+    replays = time.perf_counter() - started
+
+    tracemalloc.start()
+    full = IdempotencyStore(max_entries=ops)
+    for key in keys:
+        _, entry, _ = full.claim(key, BODY)
+        full.complete(entry, 200, RESPONSE)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "new_key_us": round(new_keys / ops * 1e6, 2),
+        "replay_us": round(replays / len(replayed) * 1e6, 2),
+        "bytes_per_key": round(size / ops),
+    }
+
+
+async def bench_app(requests: int, concurrency: int) -> dict:
+    import sec_ver_SQLModel as heroes_app
+
+    heroes_app.create_db_and_tables()
+    hero = {"name": "Deadpond", "secret_name": "Dive Wilson"}
+
+    def post(headers):
+        return lambda client, i: client.post("/heroes/", json=hero, headers=headers(i))
+
+    return {
+        "no_key": await run_load(heroes_app.app, post(lambda i: {}), concurrency, requests),
+        "new_key": await run_load(heroes_app.app, post(lambda i: {"Idempotency-Key": f"new-{i}"}), concurrency, requests),
+        "replay": await run_load(heroes_app.app, post(lambda i: {"Idempotency-Key": f"new-{i}"}), concurrency, requests),
+    }
+
+
+def main(args):
+    use_temp_dir()
+    results = {"store": bench_store(args.ops), "app": asyncio.run(bench_app(args.requests, args.concurrency))}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    main(parser.parse_args())
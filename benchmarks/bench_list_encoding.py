@@ -0,0 +1,66 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlmodel import Session, select
+
+from benchmarks.common import seed_heroes, use_temp_dir
+
+'''
+Micro-benchmark of a GET /heroes/ page: Hero objects + response_model validation (the old way) vs column rows encoded straight to JSON (the app now).
+Run: python benchmarks/bench_list_encoding.py --limit 100 --rounds 2000
+Both sides include the SELECT, so the numbers are per page, like one request without the HTTP part.
+'''
+
+
+def measure(page, rounds: int) -> dict:
+    body = page()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        page()
+    elapsed = time.perf_counter() - started
+    return {"us_per_page": round(elapsed / rounds * 1e6, 1), "bytes": len(body)}
+
+
+def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+    from heroes.encoding import orjson, rows_to_json
+
+    heroes_app.create_db_and_tables()
+    seed_heroes(heroes_app.sqlite_file_name, args.limit)
+    params = heroes_app.HeroListParams(limit=args.limit)
+    heroes_list = TypeAdapter(list[heroes_app.HeroPublic])
+
+    def model_page():
+        with Session(heroes_app.read_engine) as session:
+            heroes = session.exec(select(heroes_app.Hero).limit(args.limit)).all()
+            heroes = heroes_list.validate_python([heroes_app.HeroPublic.model_validate(hero) for hero in heroes])
+            return JSONResponse(jsonable_encoder(heroes)).body
+
+    def direct_page():
+        with Session(heroes_app.read_engine) as session:
+            statement, _, _ = heroes_app.heroes_statement(params)
+            rows = session.exec(statement).all()
+            return rows_to_json(rows, heroes_app.HERO_PUBLIC_FIELDS)
+
+    assert model_page() == direct_page()
+    print(json.dumps({
+        "orjson": orjson is not None,
+        "response_model": measure(model_page, args.rounds),
+        "direct": measure(direct_page, args.rounds),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=2000)
+    main(parser.parse_args())
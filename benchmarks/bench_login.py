@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from benchmarks.common import percentile
+
+'''
+What logins do to everybody else: GET /users/me/ latency in full_oauth2.py while POST /token is under load.
+Run: python benchmarks/bench_login.py --logins 8 --requests 2000 --rate 500
+For each mode we measure /users/me/ alone, then again while `--logins` clients keep logging in:
+    inline  bcrypt called right in the async endpoint, like before (it blocks the event loop for every check)
+    pool    bcrypt on password_pool (auth/hashing.py), the event loop keeps serving /users/me/
+The login clients report logins per second, their latency and how many were refused because the pool's queue was full.
+The per IP and per username login limits are lifted here, this measures the pool.
+
+The clients run on the same event loop as the app (httpx.ASGITransport), so a blocked loop stops their clock too.
+That's why /users/me/ is sent at a fixed rate and each latency is counted from when the request was due, not from when it left.
+'''
+
+
+class InlineHashing:
+    # The old behaviour, for comparison: the check runs on the event loop.
+    async def run(self, job, function, *args):
+        return function(*args)
+
+
+async def login_load(app, clients: int, stop: asyncio.Event) -> dict:
+    latencies, rejected = [], 0
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def login():
+            nonlocal rejected
+            while not stop.is_set():
+                started = time.perf_counter()
+                response = await client.post("/token", data={"username": "johndoe", "password": "secret"})
+                if response.status_code in (429, 503):
+                    rejected += 1
+                    await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+                    continue
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "logins": len(latencies),
+        "logins_per_s": round(len(latencies) / elapsed, 1),
+        "rejected": rejected,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+async def paced_load(app, token: str, rate: float, total: int) -> dict:
+    latencies, errors = [], 0
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=None) as client:
+        async def request(due: float):
+            nonlocal errors
+            response = await client.get("/users/me/", headers={"Authorization": f"Bearer {token}"})
+            latencies.append(time.perf_counter() - due)
+            errors += response.status_code >= 400
+
+        started = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            due = started + i / rate
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(request(due)))
+        await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "requests": total,
+        "rate": rate,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+async def measure(app, token: str, args) -> dict:
+    alone = await paced_load(app, token, args.rate, args.requests)
+
+    stop = asyncio.Event()
+    logins = asyncio.ensure_future(login_load(app, args.logins, stop))
+    await asyncio.sleep(args.warmup)
+    loaded = await paced_load(app, token, args.rate, args.requests)
+    stop.set()
+    return {"users_me_alone": alone, "users_me_during_logins": loaded, "token": await logins}
+
+
+def main(args):
+    os.environ.setdefault("LOGIN_ATTEMPTS_PER_IP", "1000000000")
+    os.environ.setdefault("LOGIN_ATTEMPTS_PER_USER", "1000000000")
+    import full_oauth2
+
+    token = full_oauth2.create_access_token({"sub": "johndoe"}, timedelta(minutes=30))
+    pool = full_oauth2.password_pool
+    results = {}
+    for mode in args.modes:
+        full_oauth2.password_pool = InlineHashing() if mode == "inline" else pool
+        results[mode] = asyncio.run(measure(full_oauth2.app, token, args))
+    if "pool" in results:
+        results["pool"]["metrics"] = pool.info()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", choices=["inline", "pool"], default=["inline", "pool"])
+    parser.add_argument("--logins", type=int, default=8, help="Clients logging in continuously")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="/users/me/ requests per second")
+    parser.add_argument("--warmup", type=float, default=0.5, help="Seconds of login load before measuring")
+    main(parser.parse_args())
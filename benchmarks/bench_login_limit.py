@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx
+
+from benchmarks.common import percentile
+from auth.ratelimit import LoginLimiter, TokenBuckets
+
+'''
+The login limiter of full_oauth2.py (auth/ratelimit.py): what a check costs, and what it does to a credential-stuffing burst.
+Run: python benchmarks/bench_login_limit.py --attackers 64 --ips 8 --seconds 10
+First LoginLimiter.check() alone, µs per check: allowed ones, refused ones, and with --keys buckets in memory.
+Then POST /token under attack, once with the limits lifted and once with the app's defaults:
+--attackers clients from --ips addresses send wrong passwords for johndoe and for other users as fast as they can,
+while one user on their own address logs in with the right password once a second.
+We report the status codes the attack and the user got, how many bcrypt checks ran, and the user's login latency.
+Half the attack goes at johndoe, so with the limits on, the user is refused too (429) once johndoe's bucket is empty:
+that's what a per username limit does, it protects the account at the price of locking its owner out for a while.
+'''
+
+
+def bench_checks(keys: int, checks: int) -> dict:
+    limiter = LoginLimiter(TokenBuckets(1e9, 10**9, max_keys=keys * 2), TokenBuckets(1e9, 10**9, max_keys=keys * 2))
+    for i in range(keys):
+        limiter.check(f"user{i}", f"10.0.{i // 256 % 256}.{i % 256}")
+    names = [(f"user{random.randrange(keys)}", f"10.0.0.{random.randrange(256)}") for _ in range(checks)]
+
+    started = time.perf_counter()
+    for username, ip in names:
+        limiter.check(username, ip)
+    allowed = time.perf_counter() - started
+
+    refused_limiter = LoginLimiter(TokenBuckets(0.001, 1), TokenBuckets(0.001, 1))
+    refused_limiter.check("user", "10.0.0.1")
+    started = time.perf_counter()
+    for _ in range(checks):
+        try:
+            refused_limiter.check("user", "10.0.0.1")
+        except Exception:
+            pass
+    refused = time.perf_counter() - started
+    return {
+        "keys": keys,
+        "us_per_allowed_check": round(allowed / checks * 1e6, 2),
+        "us_per_refused_check": round(refused / checks * 1e6, 2),
+    }
+
+
+async def attack(app, args) -> dict:
+    import full_oauth2
+
+    statuses, user_latencies = {}, []
+    stop = time.perf_counter() + args.seconds
+    completed = full_oauth2.password_pool.completed
+
+    def client_for(ip: str):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False, client=(ip, 50000))
+        return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+
+    async def attacker(number: int):
+        async with client_for(f"203.0.113.{number % args.ips}") as client:
+            while time.perf_counter() < stop:
+                username = "johndoe" if random.random() < 0.5 else f"user{random.randrange(1000)}"
+                response = await client.post("/token", data={"username": username, "password": f"guess{random.random()}"})
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                await asyncio.sleep(0)
+
+    async def user():
+        async with client_for("198.51.100.7") as client:
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                response = await client.post("/token", data={"username": "johndoe", "password": "secret"})
+                user_latencies.append((time.perf_counter() - started, response.status_code))
+                await asyncio.sleep(1)
+
+    await asyncio.gather(user(), *(attacker(i) for i in range(args.attackers)))
+    latencies = sorted(seconds for seconds, _ in user_latencies)
+    return {
+        "attack_statuses": dict(sorted(statuses.items())),
+        "bcrypt_checks": full_oauth2.password_pool.completed - completed,
+        "user_statuses": dict(sorted(Counter(code for _, code in user_latencies).items())),
+        "user_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "user_max_ms": round(latencies[-1] * 1000, 1),
+        "limiter": full_oauth2.login_limiter.info(),
+    }
+
+
+def main(args):
+    import full_oauth2
+
+    results = {"checks": bench_checks(args.keys, args.checks)}
+    limiter = full_oauth2.login_limiter
+    for mode in args.modes:
+        if mode == "off":
+            full_oauth2.login_limiter = LoginLimiter(TokenBuckets(1e9, 10**9), TokenBuckets(1e9, 10**9))
+        else:
+            full_oauth2.login_limiter = limiter
+        results[mode] = asyncio.run(attack(full_oauth2.app, args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", choices=["off", "on"], default=["off", "on"])
+    parser.add_argument("--attackers", type=int, default=64)
+    parser.add_argument("--ips", type=int, default=8, help="Addresses the attackers share")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--keys", type=int, default=100_000, help="Buckets in memory for the check timings")
+    parser.add_argument("--checks", type=int, default=200_000)
+    main(parser.parse_args())
@@ -0,0 +1,109 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from benchmarks.common import use_temp_dir
+
+'''
+Micro-benchmark of the hero mutations: the old ORM way vs the single statement RETURNING way the app uses now.
+Run: python benchmarks/bench_mutations.py --ops 5000
+Each operation runs in its own session and transaction, like one request, and we count the SQL statements it sends.
+'''
+
+
+def orm_create(session, heroes_app, hero):
+    db_hero = heroes_app.Hero.model_validate(hero)
+    session.add(db_hero)
+    session.commit()
+    session.refresh(db_hero)
+    return heroes_app.HeroPublic.model_validate(db_hero)
+
+
+def orm_update(session, heroes_app, hero_id, hero):
+    hero_db = session.get(heroes_app.Hero, hero_id)
+    hero_db.sqlmodel_update(hero.model_dump(exclude_unset=True))
+    session.add(hero_db)
+    session.commit()
+    session.refresh(hero_db)
+    return heroes_app.HeroPublic.model_validate(hero_db)
+
+
+def orm_delete(session, heroes_app, hero_id):
+    hero = session.get(heroes_app.Hero, hero_id)
+    session.delete(hero)
+    session.commit()
+
+
+def fast_create(session, heroes_app, hero):
+    result = heroes_app.add_hero(session, hero)
+    session.commit()
+    return result
+
+
+def fast_update(session, heroes_app, hero_id, hero):
+    result = heroes_app.change_hero(session, hero_id, hero)
+    session.commit()
+    return result
+
+
+def fast_delete(session, heroes_app, hero_id):
+    heroes_app.remove_hero(session, hero_id)
+    session.commit()
+
+
+def measure(engine, operations, ops: int) -> dict:
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    started = time.perf_counter()
+    for i in range(ops):
+        with Session(engine) as session:
+            operations(session, i)
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count)
+    return {
+        "us_per_op": round(elapsed / ops * 1e6, 1),
+        "ops_per_s": round(ops / elapsed),
+        "statements_per_op": round(statements / ops, 2),
+    }
+
+
+def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+
+    heroes_app.create_db_and_tables()
+    engine = heroes_app.engine
+    hero = heroes_app.HeroCreate(name="Deadpond", secret_name="Dive Wilson")
+    change = heroes_app.HeroUpdate(age=30)
+
+    results = {}
+    for path, (create, update, remove) in {
+        "orm": (orm_create, orm_update, orm_delete),
+        "fast": (fast_create, fast_update, fast_delete),
+    }.items():
+        ids = []
+        results[path] = {
+            "create": measure(engine, lambda s, i: ids.append(create(s, heroes_app, hero).id), args.ops),
+            "update": measure(engine, lambda s, i: update(s, heroes_app, ids[i], change), args.ops),
+            "delete": measure(engine, lambda s, i: remove(s, heroes_app, ids[i]), args.ops),
+        }
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=5000)
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlmodel import Session
+
+from benchmarks.common import use_temp_dir
+from heroes.sharding import ShardSet, keyset_merge
+from shared.sqlite import DEFAULT_PRAGMAS
+
+'''
+Hero creates per second with the heroes spread over 1, 2, 4, 8 SQLite files (see heroes/sharding.py).
+Run: python benchmarks/bench_sharding.py --shards 1 2 4 8 --threads 32 --ops 4000 --synchronous FULL
+Each create is its own transaction on the shard its id maps to, like POST /heroes/ in sharded_SQLModel.py.
+With synchronous=FULL every commit waits for fsync: one file does one commit at a time, N files do N.
+Then a list page (scatter-gather over all shards) to see what the fan out costs the reads.
+'''
+
+
+def main(args):
+    use_temp_dir()
+    import sec_ver_SQLModel as heroes_app
+    import sharded_SQLModel
+
+    pragmas = {**DEFAULT_PRAGMAS, "synchronous": args.synchronous}
+    results = {}
+    for count in args.shards:
+        shards = ShardSet(f"shards-{count}", count, pragmas=pragmas, readers=args.threads)
+        shards.migrate(heroes_app.HERO_MIGRATIONS)
+
+        def create(i):
+            hero_id = shards.ids.allocate()
+            with Session(shards.writer(hero_id)) as session:
+                sharded_SQLModel.add_hero_with_id(
+                    session, hero_id, heroes_app.HeroCreate(name=f"Hero {i}", secret_name="x", age=i % 100)
+                )
+                session.commit()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(create, range(args.ops)))
+        elapsed = time.perf_counter() - started
+
+        statement, order_by, descending = heroes_app.heroes_statement(heroes_app.HeroListParams(order_by="age"))
+
+        def read_shard(reader):
+            with reader.connect() as connection:
+                return connection.execute(statement).all()
+
+        list_started = time.perf_counter()
+        for _ in range(args.pages):
+            keyset_merge(shards.scatter(read_shard), order_by, descending, 100)
+        list_elapsed = time.perf_counter() - list_started
+
+        results[f"{count}_shards"] = {
+            "ops": args.ops,
+            "seconds": round(elapsed, 3),
+            "creates_per_s": round(args.ops / elapsed, 1),
+            "list_page_ms": round(list_elapsed / args.pages * 1000, 3),
+        }
+        shards.dispose()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=4000)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--synchronous", default="FULL")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+import argparse
+import json
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.common import use_temp_dir
+from auth.users import CachedUserRepository, SQLiteUserRepository, UserRecord
+
+'''
+What a user lookup costs in the auth modules, with millions of users.
+Run: python benchmarks/bench_users.py --users 5000000 --lookups 200000
+    dict + UserInDB   the old get_user: a dict lookup and a Pydantic model per call
+    sqlite            SQLiteUserRepository alone, a primary key lookup per call
+    cached            CachedUserRepository in front of it, lookups of a hot set of --hot users
+And the memory of one cached record against one UserInDB.
+The users are generated inside SQLite (a recursive CTE), loading 5M of them takes about 20 s.
+'''
+
+SEED_USERS_SQL = """
+    WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1)
+    INSERT INTO user (username, email, full_name, disabled, hashed_password)
+    SELECT printf('user%08d', i), printf('user%08d@example.com', i), 'User ' || i, i % 50 = 0,
+           '$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW' FROM n
+"""
+
+
+def per_lookup_us(function, names) -> float:
+    started = time.perf_counter()
+    for name in names:
+        function(name)
+    return round((time.perf_counter() - started) / len(names) * 1e6, 2)
+
+
+def main(args):
+    from full_oauth2 import UserInDB
+
+    use_temp_dir()
+    repository = SQLiteUserRepository("users.db")
+    repository.migrate()
+    started = time.perf_counter()
+    connection = sqlite3.connect("users.db")
+    connection.execute(SEED_USERS_SQL, (args.users,))
+    connection.commit()
+    connection.close()
+    seeded = time.perf_counter() - started
+
+    rng = random.Random(42)
+    names = [f"user{rng.randrange(args.users):08d}" for _ in range(args.lookups)]
+    hot = [f"user{rng.randrange(args.users):08d}" for _ in range(args.hot)]
+    hot_names = [rng.choice(hot) for _ in range(args.lookups)]
+
+    # The old store, for the names we look up.
+    users = {
+        name: {
+            "username": name, "email": f"{name}@example.com", "full_name": "User", "disabled": False,
+            "hashed_password": "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW",
+        }
+        for name in set(names)
+    }
+
+    def dict_lookup(name):
+        if name in users:
+            return UserInDB(**users[name])
+
+    cached = CachedUserRepository(repository, max_entries=args.hot * 2)
+    for name in hot:
+        cached.get(name)
+
+    def bytes_per_user(build) -> int:
+        rows = [repository.get(name).as_row() for name in hot[:1000]]
+        tracemalloc.start()
+        built = [build(row) for row in rows]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return round(size / len(built))
+
+    results = {
+        "users": args.users,
+        "seed_seconds": round(seeded, 1),
+        "file_mib": round(Path("users.db").stat().st_size / 2**20, 1),
+        "us_per_lookup": {
+            "dict + UserInDB": per_lookup_us(dict_lookup, names),
+            "sqlite": per_lookup_us(repository.get, names),
+            "cached": per_lookup_us(cached.get, hot_names),
+        },
+        "bytes_per_user": {
+            "UserRecord": bytes_per_user(UserRecord.from_row),
+            "UserInDB": bytes_per_user(lambda row: UserInDB(**dict(zip(UserRecord.__slots__, row)))),
+        },
+        "cache": cached.info(),
+    }
+    repository.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--hot", type=int, default=10_000, help="Users that keep coming back, for the cached lookups")
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import httpx
+
+'''
+Shared helpers for the benchmark scripts.
+Every benchmark runs the app in-process through httpx.ASGITransport, so we measure the app (routing, validation, SQL) and not the network.
+The apps open "database.db" relative to the current directory, so use_temp_dir() moves us to an empty folder before the app is imported.
+'''
+
+
+def use_temp_dir() -> str:
+    path = tempfile.mkdtemp(prefix="hero-bench-")
+    os.chdir(path)
+    return path
+
+
+def seed_heroes(sqlite_file_name: str, count: int, batch: int = 50_000):
+    # Fast bulk load: one transaction per batch, no fsync, executemany.
+    conn = sqlite3.connect(sqlite_file_name)
+    conn.execute("PRAGMA synchronous=OFF")
+    for start in range(0, count, batch):
+        rows = [
+            (f"Hero {i:09d}", i % 100 or None, f"Secret {i}")
+            for i in range(start, min(start + batch, count))
+        ]
+        conn.executemany("INSERT INTO hero (name, age, secret_name) VALUES (?, ?, ?)", rows)
+        conn.commit()
+    conn.close()
+
+
+SEED_HEROES_SQL = """
+    WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+    INSERT INTO hero (id, name, age, secret_name)
+    SELECT i, printf('Hero %09d', i), nullif(i % 100, 0), 'Secret ' || i FROM n
+"""
+
+
+def seed_database(sqlite_file_name: str, count: int, migrations: list, batch: int = 1_000_000):
+    '''
+    A new database with `count` heroes, made for the big ones (10M heroes in a couple of minutes).
+    The rows are generated inside SQLite by a recursive CTE, so no Python tuple is built per hero.
+    Only the first migration (the hero table) runs before the load, the others run after it:
+    the FTS index is built in one 'rebuild' instead of a trigger per row, and the change log starts empty.
+    '''
+    from sqlalchemy import create_engine
+
+    from shared.migrations import migrate
+
+    engine = create_engine(f"sqlite:///{sqlite_file_name}")
+    with engine.begin() as connection:
+        migrations[0](connection)
+    engine.dispose()
+
+    conn = sqlite3.connect(sqlite_file_name)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    for start in range(1, count + 1, batch):
+        conn.execute(SEED_HEROES_SQL, (start, min(start + batch, count + 1) - 1))
+        conn.commit()
+    conn.close()
+
+    migrate(create_engine(f"sqlite:///{sqlite_file_name}"), migrations)
+    conn = sqlite3.connect(sqlite_file_name)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def seeded_copy(sqlite_file_name: str, count: int, migrations: list, cache_dir: str | None = None) -> float:
+    '''
+    Copies a seeded database with `count` heroes to sqlite_file_name, building it first if it's not in cache_dir yet.
+    The benchmarks change the heroes, so every run starts from a fresh copy of the same file. Returns the seconds it took.
+    '''
+    started = time.perf_counter()
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "hero-bench-seeds")
+    os.makedirs(cache_dir, exist_ok=True)
+    seed = os.path.join(cache_dir, f"heroes-{count}-v{len(migrations)}.db")
+    if not os.path.exists(seed):
+        building = f"{seed}.{os.getpid()}.tmp"
+        seed_database(building, count, migrations)
+        os.replace(building, seed)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(sqlite_file_name + suffix):
+            os.remove(sqlite_file_name + suffix)
+    shutil.copyfile(seed, sqlite_file_name)
+    return time.perf_counter() - started
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_load(app, make_request, concurrency: int, total: int) -> dict:
+    '''
+    Fire `total` requests from `concurrency` concurrent clients.
+    make_request(client, i) must return an awaitable httpx response.
+    '''
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                start = time.perf_counter()
+                response = await make_request(client, i)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "req_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
@@ -1,17 +1,28 @@
+import os
+import secrets
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 import jwt                                                                                      # ii- for creating and verifying JWT tokens
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Form, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError
 from passlib.context import CryptContext                            # i- for hashing passwords - This is what will be used to hash and verify passwords.
 from pydantic import BaseModel
 
+from auth.claims import ClaimsCache                                 # vi- for skipping the JWT verification of tokens we already verified
+from auth.hashing import HashingPool                                # v- for running bcrypt off the event loop, on its own bounded pool
+from auth.ratelimit import LoginLimiter, create_buckets             # viii- for refusing brute-force logins before they cost a bcrypt check
+from auth.revocation import create_revocation_list                  # ix- for revoking tokens by jti, checked through a Bloom filter
+from auth.users import UserRecord, create_user_store                # vii- for looking users up in a real store, through a cache of compact records
+
 # to get a string like this SECRET_KEY run in the terminal: openssl rand -hex 32                # ii- for generating a random secret key
 SECRET_KEY = "704d4fd29ebf8f5a3c5112f581b05deb7dc4db659194606da691cf233aabe810" # Change this when testing.      
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))  # ix- how long a client can get new access tokens without the password
 
 
 fake_users_db = {
@@ -28,6 +39,7 @@ fake_users_db = {
 class Token(BaseModel):                                                                         # ii- for creating a token type                                    
     access_token: str
     token_type: str
+    refresh_token: str | None = None                                # ix- send it to POST /token/refresh for a new access token
 
 
 class TokenData(BaseModel):                                                                     
@@ -45,10 +57,57 @@ class UserInDB(User):
     hashed_password: str
 
 
+# vii- the users: fake_users_db by default, or a SQLite file of users (USERS_DATABASE=users.db), both behind a cache (see auth/users.py).
+# Lookups give a UserRecord, the Pydantic User is only built when it's sent back in a response.
+user_store = create_user_store(
+    os.getenv("USERS_DATABASE"),
+    fake_users_db,
+    max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "100000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")   # i- for hashing passwords - This is what will be used to hash and verify passwords.
 
+# v- bcrypt takes ~250ms per check and would freeze the event loop, so it runs on password_pool's threads.
+# At most LOGIN_HASH_WORKERS checks run at once (default: one per CPU) and LOGIN_HASH_QUEUE more wait, after that /token answers 503 with Retry-After.
+password_pool = HashingPool(
+    workers=int(os.getenv("LOGIN_HASH_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("LOGIN_HASH_QUEUE", "16")),
+)
+
+# viii- /token answers 429 with Retry-After, before any hashing, when the password pool is full,
+# or a client IP made more than LOGIN_ATTEMPTS_PER_IP attempts (LOGIN_ATTEMPTS_PER_USER for a username) in LOGIN_ATTEMPTS_WINDOW seconds.
+# The buckets live in this process, or in redis for all the workers with LOGIN_LIMIT_URL=redis://... (see auth/ratelimit.py).
+LOGIN_ATTEMPTS_WINDOW = float(os.getenv("LOGIN_ATTEMPTS_WINDOW", "60"))
+LOGIN_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_ATTEMPTS_PER_IP", "30"))
+LOGIN_ATTEMPTS_PER_USER = int(os.getenv("LOGIN_ATTEMPTS_PER_USER", "10"))
+login_limiter = LoginLimiter(
+    per_ip=create_buckets(
+        os.getenv("LOGIN_LIMIT_URL"), LOGIN_ATTEMPTS_PER_IP / LOGIN_ATTEMPTS_WINDOW, LOGIN_ATTEMPTS_PER_IP
+    ),
+    per_user=create_buckets(
+        os.getenv("LOGIN_LIMIT_URL"), LOGIN_ATTEMPTS_PER_USER / LOGIN_ATTEMPTS_WINDOW, LOGIN_ATTEMPTS_PER_USER
+    ),
+    pool=password_pool,
+)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# ix- every token has a jti, revoked ones are refused until their exp: POST /logout, POST /token/revoke, and a refresh token once it was used.
+# Checked on every request, through a Bloom filter that answers "not revoked" without a lock (see auth/revocation.py).
+# In this process by default. With REVOKED_TOKENS_DATABASE=revoked.db the jtis are kept in that SQLite file too: they're loaded again
+# at startup, and each worker picks up what the others revoked within REVOKED_TOKENS_SYNC_INTERVAL seconds.
+revocations = create_revocation_list(
+    os.getenv("REVOKED_TOKENS_DATABASE"),
+    capacity=int(os.getenv("REVOKED_TOKENS_CAPACITY", "10000")),
+    sync_interval=float(os.getenv("REVOKED_TOKENS_SYNC_INTERVAL", "1")),
+)
+
+# vi- the user each verified token belongs to, until the token's exp, at most TOKEN_CACHE_MAX_ENTRIES tokens (see auth/claims.py).
+# disable_user() tells it when a cached user is not good anymore, a hit checks `revocations` first.
+claims_cache = ClaimsCache(max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "100000")), revocations=revocations)
+
 app = FastAPI()
 
 
@@ -60,23 +119,23 @@ def get_password_hash(password):                                    # i- for has
     return pwd_context.hash(password)
 
 
-def get_user(db, username: str):
-    if username in db:
-        user_dict = db[username]
-        return UserInDB(**user_dict)
+def get_user(username: str) -> UserRecord | None:                  # vii- a cached record, no model validation per request
+    return user_store.get(username)
 
 
-def authenticate_user(fake_db, username: str, password: str):       # i- for authenticating users - Utility to authenticate and return a user. 
-    user = get_user(fake_db, username)
+async def authenticate_user(username: str, password: str):          # i- for authenticating users - Utility to authenticate and return a user. 
+    user = get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await password_pool.run("verify", verify_password, password, user.hashed_password):  # v- on the pool, the event loop keeps serving other requests
         return False
     return user
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):                    # ii- for creating access tokens    
     to_encode = data.copy()
+    to_encode.setdefault("type", "access")                          # ix- so a refresh token can't be used as an access token, or the other way round
+    to_encode.setdefault("jti", secrets.token_urlsafe(16))          # ix- the id a revocation refers to
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
@@ -86,28 +145,60 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):  # iii- for getting the current user
+def verify_access_token(token: str) -> tuple[UserRecord, str, float]:  # ix- the user, jti and exp of a valid access token
+    cached = claims_cache.get_claims(token)                         # vi- a token we already verified: no HMAC, no lookup, no new model
+    if cached is not None:
+        return cached
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    generation = claims_cache.get_generation()
+    payload = decode_token(token, "access", credentials_exception)
+    user = get_user(payload["sub"])
+    if user is None:
+        raise credentials_exception
+    claims_cache.put(token, user.username, user, payload["exp"], generation, payload["jti"])
+    return user, payload["jti"], payload["exp"]
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):  # iii- for getting the current user
+    return verify_access_token(token)[0]
+
+
+def decode_token(token: str, token_type: str, credentials_exception: HTTPException) -> dict:  # ix- a valid, unexpired, unrevoked token of this type
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except InvalidTokenError:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub", "jti"]})
+        TokenData(username=payload["sub"])
+    except (InvalidTokenError, ValueError):
         raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
-    if user is None:
+    if payload.get("type") != token_type or revocations.is_revoked(payload["jti"]):
         raise credentials_exception
-    return user
+    return payload
+
+
+def create_refresh_token(username: str):                            # ix- for getting new access tokens without sending the password again
+    return create_access_token(
+        {"sub": username, "type": "refresh"}, expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+
+
+def issue_tokens(username: str) -> Token:
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": username}, expires_delta=access_token_expires
+    )
+    return Token(access_token=access_token, token_type="bearer", refresh_token=create_refresh_token(username))
+
+
+def disable_user(username: str):                                    # vi- for user-disable events - call it whenever a user is disabled or changed
+    user_store.set_disabled(username, True)
+    claims_cache.invalidate_user(username)
 
 
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[UserRecord, Depends(get_current_user)],
 ):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -116,31 +207,89 @@ async def get_current_active_user(
 
 @app.post("/token")                                 # iv- for creating a real JWT access token and return it
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Token:
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    login_limiter.check(form_data.username, request.client.host if request.client else None)  # viii- before the password is checked
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+    return issue_tokens(user.username)
+
+
+@app.post("/token/refresh")                                         # ix- for a new access token from a refresh token, no password and no bcrypt
+async def refresh_access_token(refresh_token: Annotated[str, Form()]) -> Token:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return Token(access_token=access_token, token_type="bearer")
+    payload = decode_token(refresh_token, "refresh", credentials_exception)
+    user = get_user(payload["sub"])
+    if user is None or user.disabled:
+        raise credentials_exception
+    # Rotation: each refresh token works once, the client gets a new one with the new access token.
+    # revoke() is False when another request (on any worker) used it first. It writes to the revocation store, so off the event loop.
+    if not await run_in_threadpool(revocations.revoke, payload["jti"], payload["exp"]):
+        raise credentials_exception
+    return issue_tokens(user.username)
+
+
+@app.post("/token/revoke")                                          # ix- for revoking any of our tokens, access or refresh, by its jti
+async def revoke_token(token: Annotated[str, Form()]):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "jti"]})
+    except InvalidTokenError:
+        return {"ok": True}                                         # like RFC 7009: a token that isn't valid anymore needs no revoking
+    await run_in_threadpool(revocations.revoke, payload["jti"], payload["exp"])
+    return {"ok": True}
 
 
 @app.get("/users/me/", response_model=User)
 async def read_users_me(
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    current_user: Annotated[UserRecord, Depends(get_current_active_user)],
 ):
-    return current_user
+    return User.model_validate(current_user, from_attributes=True)  # vii- the response boundary, the only place a User model is built
 
 
 @app.get("/users/me/items/")
 async def read_own_items(
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    current_user: Annotated[UserRecord, Depends(get_current_active_user)],
 ):
-    return [{"item_id": "Foo", "owner": current_user.username}]
\ No newline at end of file
+    return [{"item_id": "Foo", "owner": current_user.username}]
+
+
+@app.get("/metrics", response_class=PlainTextResponse)         # v- for watching the password pool: wait and run times, in flight, rejected
+async def read_metrics():
+    return password_pool.render()
+
+
+@app.get("/token/limits")                                           # viii- for watching the login limiter: allowed, and refused by pool, IP and username
+async def read_login_limits():
+    return login_limiter.info()
+
+
+@app.post("/logout")                                                # ix- for revoking a token - it's refused from now on, even though it's still valid
+async def logout(token: Annotated[str, Depends(oauth2_scheme)]):
+    _, jti, exp = verify_access_token(token)                        # ix- the claims verified (or cached) for this token, no second decode
+    await run_in_threadpool(revocations.revoke, jti, exp)
+    return {"ok": True}
+
+
+@app.get("/token/cache/stats")                                      # vi- for watching the verified token cache: hits, misses, evictions
+async def read_token_cache_stats():
+    return claims_cache.info()
+
+
+@app.get("/users/stats")                                            # vii- for watching the user store and its cache: users, hits, misses
+async def read_user_stats():
+    return user_store.info()
+
+
+@app.get("/token/revocations/stats")                                # ix- for watching the revocation list: revoked jtis, filter size, false positives
+async def read_revocation_stats():
+    return revocations.info()
@@ -0,0 +1,218 @@
+import threading
+from array import array
+
+import numpy as np
+
+from heroes.changes import CHANGES_SQL
+
+'''
+Columnar hero snapshot for analytics (pip install numpy):
+Counting heroes or building an age histogram from the hero table means reading every row, every time.
+HeroSnapshot keeps just what the stats need in NumPy arrays, one per column, sorted by id:
+    ids      int64   the hero id
+    ages     int64   the age (0 when has_age is False), any integer SQLite holds fits
+    has_age  bool    age is not NULL
+    names    int32   the name as a code into the interned names list (the same name is stored once)
+    alive    bool    False for deleted heroes, until the next compaction
+That's about 22 bytes per hero, a million heroes fit in ~22 MB.
+Next to the interned names, name_counts (4 bytes per name) says how many live heroes have each one,
+so a name whose heroes were all renamed or deleted can be skipped (heroes/autocomplete.py relies on it).
+
+It's kept up to date from the hero_change log (see heroes/changes.py): refresh() reads the changes after the last one it applied,
+appends the new heroes, updates ages and names in place (a binary search on ids) and marks deleted ones dead.
+When more than a quarter of the rows are dead they're compacted away. If the log was pruned past our position we simply reload.
+The stats are computed with vectorized NumPy operations over the arrays (see age_stats) and cached until the next change.
+load() and apply() convert every value before they touch the arrays, so one that doesn't fit leaves the snapshot as it was.
+'''
+
+LOAD_BATCH_ROWS = 50_000
+
+
+class HeroSnapshot:
+    def __init__(self, engine):
+        self.engine = engine
+        self.ids = np.empty(0, dtype=np.int64)
+        self.ages = np.empty(0, dtype=np.int64)
+        self.has_age = np.empty(0, dtype=bool)
+        self.names = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.name_list: list[str] = []
+        self.name_codes: dict[str, int] = {}
+        self.name_counts = array("i")
+        self.last_change_id = None
+        self.version = 0
+        self._stats_cache = {}
+        self._lock = threading.Lock()
+
+    def intern(self, name: str) -> int:
+        code = self.name_codes.get(name)
+        if code is None:
+            code = self.name_codes[name] = len(self.name_list)
+            self.name_list.append(name)
+            self.name_counts.append(0)
+        return code
+
+    def load(self, connection):
+        # The change id is read before the heroes: whatever changes in between is applied again by refresh(), and applying twice is harmless.
+        last_change_id = connection.exec_driver_sql("SELECT coalesce(max(id), 0) FROM hero_change").scalar_one()
+        name_codes: dict[str, int] = {}
+        ids, ages, names = [], [], []
+        result = connection.exec_driver_sql("SELECT id, age, name FROM hero ORDER BY id")
+        for rows in result.partitions(LOAD_BATCH_ROWS):
+            ids.extend(row[0] for row in rows)
+            ages.extend(row[1] for row in rows)
+            names.extend(name_codes.setdefault(row[2], len(name_codes)) for row in rows)
+        new_ids = np.array(ids, dtype=np.int64)
+        new_has_age = np.fromiter((age is not None for age in ages), dtype=bool, count=len(ages))
+        new_ages = np.fromiter((age or 0 for age in ages), dtype=np.int64, count=len(ages))
+        new_names = np.array(names, dtype=np.int32)
+        name_counts = array("i", np.bincount(new_names, minlength=len(name_codes)).astype(np.int32).tobytes())
+        self.ids, self.ages, self.has_age, self.names = new_ids, new_ages, new_has_age, new_names
+        self.alive = np.ones(len(ids), dtype=bool)
+        self.name_list, self.name_codes, self.name_counts = list(name_codes), name_codes, name_counts
+        self.last_change_id = last_change_id
+        self.version += 1
+
+    def apply(self, changes):
+        # New heroes are collected in lists and appended once at the end, the rest is changed in place.
+        new_ids, new_ages, new_has_age, new_names, new_alive = [], [], [], [], []
+        new_positions: dict[int, int] = {}
+        max_id = self.ids[-1] if len(self.ids) else 0
+        counts = self.name_counts
+        unsorted = False
+        # Converted up front: an age that doesn't fit fails here, before anything changed.
+        ages = np.array([age or 0 for *_, age in changes], dtype=np.int64).tolist()
+        for (_, hero_id, op, name, age), age_value in zip(changes, ages):
+            if hero_id in new_positions:
+                index = new_positions[hero_id]
+                if new_alive[index]:
+                    counts[new_names[index]] -= 1
+                if op == "delete":
+                    new_alive[index] = False
+                else:
+                    new_ages[index], new_has_age[index], new_names[index] = age_value, age is not None, self.intern(name)
+                    new_alive[index] = True
+                    counts[new_names[index]] += 1
+                continue
+            position = int(np.searchsorted(self.ids, hero_id))
+            if position < len(self.ids) and self.ids[position] == hero_id:
+                if self.alive[position]:
+                    counts[self.names[position]] -= 1
+                if op == "delete":
+                    self.alive[position] = False
+                else:
+                    self.ages[position], self.has_age[position] = age_value, age is not None
+                    self.names[position] = code = self.intern(name)
+                    self.alive[position] = True
+                    counts[code] += 1
+            elif op != "delete":
+                unsorted = unsorted or hero_id < max_id
+                new_positions[hero_id] = len(new_ids)
+                code = self.intern(name)
+                counts[code] += 1
+                new_ids.append(hero_id)
+                new_ages.append(age_value)
+                new_has_age.append(age is not None)
+                new_names.append(code)
+                new_alive.append(True)
+        if new_ids:
+            self.ids = np.concatenate([self.ids, np.array(new_ids, dtype=np.int64)])
+            self.ages = np.concatenate([self.ages, np.array(new_ages, dtype=np.int64)])
+            self.has_age = np.concatenate([self.has_age, np.array(new_has_age, dtype=bool)])
+            self.names = np.concatenate([self.names, np.array(new_names, dtype=np.int32)])
+            self.alive = np.concatenate([self.alive, np.array(new_alive, dtype=bool)])
+            if unsorted:
+                self._take(np.argsort(self.ids, kind="stable"))
+        if len(self.alive) and np.count_nonzero(~self.alive) * 4 > len(self.alive):
+            self._take(np.flatnonzero(self.alive))
+        self.version += 1
+
+    def _take(self, index):
+        self.ids, self.ages, self.has_age = self.ids[index], self.ages[index], self.has_age[index]
+        self.names, self.alive = self.names[index], self.alive[index]
+
+    def refresh(self, batch: int = 10_000):
+        with self._lock, self.engine.connect() as connection:
+            if self.last_change_id is None:
+                self.load(connection)
+                return
+            oldest = connection.exec_driver_sql("SELECT min(id) FROM hero_change").scalar()
+            if oldest is not None and oldest > self.last_change_id + 1:
+                self.load(connection)
+                return
+            while True:
+                changes = connection.exec_driver_sql(CHANGES_SQL, (self.last_change_id, batch)).all()
+                if changes:
+                    self.apply(changes)
+                    self.last_change_id = changes[-1][0]
+                if len(changes) < batch:
+                    return
+
+    def stats(self, percentiles: tuple[float, ...] = (50, 90, 99), bucket_width: int = 10) -> dict:
+        with self._lock:
+            key = (self.version, percentiles, bucket_width)
+            cached = self._stats_cache.get(key)
+            if cached is not None:
+                return cached
+            ages = self.ages[self.alive & self.has_age]
+            result = {
+                "count": int(np.count_nonzero(self.alive)),
+                "with_age": int(ages.size),
+                "distinct_names": int(np.count_nonzero(np.frombuffer(self.name_counts, dtype=np.int32))),
+                "age": age_stats(ages, percentiles, bucket_width) if ages.size else None,
+            }
+            self._stats_cache = {key: result}
+            return result
+
+    def info(self) -> dict:
+        arrays = (self.ids, self.ages, self.has_age, self.names, self.alive)
+        return {
+            "rows": len(self.ids),
+            "names": len(self.name_list),
+            "array_bytes": sum(column.nbytes for column in arrays) + self.name_counts.itemsize * len(self.name_counts),
+            "last_change_id": self.last_change_id,
+        }
+
+
+MAX_COUNTED_AGE_RANGE = 1_000_000
+
+
+def age_stats(ages, percentiles: tuple[float, ...], bucket_width: int) -> dict:
+    '''
+    Ages are small integers, so one bincount (how many heroes of each age) gives everything in a single pass, no sorting:
+    the mean from the counts, the percentiles from their running sum, the histogram by adding up the counts per bucket.
+    The percentiles interpolate like np.percentile's default ("linear"). A silly range of ages falls back to sorting.
+    '''
+    lowest, highest = int(ages.min()), int(ages.max())
+    if highest - lowest > MAX_COUNTED_AGE_RANGE:
+        values = np.percentile(ages, percentiles)
+        mean = float(ages.mean(dtype=np.float64))
+        # Only the buckets that have heroes, a bincount would allocate one per bucket between the extremes.
+        buckets, bucket_counts = np.unique(ages // bucket_width, return_counts=True)
+    else:
+        counts = np.bincount(ages - lowest)
+        offsets = np.arange(counts.size, dtype=np.int64)
+        # Summed as offsets from lowest, so huge ages don't overflow int64.
+        mean = lowest + float(np.dot(counts, offsets) / ages.size)
+        cumulative = np.cumsum(counts)
+        positions = np.asarray(percentiles, dtype=np.float64) / 100 * (ages.size - 1)
+        below = np.floor(positions)
+        fraction = positions - below
+        low = lowest + np.searchsorted(cumulative, below, side="right")
+        high = lowest + np.searchsorted(cumulative, np.ceil(positions), side="right")
+        difference = high - low
+        values = np.where(fraction >= 0.5, high - difference * (1 - fraction), low + difference * fraction)
+        first_bucket = lowest // bucket_width
+        bucket_counts = np.bincount((offsets + lowest) // bucket_width - first_bucket, weights=counts).astype(np.int64)
+        buckets = first_bucket + np.arange(bucket_counts.size)
+    return {
+        "min": lowest,
+        "max": highest,
+        "mean": mean,
+        "percentiles": {f"p{p:g}": float(value) for p, value in zip(percentiles, values)},
+        "histogram": [
+            {"from": bucket * bucket_width, "to": (bucket + 1) * bucket_width, "count": count}
+            for bucket, count in zip(buckets.tolist(), bucket_counts.tolist())
+            if count
+        ],
+    }
@@ -0,0 +1,39 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from heroes.db import set_sqlite_pragmas
+from shared.sqlite import DEFAULT_PRAGMAS
+
+'''
+Async engine and session:
+A plain `def` endpoint runs in FastAPI's threadpool, and that pool only has a few dozen workers.
+Under a burst of requests they are all busy waiting on SQLite and new requests queue up even though the CPU is idle.
+With aiosqlite the database calls are awaited instead, so an `async def` endpoint gives the event loop back while it waits.
+The same database.db file is used, only the driver changes: sqlite+aiosqlite:// instead of sqlite://
+The connections get the same pragmas as the sync engines (see heroes/db.py).
+'''
+
+
+def create_async_sqlite_engine(sqlite_file_name: str, pragmas: dict | None = None):
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_file_name}")
+    set_sqlite_pragmas(async_engine.sync_engine, DEFAULT_PRAGMAS if pragmas is None else pragmas)
+    return async_engine
+
+
+def async_session_dependency(async_engine):
+    async def get_async_session():
+        async with AsyncSession(async_engine) as session:
+            yield session
+
+    return get_async_session
+
+
+async def warm_async_pool(async_engine, connections: int | None = None):
+    # Same as heroes.db.warm_pool, for the aiosqlite pool.
+    connections = async_engine.pool.size() if connections is None else connections
+    opened = await asyncio.gather(*(async_engine.connect() for _ in range(connections)))
+    for connection in opened:
+        await connection.exec_driver_sql("SELECT count(*) FROM sqlite_master")
+        await connection.close()
@@ -0,0 +1,100 @@
+import heapq
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+'''
+Hero name autocomplete:
+NameIndex answers "which names start with this prefix" from memory, for a search box that asks on every keystroke.
+It doesn't keep its own copy of the names: HeroSnapshot (heroes/analytics.py) already interns every name once
+(name_list, with name_counts saying how many live heroes have it) and keeps them up to date from the hero_change log.
+On top of that NameIndex only keeps `order`, the name codes sorted by their folded name, 4 bytes per name in an array.
+A lookup is a binary search in `order` and then a walk over the next names while they still match, so it's O(log n + k).
+
+Names interned after the last build go to `pending`, a small sorted list that's merged into the answers,
+and once it holds more than a 16th of the names (at least max_pending) the order is rebuilt.
+Names whose heroes were all renamed or deleted stay in the snapshot (until it reloads) but are skipped, their count is 0.
+Matching ignores case and accents, like the search (heroes/search.py): "spi" finds "Spider-Boy", "umi" finds "Ümit".
+The results come in that same folded alphabetical order.
+'''
+
+
+def fold(text: str) -> str:
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class NameIndex:
+    def __init__(self, snapshot, max_pending: int = 1024):
+        self.snapshot = snapshot
+        self.max_pending = max_pending
+        self.order = array("i")
+        self.pending: list[int] = []
+        self.name_bytes = 0
+        self._names = None
+        self._indexed = 0
+
+    def _key(self, code: int) -> tuple[str, str]:
+        name = self._names[code]
+        return fold(name), name
+
+    def build(self):
+        self._names = self.snapshot.name_list
+        self.order = array("i", sorted(range(len(self._names)), key=self._key))
+        self.pending = []
+        self._indexed = len(self._names)
+        self.name_bytes = sum(sys.getsizeof(name) for name in self._names)
+
+    def sync(self):
+        with self.snapshot._lock:
+            self._sync()
+
+    def _sync(self):
+        # Picks up the names the snapshot interned since the last call, with the snapshot's lock held.
+        if self._names is not self.snapshot.name_list:  # the snapshot was reloaded
+            self.build()
+            return
+        names = self._names
+        for code in range(self._indexed, len(names)):
+            insort(self.pending, code, key=self._key)
+            self.name_bytes += sys.getsizeof(names[code])
+        self._indexed = len(names)
+        if len(self.pending) > max(self.max_pending, len(self.order) // 16):
+            self.build()
+
+    def _matches(self, codes, start: int, prefix: str):
+        names, counts = self._names, self.snapshot.name_counts
+        for position in range(start, len(codes)):
+            code = codes[position]
+            key = fold(names[code])
+            if not key.startswith(prefix):
+                return
+            if counts[code] > 0:
+                yield key, names[code]
+
+    def complete(self, prefix: str, limit: int = 10) -> list[str]:
+        with self.snapshot._lock:
+            self._sync()
+            prefix = fold(prefix)
+            found = self._matches(self.order, bisect_left(self.order, (prefix,), key=self._key), prefix)
+            if self.pending:
+                extra = self._matches(self.pending, bisect_left(self.pending, (prefix,), key=self._key), prefix)
+                found = heapq.merge(found, extra)
+            return [name for _, (_, name) in zip(range(limit), found)]
+
+    def info(self) -> dict:
+        names = len(self._names or ())
+        # Per name: the interned str (shared with the snapshot), the list and dict slots pointing at it, its count and its place in order.
+        overhead = 8 + 8 * 3 + self.snapshot.name_counts.itemsize + self.order.itemsize
+        total = self.name_bytes + names * overhead
+        return {
+            "names": names,
+            "pending": len(self.pending),
+            "bytes": total,
+            "bytes_per_name": round(total / names, 1) if names else 0,
+            "index_bytes": self.order.itemsize * len(self.order) + 8 * len(self.pending),
+        }
+
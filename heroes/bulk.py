@@ -0,0 +1,130 @@
+import codecs
+import json
+from collections.abc import AsyncIterator
+
+from fastapi import HTTPException
+
+'''
+Streaming parsers for bulk uploads:
+request.json() would read the whole body and build every object at once, for 100k heroes that's a lot of memory.
+Instead we read the body chunk by chunk (request.stream()) and yield one decoded object at a time.
+Two formats are accepted:
+NDJSON (Content-Type: application/x-ndjson), one JSON object per line.
+A normal JSON array, [{...}, {...}], we decode it element by element with JSONDecoder.raw_decode.
+MAX_ROW_BYTES protects us from a single "row" that never ends.
+'''
+
+MAX_ROW_BYTES = 1024 * 1024
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-seq")
+WHITESPACE = " \t\r\n"
+
+_decoder = json.JSONDecoder()
+
+
+def is_ndjson(content_type: str | None) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES
+
+
+async def _text_chunks(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        async for chunk in stream:
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body is not valid UTF-8")
+
+
+def _load_line(line: str, line_number: int):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON on line {line_number}: {e.msg}")
+
+
+async def iter_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[object]:
+    buffer = ""
+    line_number = 0
+    async for text in _text_chunks(stream):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _load_line(line, line_number)
+        if len(buffer) > MAX_ROW_BYTES:
+            raise HTTPException(status_code=413, detail=f"Line {line_number + 1} is too long")
+    if buffer.strip():
+        yield _load_line(buffer, line_number + 1)
+
+
+async def iter_json_array(stream: AsyncIterator[bytes]) -> AsyncIterator[object]:
+    # States: "start" expects "[", "first" a value or "]", "value" a value, "next" "," or "]".
+    chunks = _text_chunks(stream)
+    buffer, position = "", 0
+    state = "start"
+    exhausted = False
+
+    while True:
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if state == "done":
+                raise HTTPException(status_code=400, detail="Unexpected data after the JSON array")
+            if state == "start":
+                if char != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array")
+                state, position = "first", position + 1
+            elif state == "next":
+                if char == ",":
+                    state, position = "value", position + 1
+                elif char == "]":
+                    state, position = "done", position + 1
+                else:
+                    raise HTTPException(status_code=400, detail="Expected ',' or ']' in JSON array")
+            elif state == "first" and char == "]":
+                state, position = "done", position + 1
+            else:
+                try:
+                    value, end = _decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    if exhausted:
+                        raise HTTPException(status_code=400, detail=f"Invalid JSON array: {e.msg}")
+                    break
+                if end == len(buffer) and not exhausted:
+                    # A number at the very end of the buffer might continue in the next chunk.
+                    break
+                yield value
+                state, position = "next", end
+
+        if exhausted:
+            if state != "done":
+                raise HTTPException(status_code=400, detail="Unexpected end of JSON array")
+            return
+        buffer, position = buffer[position:], 0
+        if len(buffer) > MAX_ROW_BYTES:
+            raise HTTPException(status_code=413, detail="Array element is too large")
+        try:
+            buffer += await chunks.__anext__()
+        except StopAsyncIteration:
+            exhausted = True
+
+
+async def iter_upload(stream: AsyncIterator[bytes], content_type: str | None) -> AsyncIterator[object]:
+    rows = iter_ndjson(stream) if is_ndjson(content_type) else iter_json_array(stream)
+    async for row in rows:
+        yield row
+
+
+async def batched(rows: AsyncIterator[object], size: int) -> AsyncIterator[list]:
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,239 @@
+import threading
+import time
+from collections import OrderedDict
+
+from shared.metrics import CacheStats
+
+'''
+Read-through cache for single heroes:
+Most of our traffic reads the same hot heroes over and over, so we keep the already serialized JSON of each HeroPublic in memory.
+A hit skips the session, the SELECT, the model validation and the JSON encoding, we just send the bytes.
+
+LRUCache lives in the process: bounded by max_entries AND max_bytes, entries expire after ttl seconds, least recently used go first.
+RemoteCache wraps any client with a redis-like get/set/incr/delete API, so several workers share one cache.
+InMemoryRemote is a tiny stand-in for that client, for tests or a single worker, RedisRemote adapts a real redis client.
+Both caches have the same methods, the app doesn't care which one it gets.
+
+There's one race to care about: a request that missed reads the OLD hero, then an update commits and invalidates,
+then the first request stores its old copy. To avoid that, get_generation() is read before going to the database,
+every invalidation bumps the generation, and set() drops the value if the generation moved in between.
+For RemoteCache the generation is a counter in the shared backend, bumped by every worker's invalidations,
+and the check and the write are one compare-and-set there (a Lua script on redis).
+'''
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = 10_000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self.size_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def get(self, key) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key, value: bytes, generation: int | None = None):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.size_bytes += len(value)
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._generation += 1
+            self.stats.invalidations += 1
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def info(self) -> dict:
+        return {
+            "backend": "lru",
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            **self.stats.as_dict(),
+        }
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+
+class RemoteCache:
+    def __init__(self, client, prefix: str = "hero:", ttl: float = 60.0, max_value_bytes: int = 64 * 1024):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_value_bytes = max_value_bytes
+        self.stats = CacheStats()
+        # The generation lives in the shared backend, so an invalidation on one worker stops the stale writes of all of them.
+        self.generation_key = f"{prefix}generation"
+
+    def get_generation(self) -> int:
+        return int(self.client.get(self.generation_key) or 0)
+
+    def get(self, key) -> bytes | None:
+        value = self.client.get(f"{self.prefix}{key}")
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return value
+
+    def set(self, key, value: bytes, generation: int | None = None):
+        if len(value) > self.max_value_bytes:
+            return
+        ex = max(1, int(self.ttl))
+        if generation is None:
+            self.client.set(f"{self.prefix}{key}", value, ex=ex)
+        else:
+            # Checked and written in one step on the backend, an invalidation can't land in between.
+            self.client.set_if_generation(self.generation_key, generation, f"{self.prefix}{key}", value, ex)
+
+    def delete(self, key):
+        # Bump first: a worker that read the hero before this is refused when it tries to store it.
+        self.client.incr(self.generation_key)
+        self.stats.invalidations += 1
+        self.client.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        self.client.incr(self.generation_key)
+
+    def info(self) -> dict:
+        return {"backend": type(self.client).__name__, "ttl": self.ttl, **self.stats.as_dict()}
+
+
+class InMemoryRemote:
+    '''The subset of the redis client API that RemoteCache uses, plus set_if_generation (see RedisRemote).'''
+
+    def __init__(self):
+        self._data: dict[str, tuple[float | None, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ex if ex else None, value)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._get(key) or 0) + 1
+            self._data[key] = (None, str(value).encode())
+            return value
+
+    def set_if_generation(self, generation_key: str, generation: int, key: str, value: bytes, ex: int) -> bool:
+        with self._lock:
+            if int(self._get(generation_key) or 0) != generation:
+                return False
+            self._data[key] = (time.monotonic() + ex, value)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+# KEYS: the generation, the entry. ARGV: the generation the value was read at, the value, its ttl in seconds.
+SET_IF_GENERATION_LUA = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class RedisRemote:
+    '''A redis client with set_if_generation, the compare-and-set RemoteCache needs, done by a Lua script on the server.'''
+
+    def __init__(self, client):
+        self.client = client
+        self._set_if_generation = client.register_script(SET_IF_GENERATION_LUA)
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ex: int | None = None):
+        self.client.set(key, value, ex=ex)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def set_if_generation(self, generation_key: str, generation: int, key: str, value: bytes, ex: int) -> bool:
+        return bool(self._set_if_generation(keys=[generation_key, key], args=[generation, value, ex]))
+
+    def delete(self, *keys: str) -> int:
+        return self.client.delete(*keys)
+
+
+def create_cache(url: str | None = None, **options):
+    '''
+    None or "lru://"  -> LRUCache in this process
+    "memory://"       -> RemoteCache over InMemoryRemote (same code path as a real shared cache)
+    "redis://..."     -> RemoteCache over redis (pip install redis)
+    max_entries and max_bytes only bound the LRU: a shared cache is bounded by its server (redis maxmemory
+    with an LRU eviction policy), so they are refused with a shared URL instead of being silently ignored.
+    '''
+    if not url or url.startswith("lru://"):
+        return LRUCache(**options)
+    limits = sorted({"max_entries", "max_bytes"} & options.keys())
+    if limits:
+        raise ValueError(f"{' and '.join(limits)} only bound the in-process cache, bound a shared cache on its server (redis maxmemory)")
+    if url.startswith("memory://"):
+        return RemoteCache(InMemoryRemote(), **options)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// cache URL needs the redis package: pip install redis")
+        return RemoteCache(RedisRemote(redis.Redis.from_url(url)), **options)
+    raise ValueError(f"Unsupported cache URL: {url}")
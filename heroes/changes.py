@@ -0,0 +1,238 @@
+import asyncio
+import contextvars
+import logging
+from collections.abc import AsyncIterator
+
+from fastapi.concurrency import run_in_threadpool
+
+from heroes.encoding import dumps
+
+'''
+Hero change feed:
+Every INSERT, UPDATE and DELETE on hero is written to the hero_change table by triggers, in the same transaction as the change,
+whatever code path did it (the endpoints, bulk, group commit, another worker process).
+hero_change.id is AUTOINCREMENT, so it only goes up and is never reused, even after old rows are pruned: it's the SSE event id.
+
+ChangeFeed runs one pump task per worker: when a mutation calls notify() (or every poll_interval, to see the other workers' writes)
+it reads the new rows once, encodes each one once as an SSE frame, and hands the same bytes to every subscriber.
+So an idle subscriber costs a queue and a waiting task, no CPU, and one change costs one query however many dashboards listen.
+
+Each subscriber has a bounded queue (queue_size frames). A client that doesn't keep up is dropped: it gets an "overflow" event and the stream ends.
+That loses nothing, the browser reconnects with the Last-Event-ID header and we replay from hero_change what it missed.
+If those rows were already pruned (we keep the last `retention`) it gets a "reset" event instead: refetch GET /heroes/ and carry on.
+A comment frame (": ping") goes out every heartbeat_interval so proxies don't close idle connections.
+'''
+
+logger = logging.getLogger("heroes.changes")
+
+HERO_CHANGES_DDL = (
+    """CREATE TABLE IF NOT EXISTS hero_change (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hero_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        name TEXT,
+        age INTEGER
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS hero_change_insert AFTER INSERT ON hero BEGIN
+        INSERT INTO hero_change(hero_id, op, name, age) VALUES (new.id, 'create', new.name, new.age);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hero_change_update AFTER UPDATE ON hero BEGIN
+        INSERT INTO hero_change(hero_id, op, name, age) VALUES (new.id, 'update', new.name, new.age);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hero_change_delete AFTER DELETE ON hero BEGIN
+        INSERT INTO hero_change(hero_id, op) VALUES (old.id, 'delete');
+    END""",
+)
+
+CHANGES_SQL = "SELECT id, hero_id, op, name, age FROM hero_change WHERE id > ? ORDER BY id LIMIT ?"
+
+RETRY = b"retry: 3000\n\n"
+HEARTBEAT = b": ping\n\n"
+RESET = b"event: reset\ndata: {}\n\n"
+OVERFLOW = b"event: overflow\ndata: {}\n\n"
+
+
+def create_hero_changes(connection):
+    for statement in HERO_CHANGES_DDL:
+        connection.exec_driver_sql(statement)
+
+
+def change_frame(row) -> bytes:
+    change_id, hero_id, op, name, age = row
+    data = {"id": hero_id} if op == "delete" else {"name": name, "age": age, "id": hero_id}
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (change_id, op.encode(), dumps(data))
+
+
+class Subscriber:
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, queue_size: int):
+        # (change id, frame), the id is 0 for heartbeats.
+        self.queue: asyncio.Queue[tuple[int, bytes]] = asyncio.Queue(queue_size)
+        self.dropped = False
+
+
+class ChangeHub:
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.subscribers: set[Subscriber] = set()
+        self.dropped = 0
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, change_id: int, frame: bytes):
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber.queue.put_nowait((change_id, frame))
+            except asyncio.QueueFull:
+                if change_id:
+                    # Too slow: drop it, it resumes from its Last-Event-ID when it reconnects.
+                    subscriber.dropped = True
+                    self.subscribers.discard(subscriber)
+                    self.dropped += 1
+
+
+class ChangeFeed:
+    def __init__(
+        self,
+        read_engine,
+        write_engine=None,
+        *,
+        queue_size: int = 256,
+        poll_interval: float = 1.0,
+        heartbeat_interval: float = 15.0,
+        batch: int = 1000,
+        retention: int = 100_000,
+        prune_interval: float = 60.0,
+    ):
+        self.read_engine = read_engine
+        self.write_engine = write_engine
+        self.hub = ChangeHub(queue_size)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.batch = batch
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.last_id = 0
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    def read_changes(self, after: int, limit: int) -> list:
+        with self.read_engine.connect() as connection:
+            return connection.exec_driver_sql(CHANGES_SQL, (after, limit)).all()
+
+    def change_range(self) -> tuple[int | None, int]:
+        with self.read_engine.connect() as connection:
+            oldest, newest = connection.exec_driver_sql("SELECT min(id), max(id) FROM hero_change").one()
+        return oldest, newest or 0
+
+    def prune(self):
+        with self.write_engine.begin() as connection:
+            connection.exec_driver_sql(
+                "DELETE FROM hero_change WHERE id <= (SELECT max(id) FROM hero_change) - ?", (self.retention,)
+            )
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        _, self.last_id = await run_in_threadpool(self.change_range)
+        # A fresh context: the pump must not count its queries in the request that happened to start it.
+        self._task = asyncio.create_task(self._pump(), context=contextvars.Context())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+
+    def notify(self):
+        # Called after a commit, from any thread.
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:  # the loop is closed, we are shutting down
+                pass
+
+    async def _publish_new(self):
+        # After half a queue of frames, let the subscribers run: a burst (a bulk upload) shouldn't drop the ones that keep up.
+        pause_every = max(1, self.hub.queue_size // 2)
+        while True:
+            rows = await run_in_threadpool(self.read_changes, self.last_id, self.batch)
+            for count, row in enumerate(rows, 1):
+                self.hub.publish(row[0], change_frame(row))
+                self.last_id = row[0]
+                if count % pause_every == 0:
+                    await asyncio.sleep(0)
+            if len(rows) < self.batch:
+                return
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        last_heartbeat = last_prune = loop.time()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._publish_new()
+                now = loop.time()
+                if now - last_heartbeat >= self.heartbeat_interval:
+                    self.hub.publish(0, HEARTBEAT)
+                    last_heartbeat = now
+                if self.write_engine is not None and now - last_prune >= self.prune_interval:
+                    await run_in_threadpool(self.prune)
+                    last_prune = now
+            except Exception:
+                logger.exception("Hero change feed pump failed, retrying")
+
+    async def stream(self, last_event_id: int | None = None) -> AsyncIterator[bytes]:
+        await self.start()
+        # Subscribe before reading the backlog, so nothing published meanwhile is missed (duplicates are skipped by id).
+        # Everything up to last_id was published before we subscribed, everything after it will be in our queue.
+        subscriber = self.hub.subscribe()
+        sent = self.last_id
+        try:
+            yield RETRY
+            if last_event_id is not None and last_event_id < sent:
+                oldest, _ = await run_in_threadpool(self.change_range)
+                if oldest is None or last_event_id < oldest - 1:
+                    yield RESET
+                else:
+                    sent = last_event_id
+                    while True:
+                        rows = await run_in_threadpool(self.read_changes, sent, self.batch)
+                        for row in rows:
+                            yield change_frame(row)
+                            sent = row[0]
+                        if len(rows) < self.batch:
+                            break
+            while True:
+                change_id, frame = await subscriber.queue.get()
+                if subscriber.dropped:
+                    yield OVERFLOW
+                    return
+                if change_id == 0 or change_id > sent:
+                    yield frame
+                    sent = max(sent, change_id)
+        finally:
+            self.hub.unsubscribe(subscriber)
+
+    def info(self) -> dict:
+        return {"subscribers": len(self.hub.subscribers), "dropped": self.hub.dropped, "last_id": self.last_id}
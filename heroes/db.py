@@ -0,0 +1,113 @@
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlmodel import create_engine
+
+from shared.sqlite import DEFAULT_PRAGMAS
+
+'''
+SQLite engines:
+Every connection gets the tuning pragmas of shared/sqlite.py, most importantly WAL mode: readers keep reading the last committed data
+while one writer appends to the log.
+
+SQLite only allows one writer at a time anyway, so instead of letting many connections fight for the lock,
+we give writes a single dedicated connection and reads their own pool.
+
+The writer also starts its transactions itself with BEGIN IMMEDIATE instead of leaving it to the sqlite3 module.
+sqlite3 only opens a transaction right before an INSERT/UPDATE/DELETE, which breaks SAVEPOINTs (session.begin_nested()),
+and IMMEDIATE takes the write lock up front instead of failing halfway through a transaction.
+'''
+
+
+def begin_immediate(engine):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def on_begin(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return engine
+
+
+def set_sqlite_pragmas(engine, pragmas: dict, query_only: bool = False):
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    return engine
+
+
+def create_sqlite_engine(
+    sqlite_file_name: str,
+    *,
+    pool_size: int = 5,
+    pragmas: dict | None = None,
+    query_only: bool = False,
+    pool_timeout: float = 30,
+):
+    engine = create_engine(
+        f"sqlite:///{sqlite_file_name}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=pool_timeout,
+    )
+    return set_sqlite_pragmas(engine, DEFAULT_PRAGMAS if pragmas is None else pragmas, query_only)
+
+
+def create_unpooled_sqlite_engine(sqlite_file_name: str, *, pragmas: dict | None = None, query_only: bool = False):
+    '''
+    Every connect() opens its own connection and close() really closes it, nothing is shared with the pools.
+    For long jobs like an export: they would keep a pooled connection for as long as they run, and the other requests would wait for it.
+    '''
+    engine = create_engine(
+        f"sqlite:///{sqlite_file_name}", connect_args={"check_same_thread": False}, poolclass=NullPool
+    )
+    return set_sqlite_pragmas(engine, DEFAULT_PRAGMAS if pragmas is None else pragmas, query_only)
+
+
+def create_reader_writer_engines(
+    sqlite_file_name: str,
+    *,
+    readers: int = 8,
+    pragmas: dict | None = None,
+    pool_timeout: float = 30,
+):
+    '''
+    Returns (writer_engine, reader_engine).
+    The writer has exactly one connection, so writes queue up in the pool instead of spinning on SQLITE_BUSY.
+    The readers are opened with query_only=ON so a read session can never write by accident.
+    '''
+    writer = begin_immediate(create_sqlite_engine(
+        sqlite_file_name, pool_size=1, pragmas=pragmas, pool_timeout=pool_timeout
+    ))
+    reader = create_sqlite_engine(
+        sqlite_file_name,
+        pool_size=readers,
+        pragmas=pragmas,
+        query_only=True,
+        pool_timeout=pool_timeout,
+    )
+    return writer, reader
+
+
+def warm_pool(engine, connections: int | None = None):
+    '''
+    Opens the pool's connections before the first request, so nobody pays the connect, the pragmas and the schema load.
+    They are all checked out at the same time, otherwise the pool would hand back the same one each time.
+    '''
+    connections = engine.pool.size() if connections is None else connections
+    opened = [engine.raw_connection() for _ in range(connections)]
+    for connection in opened:
+        cursor = connection.cursor()
+        cursor.execute("SELECT count(*) FROM sqlite_master")  # reads the schema into the connection
+        cursor.fetchall()
+        cursor.close()
+        connection.close()
@@ -0,0 +1,25 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library gives the same bytes, just slower.
+    orjson = None
+
+'''
+JSON encoding without Pydantic in the middle:
+For list responses FastAPI validates every row into HeroPublic and runs jsonable_encoder before it encodes anything.
+When the rows already come from SQL with exactly the public columns, we can build plain dicts and encode them in one call.
+The output is the same bytes FastAPI sends: compact separators, UTF-8 as is (no \\u escapes for non-ASCII), keys in field order.
+'''
+
+_encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return _encoder.encode(value).encode()
+
+
+def rows_to_json(rows, fields: tuple[str, ...]) -> bytes:
+    return dumps([dict(zip(fields, row)) for row in rows])
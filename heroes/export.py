@@ -0,0 +1,53 @@
+import csv
+import io
+from collections.abc import AsyncIterator, Iterator
+
+from fastapi.concurrency import run_in_threadpool
+
+from heroes.encoding import dumps
+
+'''
+Streaming export:
+Instead of paging through the API 100 heroes at a time, GET /heroes/export sends the whole table in one response.
+The rows come from a server-side cursor (yield_per) EXPORT_BATCH_ROWS at a time, each batch is encoded to one chunk of bytes
+and handed to a StreamingResponse, so memory doesn't depend on how many heroes there are.
+stream_in_threadpool pulls the chunks from a worker thread (SQLite calls block) and closes the cursor in `finally`,
+that's what stops the export when the client goes away: Starlette cancels the response and we stop reading.
+on_close runs after that, the app uses it to close the export's connection and give back its export slot.
+'''
+
+EXPORT_BATCH_ROWS = 1000
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def encode_ndjson(rows, fields: tuple[str, ...]) -> bytes:
+    return b"".join([dumps(dict(zip(fields, row))) + b"\n" for row in rows])
+
+
+def encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def export_chunks(result, fields: tuple[str, ...], format: str) -> Iterator[bytes]:
+    if format == "csv":
+        yield encode_csv([fields])
+    for partition in result.partitions(EXPORT_BATCH_ROWS):
+        if format == "csv":
+            yield encode_csv(partition)
+        else:
+            yield encode_ndjson(partition, fields)
+
+
+async def stream_in_threadpool(chunks: Iterator[bytes], on_close=None) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            chunk = await run_in_threadpool(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        chunks.close()
+        if on_close is not None:
+            on_close()
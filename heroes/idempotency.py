@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from shared.digest import digest
+
+'''
+Idempotency keys:
+A client that retries POST /heroes/ after a timeout sends the same Idempotency-Key header again.
+The first request with a key creates the hero and its response is kept for `ttl` seconds, a retry gets that same response back
+without touching the hero table. A retry that arrives while the first one is still running waits for it instead of inserting a second hero.
+
+The store is in memory and bounded: at most max_entries keys, the oldest finished ones go first, and expired ones are dropped as we go.
+Each entry is small: a 16 byte digest of the key, a 16 byte digest of the request body, the status code and the response bytes (~60 bytes for a hero),
+about 300 bytes per key with the Python overhead (benchmarks/bench_idempotency.py).
+The body digest catches a client reusing a key for a different hero, that's a 422 instead of the wrong hero coming back.
+It's per process: with several workers, a retry that lands on another worker is not deduplicated.
+'''
+
+
+class IdempotencyEntry:
+    # No Event per entry (that's over 1 KB each), the waiters share the store's Condition.
+    __slots__ = ("fingerprint", "expires", "status_code", "body", "done")
+
+    def __init__(self, fingerprint: bytes, expires: float):
+        self.fingerprint = fingerprint
+        self.expires = expires
+        self.status_code = None
+        self.body = None
+        self.done = False
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries: int = 100_000, ttl: float = 24 * 60 * 60, wait_timeout: float = 10.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.replays = 0
+        self._entries: OrderedDict[bytes, IdempotencyEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+
+    def claim(self, key: str, body: bytes) -> tuple[bytes, IdempotencyEntry, bool]:
+        '''
+        Returns (key digest, entry, owner). owner=True means this request must do the work and then call complete() or abandon(),
+        otherwise the entry is one that's done (or another request is doing it, see wait()).
+        '''
+        key_digest = digest(key.encode())
+        fingerprint = digest(body)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key_digest)
+            if entry is not None and entry.expires > now:
+                if entry.fingerprint != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+                return key_digest, entry, False
+            entry = IdempotencyEntry(fingerprint, now + self.ttl)
+            self._entries[key_digest] = entry
+            self._entries.move_to_end(key_digest)
+            self._evict(now)
+            return key_digest, entry, True
+
+    def complete(self, entry: IdempotencyEntry, status_code: int, body: bytes):
+        with self._finished:
+            entry.status_code = status_code
+            entry.body = body
+            entry.done = True
+            self._finished.notify_all()
+
+    def abandon(self, key_digest: bytes, entry: IdempotencyEntry):
+        # The request failed, forget the key so the next retry can try again (the waiting ones see body=None and retry).
+        with self._finished:
+            if self._entries.get(key_digest) is entry:
+                del self._entries[key_digest]
+            entry.done = True
+            self._finished.notify_all()
+
+    def wait(self, entry: IdempotencyEntry) -> IdempotencyEntry | None:
+        with self._finished:
+            if not self._finished.wait_for(lambda: entry.done, self.wait_timeout):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            if entry.body is None:
+                return None
+            self.replays += 1
+            return entry
+
+    def _evict(self, now: float):
+        # Every entry gets the same ttl, so the oldest one is also the first to expire.
+        # Entries still in progress stay: dropping one would let a retry insert a second hero. There are at most as many as requests in flight.
+        entries = self._entries
+        excess = len(entries) - self.max_entries
+        evicted = []
+        for key_digest, entry in entries.items():
+            if entry.expires > now and excess <= 0:
+                break
+            if entry.done:
+                evicted.append(key_digest)
+                excess -= 1
+        for key_digest in evicted:
+            del entries[key_digest]
+
+    def info(self) -> dict:
+        with self._lock:
+            return {"keys": len(self._entries), "max_keys": self.max_entries, "replays": self.replays}
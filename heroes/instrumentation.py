@@ -0,0 +1,185 @@
+import logging
+import re
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from shared.metrics import Histogram
+
+'''
+SQL instrumentation per request:
+instrument_engine() adds SQLAlchemy cursor events to an engine, every statement is timed and added to the RequestStats of the current request.
+The current request is found with a ContextVar, set by SqlTimingMiddleware. It follows the request into the threadpool (sync endpoints),
+into the greenlets of aiosqlite (async endpoints) and into the group commit writer (it copies the context of each operation).
+Statements that run outside a request (startup, background jobs) are simply not counted.
+
+Each response gets a Server-Timing header, browsers show it in the network tab:
+    Server-Timing: db;dur=1.204;desc="3 statements", db-slowest;dur=0.731, app;dur=4.950
+And SqlMetrics keeps histograms per route (total time, DB time, statements) for GET /metrics, in the Prometheus text format.
+
+N+1 detector (dev mode):
+With n_plus_one_threshold > 0 the middleware also remembers where each statement came from (the first frame of our code in the stack),
+and logs a warning when a request runs the same statement more than n_plus_one_threshold times, typically a query inside a loop.
+Walking the stack isn't free, keep it off in production.
+'''
+
+logger = logging.getLogger("heroes.sql")
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+MAX_CALL_SITES = 3
+
+_LIBRARY_PATHS = tuple({sysconfig.get_paths()["stdlib"], sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"]})
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\?(\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    # Same statement with other values: numbers and IN (?, ?, ?) lists don't count as a difference.
+    statement = _SPACES.sub(" ", statement).strip()
+    statement = _NUMBER.sub("?", statement)
+    return _PLACEHOLDERS.sub("?, ...", statement)
+
+
+def call_site() -> str:
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename != __file__ and not filename.startswith(_LIBRARY_PATHS) and not filename.startswith("<"):
+            return f"{filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_time", "slowest", "slowest_statement", "similar", "call_sites", "track_call_sites", "_lock")
+
+    def __init__(self, track_call_sites: bool = False):
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.similar: Counter = Counter()
+        self.call_sites: dict[str, Counter] = {}
+        self.track_call_sites = track_call_sites
+        # One request can run statements from several threads (a dependency and the group commit writer, for example).
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float, site: str | None = None):
+        with self._lock:
+            self.statements += 1
+            self.db_time += seconds
+            if seconds >= self.slowest:
+                self.slowest = seconds
+                self.slowest_statement = statement
+            if self.track_call_sites:
+                key = normalize_statement(statement)
+                self.similar[key] += 1
+                if site is not None:
+                    self.call_sites.setdefault(key, Counter())[site] += 1
+
+    def server_timing(self, total: float) -> str:
+        return (
+            f'db;dur={self.db_time * 1000:.3f};desc="{self.statements} statements", '
+            f"db-slowest;dur={self.slowest * 1000:.3f}, "
+            f"app;dur={total * 1000:.3f}"
+        )
+
+
+current_stats: ContextVar[RequestStats | None] = ContextVar("current_stats", default=None)
+
+
+def instrument_engine(engine):
+    # Works with sync engines and with async_engine.sync_engine.
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["statement_started"].pop()
+        stats = current_stats.get()
+        if stats is not None:
+            stats.record(statement, seconds, call_site() if stats.track_call_sites else None)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("statement_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+    return engine
+
+
+def find_n_plus_one(stats: RequestStats, threshold: int) -> list[tuple[str, int, list[str]]]:
+    return [
+        (statement, count, [site for site, _ in stats.call_sites.get(statement, Counter()).most_common(MAX_CALL_SITES)])
+        for statement, count in stats.similar.most_common()
+        if count > threshold
+    ]
+
+
+def report_n_plus_one(route: str, stats: RequestStats, threshold: int) -> list[tuple[str, int, list[str]]]:
+    suspects = find_n_plus_one(stats, threshold)
+    for statement, count, sites in suspects:
+        logger.warning(
+            "Possible N+1 in %s: %d similar statements: %s\n  called from:\n    %s",
+            route, count, statement, "\n    ".join(sites) or "unknown",
+        )
+    return suspects
+
+
+class SqlMetrics:
+    def __init__(self):
+        self.request_seconds = Histogram("hero_request_seconds", "Time spent handling the request.", SECONDS_BUCKETS)
+        self.db_seconds = Histogram("hero_request_db_seconds", "Time spent in SQL statements per request.", SECONDS_BUCKETS)
+        self.statements = Histogram("hero_request_statements", "SQL statements per request.", STATEMENT_BUCKETS)
+
+    def observe(self, route: str, total: float, stats: RequestStats):
+        self.request_seconds.observe(route, total)
+        self.db_seconds.observe(route, stats.db_time)
+        self.statements.observe(route, stats.statements)
+
+    def render(self) -> str:
+        return "\n".join(
+            line for histogram in (self.request_seconds, self.db_seconds, self.statements) for line in histogram.render()
+        ) + "\n"
+
+
+class SqlTimingMiddleware:
+    # Plain ASGI middleware, so streaming responses (like /heroes/export) keep streaming.
+    def __init__(self, app, metrics: SqlMetrics, n_plus_one_threshold: int = 0):
+        self.app = app
+        self.metrics = metrics
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(track_call_sites=self.n_plus_one_threshold > 0)
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", stats.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_stats.reset(token)
+            # The router puts the matched route in the scope, its path template keeps the number of series small.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.observe(route, time.perf_counter() - started, stats)
+            if self.n_plus_one_threshold > 0:
+                report_n_plus_one(f"{scope['method']} {route}", stats, self.n_plus_one_threshold)
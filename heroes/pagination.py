@@ -0,0 +1,88 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+'''
+Keyset (cursor) pagination helpers:
+offset/limit makes SQLite walk and throw away `offset` rows before it can return anything, so every page is slower than the last one.
+With keyset pagination we remember the sort key of the last row we sent (plus the id, to break ties) and ask for rows "after" it.
+That is a seek on an index, so page 1 and page 100000 cost the same.
+The cursor handed to clients is opaque: it is just the sort column, the direction, the last value and the last id, base64 encoded.
+'''
+
+SORT_COLUMNS = ("id", "name", "age")
+# The type the last value of each sort column must have, it goes to SQL as a parameter. None is for NULL ages (and names).
+SORT_COLUMN_TYPES = {"id": int, "name": str, "age": int}
+
+
+def encode_cursor(order_by: str, descending: bool, last_value, last_id: int) -> str:
+    raw = json.dumps([order_by, descending, last_value, last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, bool, object, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if len(values) == 3:
+            # Cursors handed out before sorting direction existed.
+            values = [values[0], False, values[1], values[2]]
+        order_by, descending, last_value, last_id = values
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if order_by not in SORT_COLUMNS or not isinstance(descending, bool) or not is_sort_value(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not (is_sort_value(last_value, SORT_COLUMN_TYPES[order_by]) or (last_value is None and order_by != "id")):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return order_by, descending, last_value, last_id
+
+
+# SQLite integers are 64 bit, binding a bigger Python int raises OverflowError.
+SQLITE_INT_MIN, SQLITE_INT_MAX = -2**63, 2**63 - 1
+
+
+def is_sort_value(value, expected: type) -> bool:
+    # bool is an int too, but True is not an id.
+    if isinstance(value, bool) or not isinstance(value, expected):
+        return False
+    return expected is not int or SQLITE_INT_MIN <= value <= SQLITE_INT_MAX
+
+
+def keyset_order(column, id_column, descending: bool = False):
+    if column is id_column:
+        return [id_column.desc() if descending else id_column]
+    if descending:
+        return [column.desc(), id_column.desc()]
+    return [column, id_column]
+
+
+def keyset_after(column, id_column, last_value, last_id: int, descending: bool = False):
+    # SQLite sorts NULLs first in ascending order and last in descending order.
+    if column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+    if last_value is None:
+        if descending:
+            return column.is_(None) & (id_column < last_id)
+        return (column.is_(None) & (id_column > last_id)) | column.is_not(None)
+    if descending:
+        return (tuple_(column, id_column) < tuple_(last_value, last_id)) | column.is_(None)
+    return tuple_(column, id_column) > tuple_(last_value, last_id)
+
+
+def prefix_upper_bound(prefix: str) -> str | None:
+    '''
+    The smallest string that is bigger than every string starting with `prefix`.
+    name >= prefix AND name < prefix_upper_bound(prefix) is a range the name index can seek,
+    a LIKE 'prefix%' is not (SQLite's LIKE is case insensitive, the index is not).
+    '''
+    while prefix:
+        last = ord(prefix[-1])
+        if last < 0x10FFFF:
+            # U+D800..U+DFFF are surrogates, not characters: they can't be encoded to bind the bound, the next character is U+E000.
+            following = 0xE000 if last == 0xD7FF else last + 1
+            return prefix[:-1] + chr(following)
+        prefix = prefix[:-1]
+    return None
@@ -0,0 +1,193 @@
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from sqlmodel import create_engine
+
+from heroes.changes import CHANGES_SQL
+
+'''
+In-memory read replica of database.db:
+ReadReplica copies the database into a shared in-memory SQLite database with the backup API (sqlite3.Connection.backup),
+and serves reads from there: no file, no page cache misses, no WAL to look through, and no contention with the writer's commits.
+
+It keeps up from the hero_change log (see heroes/changes.py), like HeroSnapshot does (heroes/analytics.py):
+refresh() reads the changes after the last one it applied, reads the current rows of the heroes they touch from the file,
+and replaces those rows in memory. If the log was pruned past our position it simply copies the whole database again.
+Reading the current rows (not the values in the log) makes it harmless to apply a change twice, so nothing needs a snapshot.
+Only the hero table and its indexes are kept: the triggers, hero_fts and hero_change are dropped from the copy.
+
+The staleness bound: ensure_fresh() refreshes when the last refresh started more than max_staleness seconds ago,
+so what a read sees is never older than that. It's checked on the reads, an idle app doesn't refresh at all.
+Read-your-writes: a client that just wrote sends the change id it got back (min_change_id), and the replica refreshes first if it's behind it.
+
+The readers share one in-memory database (cache=shared), and SQLite answers "database table is locked" instead of waiting
+when a reader and the refresh touch the hero table at the same time. So the readers hold a shared lock while they have
+a connection checked out of the pool, and a refresh takes it exclusively (new readers wait behind a waiting refresh).
+'''
+
+_names = itertools.count()
+FETCH_CHUNK_SIZE = 500
+
+
+class SharedLock:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_shared(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+
+    def release_shared(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._writers_waiting += 1
+            self._condition.wait_for(lambda: not self._writer and not self._readers)
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class ReadReplica:
+    def __init__(self, source_engine, *, max_staleness: float = 1.0, readers: int = 8, batch: int = 10_000):
+        self.source_engine = source_engine
+        self.max_staleness = max_staleness
+        self.batch = batch
+        self.uri = f"file:hero-replica-{next(_names)}?mode=memory&cache=shared"
+        # The in-memory database lives as long as one connection to it is open, this one also applies the changes.
+        self._anchor = sqlite3.connect(self.uri, uri=True, check_same_thread=False, isolation_level=None)
+        self.engine = create_engine(
+            "sqlite://",
+            creator=self._connect_reader,
+            poolclass=QueuePool,
+            pool_size=readers,
+            max_overflow=0,
+        )
+        self.lock = SharedLock()
+        event.listen(self.engine, "checkout", lambda *args: self.lock.acquire_shared())
+        event.listen(self.engine, "checkin", lambda *args: self.lock.release_shared())
+        self.last_change_id = None
+        self.refreshed_at = float("-inf")
+        self.refreshes = 0
+        self.full_loads = 0
+        self._refresh_lock = threading.Lock()
+
+    def _connect_reader(self):
+        connection = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        connection.execute("PRAGMA query_only=ON")
+        return connection
+
+    def is_fresh(self, min_change_id: int = 0) -> bool:
+        return (
+            self.last_change_id is not None
+            and self.last_change_id >= min_change_id
+            and time.monotonic() - self.refreshed_at <= self.max_staleness
+        )
+
+    def ensure_fresh(self, min_change_id: int = 0):
+        if not self.is_fresh(min_change_id):
+            self.refresh(min_change_id)
+
+    def source_position(self) -> int:
+        '''The id of the last change committed to the file, what a client that just wrote should wait for.'''
+        with self.source_engine.connect() as connection:
+            return connection.exec_driver_sql(
+                "SELECT coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'hero_change'), 0)"
+            ).scalar_one()
+
+    def refresh(self, min_change_id: int = 0):
+        with self._refresh_lock:
+            # Another request may have refreshed while we waited for the lock.
+            if self.is_fresh(min_change_id):
+                return
+            started = time.monotonic()
+            with self.source_engine.connect() as source:
+                if self.last_change_id is None:
+                    self._load(source)
+                else:
+                    oldest = source.exec_driver_sql("SELECT min(id) FROM hero_change").scalar()
+                    if oldest is not None and oldest > self.last_change_id + 1:
+                        self._load(source)
+                    else:
+                        self._catch_up(source)
+            self.refreshed_at = started
+            self.refreshes += 1
+
+    def _load(self, source):
+        # The change id is read before the copy: whatever changes in between is applied again by the next refresh.
+        last_change_id = source.exec_driver_sql("SELECT coalesce(max(id), 0) FROM hero_change").scalar_one()
+        with self.lock.exclusive():
+            source.connection.driver_connection.backup(self._anchor)
+            triggers = self._anchor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+            for (name,) in triggers:
+                self._anchor.execute(f'DROP TRIGGER "{name}"')
+            self._anchor.execute("DROP TABLE IF EXISTS hero_fts")
+            self._anchor.execute("DROP TABLE IF EXISTS hero_change")
+            self._anchor.execute("VACUUM")
+        self.last_change_id = last_change_id
+        self.full_loads += 1
+
+    def _catch_up(self, source):
+        while True:
+            changes = source.exec_driver_sql(CHANGES_SQL, (self.last_change_id, self.batch)).all()
+            if not changes:
+                return
+            hero_ids = list(dict.fromkeys(change[1] for change in changes))
+            columns, rows = None, []
+            for start in range(0, len(hero_ids), FETCH_CHUNK_SIZE):
+                chunk = hero_ids[start:start + FETCH_CHUNK_SIZE]
+                result = source.exec_driver_sql(
+                    f"SELECT * FROM hero WHERE id IN ({', '.join('?' * len(chunk))})", tuple(chunk)
+                )
+                columns = columns or list(result.keys())
+                rows.extend(tuple(row) for row in result)
+            with self.lock.exclusive():
+                self._anchor.execute("BEGIN")
+                try:
+                    self._anchor.executemany("DELETE FROM hero WHERE id = ?", [(hero_id,) for hero_id in hero_ids])
+                    if rows:
+                        self._anchor.executemany(
+                            f"INSERT INTO hero ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+                        )
+                    self._anchor.execute("COMMIT")
+                except BaseException:
+                    self._anchor.execute("ROLLBACK")
+                    raise
+            self.last_change_id = changes[-1][0]
+            if len(changes) < self.batch:
+                return
+
+    def info(self) -> dict:
+        page_count = self._anchor.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._anchor.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "last_change_id": self.last_change_id,
+            "age_seconds": round(time.monotonic() - self.refreshed_at, 3) if self.last_change_id is not None else None,
+            "max_staleness": self.max_staleness,
+            "bytes": page_count * page_size,
+            "refreshes": self.refreshes,
+            "full_loads": self.full_loads,
+        }
+
+    def close(self):
+        self.engine.dispose()
+        self._anchor.close()
@@ -0,0 +1,69 @@
+import re
+
+from fastapi import HTTPException
+
+'''
+Full-text search over hero names with SQLite FTS5:
+hero_fts is an "external content" FTS5 table, it only stores the search index and reads the names from the hero table itself.
+Three triggers keep it in sync on every INSERT, UPDATE of name and DELETE on hero, whatever code path did the write.
+The tokenizer (unicode61 with remove_diacritics) splits "Spider-Boy" into "spider" and "boy", so both words match,
+and prefix='2 3' adds small prefix indexes so "spi*" is as cheap as a whole word.
+'''
+
+HERO_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS hero_fts USING fts5(
+        name, content='hero', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS hero_fts_insert AFTER INSERT ON hero BEGIN
+        INSERT INTO hero_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hero_fts_delete AFTER DELETE ON hero BEGIN
+        INSERT INTO hero_fts(hero_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS hero_fts_update AFTER UPDATE OF name ON hero BEGIN
+        INSERT INTO hero_fts(hero_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO hero_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+)
+
+HERO_SEARCH_SQL = """
+    SELECT hero.name, hero.age, hero.id
+    FROM hero_fts JOIN hero ON hero.id = hero_fts.rowid
+    WHERE hero_fts MATCH :query
+    ORDER BY hero_fts.rank
+    LIMIT :limit
+"""
+
+# The same search with the rank, to merge the results of several databases (see heroes/sharding.py).
+HERO_SEARCH_RANKED_SQL = """
+    SELECT hero.name, hero.age, hero.id, hero_fts.rank
+    FROM hero_fts JOIN hero ON hero.id = hero_fts.rowid
+    WHERE hero_fts MATCH :query
+    ORDER BY hero_fts.rank
+    LIMIT :limit
+"""
+
+
+def create_hero_fts(connection):
+    '''Creates the FTS table and triggers if they are missing, and indexes the heroes that already exist.'''
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hero_fts'"
+    ).first()
+    for statement in HERO_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    if not exists:
+        connection.exec_driver_sql("INSERT INTO hero_fts(hero_fts) VALUES ('rebuild')")
+
+
+def fts_query(text: str) -> str:
+    '''
+    Turns what the user typed into a safe FTS5 query: every word must match, the last one as a prefix.
+    Quoting each word means characters like " * : ( ) can't change the query syntax.
+    '''
+    words = re.findall(r"\w+", text)
+    if not words:
+        raise HTTPException(status_code=422, detail="The search query has no words")
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
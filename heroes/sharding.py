@@ -0,0 +1,142 @@
+import heapq
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from heroes.db import begin_immediate, create_reader_writer_engines, create_sqlite_engine
+from shared.migrations import migrate
+
+'''
+Sharding the hero table over several SQLite files:
+SQLite has one writer per file, so one database.db caps how many heroes we can write per second.
+A ShardSet spreads the heroes over N files (heroes-0.db, heroes-1.db, ...), each with its own writer and readers,
+so writes to different shards run at the same time (sqlite3 releases the GIL while SQLite works).
+
+Ids: every file would happily hand out id 1, so ids come from IdAllocator instead, a counter in its own small file (hero-ids.db).
+Each process reserves a block of ids at a time (one tiny transaction per block_size heroes) and hands them out from memory,
+so ids are unique across all shards and all workers, and the allocator is never the bottleneck.
+
+Placement: the id alone says where a hero lives, so a single-id read, update or delete goes to exactly one shard.
+HashPlacement mixes the id and takes it modulo N: new heroes spread evenly, which is what scales writes.
+RangePlacement gives each shard a range of ids: easy to reason about and to archive old ranges,
+but new ids are all in the last range, so it doesn't spread writes (use it for a big existing table, not for throughput).
+
+Lists and search are scatter-gather: every shard runs the same query (same filters, same keyset cursor, same limit),
+in parallel, and keyset_merge merges the already sorted results and keeps the first `limit`.
+The cursor is the same as the unsharded one (sort value + id), ids are unique, so the merged order is exact.
+'''
+
+
+class IdAllocator:
+    def __init__(self, sqlite_file_name: str, block_size: int = 1000, start: int = 1):
+        self.block_size = block_size
+        self.start = start
+        self.engine = begin_immediate(create_sqlite_engine(sqlite_file_name, pool_size=1))
+        self._next = self._end = 0
+        self._lock = threading.Lock()
+
+    def create_table(self):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE IF NOT EXISTS id_block (name TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+            connection.exec_driver_sql(
+                "INSERT INTO id_block (name, next) VALUES ('hero', ?) ON CONFLICT DO NOTHING", (self.start,)
+            )
+
+    def _reserve(self):
+        with self.engine.begin() as connection:
+            end = connection.exec_driver_sql(
+                "UPDATE id_block SET next = next + ? WHERE name = 'hero' RETURNING next", (self.block_size,)
+            ).scalar_one()
+        self._next, self._end = end - self.block_size, end
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            hero_id = self._next
+            self._next += 1
+            return hero_id
+
+
+class HashPlacement:
+    def __init__(self, shards: int):
+        self.shards = shards
+
+    def shard_for(self, hero_id: int) -> int:
+        # Fibonacci hashing, so ids with a stride (like every 4th) still spread over all the shards.
+        return (((hero_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) % self.shards
+
+
+class RangePlacement:
+    def __init__(self, bounds: list[int]):
+        # Shard i holds the ids below bounds[i] (and not below bounds[i - 1]), the last shard holds everything above.
+        self.bounds = sorted(bounds)
+        self.shards = len(self.bounds) + 1
+
+    def shard_for(self, hero_id: int) -> int:
+        return bisect_right(self.bounds, hero_id)
+
+
+class ShardSet:
+    def __init__(
+        self,
+        directory: str,
+        shards: int = 4,
+        *,
+        placement: HashPlacement | RangePlacement | None = None,
+        readers: int = 4,
+        pragmas: dict | None = None,
+        id_block_size: int = 1000,
+    ):
+        self.directory = directory
+        self.placement = placement or HashPlacement(shards)
+        if self.placement.shards != shards:
+            raise ValueError(f"The placement has {self.placement.shards} shards, not {shards}")
+        self.engines = [
+            create_reader_writer_engines(os.path.join(directory, f"heroes-{shard}.db"), readers=readers, pragmas=pragmas)
+            for shard in range(shards)
+        ]
+        self.ids = IdAllocator(os.path.join(directory, "hero-ids.db"), block_size=id_block_size)
+        self._pool = ThreadPoolExecutor(shards, thread_name_prefix="shard")
+
+    def __len__(self):
+        return len(self.engines)
+
+    def shard_for(self, hero_id: int) -> int:
+        return self.placement.shard_for(hero_id)
+
+    def writer(self, hero_id: int):
+        return self.engines[self.shard_for(hero_id)][0]
+
+    def reader(self, hero_id: int):
+        return self.engines[self.shard_for(hero_id)][1]
+
+    def scatter(self, function) -> list:
+        '''Runs function(reader_engine) on every shard at the same time, returns the results in shard order.'''
+        return list(self._pool.map(function, [reader for _, reader in self.engines]))
+
+    def migrate(self, migrations) -> int:
+        '''Creates the directory and the id counter, and brings every shard to the latest schema (see shared/migrations.py).'''
+        os.makedirs(self.directory, exist_ok=True)
+        self.ids.create_table()
+        return sum(migrate(writer, migrations) for writer, _ in self.engines)
+
+    def dispose(self):
+        self._pool.shutdown()
+        for writer, reader in self.engines:
+            writer.dispose()
+            reader.dispose()
+        self.ids.engine.dispose()
+
+
+def sort_key(value, hero_id: int):
+    # The order SQLite uses: NULLs first when ascending (so last when descending), then the value, then the id.
+    return (0, 0, hero_id) if value is None else (1, value, hero_id)
+
+
+def keyset_merge(results: list[list], order_by: str, descending: bool, limit: int) -> list:
+    merged = heapq.merge(
+        *results, key=lambda row: sort_key(getattr(row, order_by), row.id), reverse=descending
+    )
+    return [row for _, row in zip(range(limit), merged)]
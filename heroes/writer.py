@@ -0,0 +1,131 @@
+import contextvars
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import TypeVar
+
+from sqlmodel import Session
+
+'''
+Group commit:
+Each mutation committing its own transaction means one WAL sync per request, so write throughput is capped by the disk.
+GroupCommitWriter puts every mutation in a queue that a single writer thread drains.
+The thread takes up to max_batch operations (or whatever arrived within max_delay_ms) and runs them all in ONE transaction.
+A SAVEPOINT per operation costs more than the operation itself (a hero insert is one statement), so the batch first runs without them.
+If an operation fails (a 404, a constraint error...) it may have written part of its changes, so that transaction is rolled back
+and the batch runs again with every operation inside its own SAVEPOINT: only the failed one is undone,
+its Future gets the exception while the others still commit. Operations must be safe to run twice, they only touch the session.
+The caller just waits on its Future: run(operation) returns the operation's result or raises its error, exactly like calling it directly.
+'''
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, engine, max_batch: int = 64, max_delay_ms: float = 2.0):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.batches = 0
+        self.operations = 0
+        self.retried_batches = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="hero-group-commit", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float | None = 5):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, operation: Callable[[Session], T]) -> "Future[T]":
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self.start()
+        future: Future = Future()
+        # Keep the caller's context variables (request id, SQL stats...) for the operation.
+        self._queue.put((future, operation, contextvars.copy_context()))
+        return future
+
+    def run(self, operation: Callable[[Session], T]) -> T:
+        return self.submit(operation).result()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch):
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        try:
+            outcomes = self._run_batch(batch, savepoints=False)
+            if outcomes is None:
+                self.retried_batches += 1
+                outcomes = self._run_batch(batch, savepoints=True)
+        except BaseException as e:
+            # The session or the commit failed, nothing in this batch was written.
+            # Every caller gets the error, also the ones whose operation never ran.
+            for future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _run_batch(self, batch, savepoints: bool):
+        '''
+        Runs the operations in one transaction and commits it. Without savepoints the first failure rolls everything back
+        and returns None. With them each operation has its own SAVEPOINT, and a failure only undoes that operation.
+        '''
+        outcomes = []
+        with Session(self.engine, expire_on_commit=False) as session:
+            for future, operation, context in batch:
+                try:
+                    if savepoints:
+                        with session.begin_nested():
+                            result = context.run(operation, session)
+                    else:
+                        result = context.run(operation, session)
+                except BaseException as e:
+                    if not savepoints:
+                        session.rollback()
+                        return None
+                    outcomes.append((future, None, e))
+                else:
+                    outcomes.append((future, result, None))
+            session.commit()
+        return outcomes
@@ -1,6 +1,37 @@
-from typing import Annotated
-from fastapi import FastAPI, Depends, HTTPException, Query
-from sqlmodel import Field, Session, SQLModel, create_engine, select
+import json
+import logging
+import os
+import threading
+from array import array
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Annotated, Literal
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from sqlalchemy import delete, insert, text, update
+from sqlmodel import Field, Session, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from heroes.analytics import HeroSnapshot
+from heroes.async_db import async_session_dependency, create_async_sqlite_engine, warm_async_pool
+from heroes.autocomplete import NameIndex
+from heroes.bulk import batched, iter_upload
+from heroes.cache import create_cache
+from heroes.db import create_reader_writer_engines, create_unpooled_sqlite_engine, warm_pool
+from heroes.changes import ChangeFeed, create_hero_changes
+from heroes.encoding import dumps, rows_to_json
+from heroes.idempotency import IdempotencyStore
+from heroes.instrumentation import SqlMetrics, SqlTimingMiddleware, instrument_engine
+from heroes.export import EXPORT_BATCH_ROWS, EXPORT_FORMATS, export_chunks, stream_in_threadpool
+from heroes.pagination import SQLITE_INT_MAX, SQLITE_INT_MIN, decode_cursor, encode_cursor, keyset_after, keyset_order, prefix_upper_bound
+from heroes.replica import ReadReplica
+from heroes.search import HERO_SEARCH_SQL, create_hero_fts, fts_query
+from heroes.writer import GroupCommitWriter
+from shared.migrations import migrate
+
+logger = logging.getLogger("heroes")
 
 '''
 Update the App with Multiple Models:
@@ -108,26 +139,64 @@ class HeroUpdate(HeroBase):
     secret_name: str | None = None
 
 
+'''
+The hero table and its public columns:
+Some endpoints skip the ORM objects and talk to the table directly (single SQL statements, rows as tuples).
+hero_public_columns are the HeroPublic fields, in the same order, so a row can become a HeroPublic (or its JSON) as is.
+'''
+
+hero_table = Hero.__table__
+hero_public_columns = (hero_table.c.name, hero_table.c.age, hero_table.c.id)
+HERO_PUBLIC_FIELDS = tuple(HeroPublic.model_fields)
+
+
 '''
 Create an Engine:
 A SQLModel engine (underneath it's actually a SQLAlchemy engine) is what holds the connections to the database.
 You would have one single engine object for all your code to connect to the same database.
 Using check_same_thread=False allows FastAPI to use the same SQLite database in different threads. This is necessary as one single request could use more than one thread (for example in dependencies).
 Don't worry, with the way the code is structured, we'll make sure we use a single SQLModel session per request later, this is actually what the check_same_thread is trying to achieve.
+
+For production we actually build two engines with create_reader_writer_engines (see heroes/db.py):
+engine is the writer, it has a single connection, all the mutations go through it.
+read_engine is a pool of read-only connections, so reads never wait behind a commit.
+Both use WAL mode and tuned pragmas. READ_POOL_SIZE sets how many readers we keep open.
+One thing to watch with small pools: FastAPI validates the response of a `def` endpoint in a worker thread too.
+If an endpoint still holds its connection when it returns, and every worker thread is busy waiting for a connection, nobody can finish.
+So the endpoints give their connection back before returning: the writer session doesn't expire objects on commit, and the read endpoints close their session.
 '''
 
 sqlite_file_name = "database.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+READ_POOL_SIZE = 8
+engine, read_engine = create_reader_writer_engines(sqlite_file_name, readers=READ_POOL_SIZE)
+instrument_engine(engine)
+instrument_engine(read_engine)
 
 '''
 Create the Tables
-We then add a function that uses SQLModel.metadata.create_all(engine) to create the tables for all the table models.
+The tables are created by versioned migrations (see shared/migrations.py), the version is stored in database.db itself. There are three:
+    create_hero_table     SQLModel.metadata.create_all for the hero table
+    create_hero_fts       the full-text search index for hero names, which is not a table model (see heroes/search.py)
+    create_hero_changes   the hero_change log and its triggers behind GET /heroes/changes (see heroes/changes.py)
+Each one checks what exists first (create_all does, the others use IF NOT EXISTS),
+so a database.db made before the migrations, or by an older version of this file, simply ends up at the latest version.
+simple_SQLMmodel.py uses the same file with the same first migration, so keep the two lists in step.
+Add new migrations at the end of HERO_MIGRATIONS, never edit one that already ran somewhere.
 '''
 
+def create_hero_table(connection):
+    SQLModel.metadata.create_all(connection, tables=[Hero.__table__])
+
+
+HERO_MIGRATIONS = [
+    create_hero_table,
+    create_hero_fts,
+    create_hero_changes,
+]
+
+
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    migrate(engine, HERO_MIGRATIONS)
 
 '''
 Create a Session Dependency:
@@ -135,26 +204,176 @@ A Session is what stores the objects in memory and keeps track of any changes ne
 We will create a FastAPI dependency with yield that will provide a new Session for each request. This is what ensures that we use a single session per request.
 Then we create an Annotated dependency SessionDep to simplify the rest of the code that will use this dependency.
 '''
+# expire_on_commit=False keeps the loaded values after commit, so returning the hero doesn't need to grab the writer connection again.
 def get_session():
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         yield session
 
 SessionDep = Annotated[Session, Depends(get_session)]
 
+# Same thing for the read-only pool, used by the endpoints that only read.
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+ReadSessionDep = Annotated[Session, Depends(get_read_session)]
+
+'''
+Group Commit (optional):
+By default every mutation commits its own transaction.
+With HERO_GROUP_COMMIT=1 the mutations are sent to a GroupCommitWriter (see heroes/writer.py) instead,
+it runs up to HERO_GROUP_COMMIT_MAX_OPS of them (or whatever arrives within HERO_GROUP_COMMIT_MAX_DELAY_MS) in a single transaction.
+The endpoints don't change: each mutation is a function that takes a session, and run_write decides where it runs.
+The request still gets its own result or its own error (like the 404).
+'''
+
+GROUP_COMMIT = os.getenv("HERO_GROUP_COMMIT", "0") == "1"
+group_commit_writer = GroupCommitWriter(
+    engine,
+    max_batch=int(os.getenv("HERO_GROUP_COMMIT_MAX_OPS", "64")),
+    max_delay_ms=float(os.getenv("HERO_GROUP_COMMIT_MAX_DELAY_MS", "2")),
+) if GROUP_COMMIT else None
+
+
+'''
+Hero Cache:
+GET /heroes/{hero_id} first looks in hero_cache, which holds the JSON of HeroPublic already encoded (see heroes/cache.py).
+update_hero and delete_hero remove the entry right after they commit, so the next read goes to the database again.
+HERO_CACHE_URL picks the backend: nothing for an in-process LRU, memory:// for the local stand-in, redis://... to share it between workers.
+GET /cache/stats shows hits, misses and sizes.
+'''
+
+hero_cache_options = {"ttl": float(os.getenv("HERO_CACHE_TTL", "60"))}
+# The in-process LRU holds at most 10000 heroes and 16 MiB by default. A shared cache is bounded by its server, setting these with one is an error.
+if os.getenv("HERO_CACHE_MAX_ENTRIES"):
+    hero_cache_options["max_entries"] = int(os.getenv("HERO_CACHE_MAX_ENTRIES"))
+if os.getenv("HERO_CACHE_MAX_BYTES"):
+    hero_cache_options["max_bytes"] = int(os.getenv("HERO_CACHE_MAX_BYTES"))
+hero_cache = create_cache(os.getenv("HERO_CACHE_URL"), **hero_cache_options)
+
+
+'''
+Hero Change Feed:
+Triggers write every change of the hero table to hero_change, and hero_changes (see heroes/changes.py) streams them to GET /heroes/changes.
+After a commit the mutations call hero_changes.notify(), so subscribers see the change right away instead of on the next poll.
+HERO_CHANGES_QUEUE is how many events a subscriber may fall behind before it's dropped (it reconnects and resumes with Last-Event-ID).
+'''
+
+hero_changes = ChangeFeed(
+    read_engine,
+    engine,
+    queue_size=int(os.getenv("HERO_CHANGES_QUEUE", "256")),
+    heartbeat_interval=float(os.getenv("HERO_CHANGES_HEARTBEAT", "15")),
+)
+
+
+def run_write(session: Session, operation):
+    if group_commit_writer is not None:
+        result = group_commit_writer.run(operation)
+    else:
+        result = operation(session)
+        session.commit()
+    hero_changes.notify()
+    return result
+
+'''
+Read Replica (optional):
+With HERO_READ_REPLICA=1, GET /heroes/{hero_id} and GET /heroes/ read from an in-memory copy of database.db instead of the file (see heroes/replica.py).
+It's copied with the SQLite backup API on startup and kept up to date from the hero_change log.
+HERO_REPLICA_MAX_STALENESS (seconds) bounds how old the data a read sees can be: an older copy is refreshed before the read.
+Read your writes: the mutations set a hero_change cookie with the id of the last change, and a read with that cookie
+refreshes the copy first if it's behind. The cookie only lives for the staleness bound, after that every copy has the write anyway.
+Reads from the copy don't fill hero_cache, it could put a hero there that was already changed.
+'''
+
+READ_REPLICA = os.getenv("HERO_READ_REPLICA", "0") == "1"
+REPLICA_COOKIE = "hero_change"
+hero_replica = ReadReplica(
+    read_engine,
+    max_staleness=float(os.getenv("HERO_REPLICA_MAX_STALENESS", "1")),
+    readers=READ_POOL_SIZE,
+) if READ_REPLICA else None
+if hero_replica is not None:
+    instrument_engine(hero_replica.engine)
+
+
+def remember_write(response: Response) -> Response:
+    if hero_replica is not None:
+        response.set_cookie(
+            REPLICA_COOKIE,
+            str(hero_replica.source_position()),
+            max_age=int(hero_replica.max_staleness) + 1,
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
+
+def get_replica_session(request: Request):
+    try:
+        min_change_id = int(request.cookies.get(REPLICA_COOKIE, 0))
+    except ValueError:
+        min_change_id = 0
+    hero_replica.ensure_fresh(min_change_id)
+    with Session(hero_replica.engine) as session:
+        yield session
+
+HeroReadSessionDep = Annotated[Session, Depends(get_read_session if hero_replica is None else get_replica_session)]
+
 '''
 Create Database Tables on Startup:
-We will create the database tables when the application starts.
-Here we create the tables on an application startup event.
+We will create the database tables when the application starts, in a lifespan handler (app.on_event is deprecated).
+The code before the yield runs before the app accepts any request, the code after it when the app shuts down.
+When the schema is already current (every boot but the first) create_db_and_tables only reads the version, no DDL and no lock.
+Then we open all the pooled connections, so the first requests don't pay the connection setup.
 For production you would probably use a migration script that runs before you start your app.
 Tip
 SQLModel will have migration utilities wrapping Alembic, but for now, you can use Alembic directly.
 '''
 
-app = FastAPI()
-#app.on_event("startup") on_even is deprecated, use life_span instead
-@app.on_event("startup")
-def on_startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     create_db_and_tables()
+    warm_pool(engine)
+    warm_pool(read_engine)
+    await warm_async_pool(async_engine)
+    try:
+        hero_snapshot.refresh()
+        hero_name_index.sync()
+    except Exception:
+        # The heroes are served without them, /heroes/stats and /heroes/autocomplete refresh again on their next request.
+        logger.exception("Loading the hero snapshot failed")
+    if hero_replica is not None:
+        hero_replica.refresh()
+        warm_pool(hero_replica.engine)
+    await hero_changes.start()
+    yield
+    await hero_changes.stop()
+    if group_commit_writer is not None:
+        group_commit_writer.stop()
+    if hero_replica is not None:
+        hero_replica.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+'''
+SQL Timing:
+Every statement on our engines is timed (see heroes/instrumentation.py) and added up per request.
+The response gets a Server-Timing header with the DB time, the number of statements and the slowest one, so you can tell SQL apart from the rest.
+GET /metrics has the same numbers as histograms per route, for Prometheus.
+Set HERO_N_PLUS_ONE_THRESHOLD=5 while developing to log the requests that run the same statement more than 5 times, and where it comes from.
+'''
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("HERO_N_PLUS_ONE_THRESHOLD", "0"))
+sql_metrics = SqlMetrics()
+app.add_middleware(SqlTimingMiddleware, metrics=sql_metrics, n_plus_one_threshold=N_PLUS_ONE_THRESHOLD)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return sql_metrics.render()
 
 
 '''
@@ -167,72 +386,521 @@ Tip
 Now we use response_model=HeroPublic instead of the return type annotation -> HeroPublic because the value that we are returning is actually not a HeroPublic.
 If we had declared -> HeroPublic, your editor and linter would complain (rightfully so) that you are returning a Hero instead of a HeroPublic.
 By declaring it in response_model we are telling FastAPI to do its thing, without interfering with the type annotations and the help from your editor and other tools.
+
+Fast path for the mutations:
+The ORM way (session.add, commit, refresh) costs several round-trips to SQLite per request plus the identity map bookkeeping.
+SQLite (3.35+) supports RETURNING, so each mutation is a single statement on the hero table:
+create is INSERT ... RETURNING id, update is UPDATE ... WHERE id = ? RETURNING the public columns, delete is DELETE ... WHERE id = ?.
+No row updated (or deleted) means the hero doesn't exist, so that's our 404.
+benchmarks/bench_mutations.py compares both ways.
 '''
 
+def add_hero(session: Session, hero: HeroCreate) -> HeroPublic:
+    hero_data = hero.model_dump()
+    hero_id = session.execute(insert(hero_table).values(**hero_data).returning(hero_table.c.id)).scalar_one()
+    return HeroPublic(id=hero_id, name=hero_data["name"], age=hero_data["age"])
+
+
+'''
+Idempotency-Key:
+Clients retry POST /heroes/ when it times out, and without help every retry inserts another copy of the hero.
+If the request has an Idempotency-Key header, the first response for that key is kept in idempotency_store (see heroes/idempotency.py)
+for HERO_IDEMPOTENCY_TTL seconds, and a retry gets it back (with Idempotent-Replayed: true) without touching the hero table.
+A retry that arrives while the first request is still running waits for it.
+If the first request fails, the key is forgotten so the next retry can try again.
+Requests without the header work exactly as before.
+'''
+
+idempotency_store = IdempotencyStore(
+    max_entries=int(os.getenv("HERO_IDEMPOTENCY_MAX_KEYS", "100000")),
+    ttl=float(os.getenv("HERO_IDEMPOTENCY_TTL", str(24 * 60 * 60))),
+)
+
+
+def create_hero_once(session: Session, hero: HeroCreate, idempotency_key: str) -> Response:
+    while True:
+        key_digest, entry, owner = idempotency_store.claim(idempotency_key, hero.model_dump_json().encode())
+        if owner:
+            break
+        done = idempotency_store.wait(entry)
+        if done is not None:
+            return Response(
+                content=done.body,
+                status_code=done.status_code,
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+    try:
+        result = run_write(session, partial(add_hero, hero=hero))
+    except BaseException:
+        idempotency_store.abandon(key_digest, entry)
+        raise
+    body = result.model_dump_json().encode()
+    idempotency_store.complete(entry, 200, body)
+    return Response(content=body, media_type="application/json")
+
+
 @app.post("/heroes/", response_model=HeroPublic)
-def create_hero(hero: HeroCreate, session: SessionDep):
-    db_hero = Hero.model_validate(hero)
-    session.add(db_hero)
+def create_hero(
+    hero: HeroCreate,
+    session: SessionDep,
+    response: Response,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+):
+    if idempotency_key is not None:
+        return remember_write(create_hero_once(session, hero, idempotency_key))
+    hero_public = run_write(session, partial(add_hero, hero=hero))
+    remember_write(response)
+    return hero_public
+
+'''
+Bulk Create Heroes:
+Creating heroes one by one means one request, one transaction and one fsync per hero, way too slow to load 100k of them.
+POST /heroes/bulk accepts a JSON array or NDJSON (one hero per line, Content-Type: application/x-ndjson) and reads it as a stream.
+Every BULK_CHUNK_SIZE rows we validate the chunk with HeroCreate and insert it with a single executemany INSERT ... RETURNING id in one transaction.
+So memory stays the same no matter how big the upload is, only the generated ids are kept (8 bytes each, in an array).
+If a chunk is invalid we stop there, the chunks before it are already committed and their ids are in the error detail.
+'''
+
+BULK_CHUNK_SIZE = 5000
+hero_create_list = TypeAdapter(list[HeroCreate])
+
+
+class HeroBulkResult(SQLModel):
+    count: int
+    ids: list[int]
+
+
+def insert_heroes(session: Session, heroes: list[HeroCreate]) -> list[int]:
+    ids = session.scalars(
+        insert(Hero).returning(Hero.id, sort_by_parameter_order=True),
+        [hero.model_dump() for hero in heroes],
+    ).all()
     session.commit()
-    session.refresh(db_hero)
-    return db_hero
+    return ids
+
+
+def bulk_error(status_code: int, error, ids: array) -> HTTPException:
+    return HTTPException(status_code=status_code, detail={"error": error, "inserted_ids": ids.tolist()})
+
+
+@app.post("/heroes/bulk", response_model=HeroBulkResult)
+async def create_heroes_bulk(request: Request, session: SessionDep):
+    ids = array("q")
+    rows = iter_upload(request.stream(), request.headers.get("content-type"))
+    try:
+        async for chunk in batched(rows, BULK_CHUNK_SIZE):
+            try:
+                heroes = hero_create_list.validate_python(chunk)
+            except ValidationError as e:
+                errors = [
+                    {"loc": ["body", len(ids) + error["loc"][0], *error["loc"][1:]], "msg": error["msg"], "type": error["type"]}
+                    for error in e.errors(include_url=False)
+                ]
+                raise bulk_error(422, errors, ids)
+            ids.extend(await run_in_threadpool(insert_heroes, session, heroes))
+            hero_changes.notify()
+    except HTTPException as e:
+        if isinstance(e.detail, dict):
+            raise
+        raise bulk_error(e.status_code, e.detail, ids)
+    # The ids can be a long list, so we skip response_model validation and write the JSON ourselves.
+    content = json.dumps({"count": len(ids), "ids": ids.tolist()}, separators=(",", ":"))
+    return await run_in_threadpool(remember_write, Response(content=content, media_type="application/json"))
+
+'''
+Stream Hero Changes:
+Instead of polling GET /heroes/ every second, a dashboard can listen to GET /heroes/changes with an EventSource (Server-Sent Events).
+Each change is an event with the change id, "create", "update" or "delete" and the hero (just the id for a delete).
+When the connection drops the browser reconnects by itself with a Last-Event-ID header, and gets what it missed.
+'''
+
+@app.get("/heroes/changes")
+async def stream_hero_changes(last_event_id: Annotated[int | None, Header()] = None):
+    return StreamingResponse(
+        hero_changes.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+'''
+Hero Stats:
+GET /heroes/stats gives the number of heroes and the age distribution: min, max, mean, percentiles and a histogram with buckets of bucket_width years.
+It doesn't scan the hero table, hero_snapshot (see heroes/analytics.py) keeps the ids, ages and names in NumPy arrays.
+Each call first applies the changes from hero_change since the last call (usually none, that's one indexed query), then computes the stats with NumPy.
+'''
+
+hero_snapshot = HeroSnapshot(read_engine)
+
+
+@app.get("/heroes/stats")
+def read_hero_stats(
+    percentile: Annotated[list[float], Query(min_length=1, max_length=20)] = [50, 90, 99],
+    bucket_width: Annotated[int, Query(ge=1, le=1000)] = 10,
+):
+    if any(not 0 <= p <= 100 for p in percentile):
+        raise HTTPException(status_code=422, detail="Percentiles must be between 0 and 100")
+    hero_snapshot.refresh()
+    return hero_snapshot.stats(tuple(percentile), bucket_width)
+
+'''
+Autocomplete Hero Names:
+GET /heroes/autocomplete?prefix=spi returns the first `limit` hero names starting with "spi" (any case), in alphabetical order, each name once.
+It's meant for a search box that asks on every keystroke, so it never touches SQLite except for the usual hero_change check:
+hero_name_index (see heroes/autocomplete.py) keeps the names of hero_snapshot sorted, 4 more bytes per name.
+Both are built on startup, and kept up to date from hero_change like the stats. GET /autocomplete/stats shows how much memory the names take.
+It's declared before /heroes/{hero_id}, otherwise "autocomplete" would be taken as a hero_id.
+'''
+
+hero_name_index = NameIndex(hero_snapshot)
+
+
+@app.get("/heroes/autocomplete", response_model=list[str])
+def autocomplete_heroes(
+    prefix: Annotated[str, Query(min_length=1, max_length=100)],
+    limit: Annotated[int, Query(ge=1, le=50)] = 10,
+):
+    hero_snapshot.refresh()
+    return hero_name_index.complete(prefix, limit)
+
+
+@app.get("/autocomplete/stats")
+def read_autocomplete_stats():
+    hero_name_index.sync()
+    return hero_name_index.info()
 
 '''
 Read Heroes with HeroPublic:
 We can do the same as before to read Heros, again, we use response_model=list[HeroPublic] to ensure that the data is validated and serialized correctly.
+
+Deep pages with offset get slower and slower, so we also support keyset (cursor) pagination.
+When a page is full we send an X-Next-Cursor header, old clients just ignore it and keep using offset.
+New clients pass it back as ?cursor=... and we seek straight to the next row using the index on the sort column (id, name or age).
+The cursor remembers the sort column and direction, so order_by and order only matter for the first page.
+
+We can also filter, the filters go straight to the indexes that HeroBase declares with index=True:
+name (exact) and name_prefix use the index on name, name_prefix as a range (name >= "Spi" AND name < "Spj"), not a LIKE.
+age_min and age_max (both inclusive) use the index on age.
+Filters are not stored in the cursor, send the same ones with every page.
+All these query parameters are declared together in a Pydantic model, HeroListParams, and heroes_statement turns them into the SELECT.
+'''
+
+class HeroListParams(BaseModel):
+    offset: int = 0
+    limit: int = Field(default=100, ge=1, le=100)
+    order_by: Literal["id", "name", "age"] = "id"
+    order: Literal["asc", "desc"] = "asc"
+    cursor: str | None = None
+    name: str | None = None
+    name_prefix: str | None = None
+    age_min: int | None = None
+    age_max: int | None = None
+
+
+def heroes_statement(params: HeroListParams):
+    statement = select(*hero_public_columns)
+    if params.name is not None:
+        statement = statement.where(Hero.name == params.name)
+    if params.name_prefix:
+        statement = statement.where(Hero.name >= params.name_prefix)
+        upper_bound = prefix_upper_bound(params.name_prefix)
+        if upper_bound is not None:
+            statement = statement.where(Hero.name < upper_bound)
+    if params.age_min is not None:
+        statement = statement.where(Hero.age >= params.age_min)
+    if params.age_max is not None:
+        statement = statement.where(Hero.age <= params.age_max)
+
+    order_by, descending = params.order_by, params.order == "desc"
+    if params.cursor is not None:
+        if params.offset:
+            raise HTTPException(status_code=400, detail="Use either offset or cursor, not both")
+        order_by, descending, last_value, last_id = decode_cursor(params.cursor)
+        column = getattr(Hero, order_by)
+        statement = statement.where(keyset_after(column, Hero.id, last_value, last_id, descending))
+    else:
+        column = getattr(Hero, order_by)
+        statement = statement.offset(params.offset)
+    statement = statement.order_by(*keyset_order(column, Hero.id, descending)).limit(params.limit)
+    return statement, order_by, descending
+
+
+def next_cursor_headers(rows, limit: int, order_by: str, descending: bool) -> dict:
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        return {"X-Next-Cursor": encode_cursor(order_by, descending, getattr(last, order_by), last.id)}
+    return {}
+
+
+'''
+The rows come back as plain tuples with the HeroPublic columns, no Hero objects are built.
+And instead of letting FastAPI validate each one into HeroPublic and then encode it,
+we turn them into JSON bytes directly (heroes/encoding.py, with orjson when it's installed) and return a Response.
+The JSON is exactly the same, response_model is still there for the docs.
 '''
 
 @app.get("/heroes/", response_model=list[HeroPublic])
 def read_heroes(
-    session: SessionDep,
-    offset: int = 0,
-    limit: Annotated[int, Query(le=100)] = 100,
+    session: HeroReadSessionDep,
+    params: Annotated[HeroListParams, Query()],
 ):
-    heroes = session.exec(select(Hero).offset(offset).limit(limit)).all()
-    return heroes
+    statement, order_by, descending = heroes_statement(params)
+    rows = session.exec(statement).all()
+    session.close()
+    return Response(
+        content=rows_to_json(rows, HERO_PUBLIC_FIELDS),
+        media_type="application/json",
+        headers=next_cursor_headers(rows, params.limit, order_by, descending),
+    )
+
+'''
+Export all the Heroes:
+GET /heroes/export?format=ndjson (or csv) streams every hero, with the same fields as HeroPublic, in a single response.
+It reads with a server-side cursor and sends EXPORT_BATCH_ROWS rows per chunk, see heroes/export.py.
+An export keeps its connection for as long as the client keeps reading, so it doesn't take one from the read pool
+(eight slow exports would leave nothing for the other reads): export_engine opens a connection of its own and closes it at the end.
+At most HERO_EXPORT_MAX_CONCURRENT exports run at once, the next ones get a 503 with Retry-After, each one also holds a worker thread while it runs.
+It has to be declared before /heroes/{hero_id}, otherwise "export" would be taken as a hero_id.
+'''
+
+export_engine = create_unpooled_sqlite_engine(sqlite_file_name, query_only=True)
+instrument_engine(export_engine)
+EXPORT_MAX_CONCURRENT = int(os.getenv("HERO_EXPORT_MAX_CONCURRENT", "4"))
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+@app.get("/heroes/export")
+def export_heroes(format: Literal["ndjson", "csv"] = "ndjson"):
+    if not export_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many exports running, try again later", headers={"Retry-After": "10"})
+    fields = ("name", "age", "id")
+    statement = select(Hero.name, Hero.age, Hero.id).order_by(Hero.id)
+    connection = None
+    try:
+        connection = export_engine.connect()
+        result = connection.execution_options(yield_per=EXPORT_BATCH_ROWS).execute(statement)
+    except BaseException:
+        if connection is not None:
+            connection.close()
+        export_slots.release()
+        raise
+
+    def finish():
+        connection.close()
+        export_slots.release()
+
+    return StreamingResponse(
+        stream_in_threadpool(export_chunks(result, fields, format), on_close=finish),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="heroes.{format}"'},
+    )
+
+'''
+Search Heroes:
+GET /heroes/search?q=spider boy finds heroes whose name has all those words (the last one can be the start of a word), best matches first.
+It runs against the hero_fts full-text index, kept up to date by triggers, so it never scans the hero table.
+'''
+
+@app.get("/heroes/search", response_model=list[HeroPublic])
+def search_heroes(
+    session: ReadSessionDep,
+    q: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+):
+    rows = session.connection().execute(text(HERO_SEARCH_SQL), {"query": fts_query(q), "limit": limit}).all()
+    session.close()
+    return [row._mapping for row in rows]
 
 '''
 Read One Hero with HeroPublic:
 We can read a single hero:
 '''
 
+@app.get("/cache/stats")
+def read_cache_stats():
+    return hero_cache.info()
+
+
+@app.get("/replica/stats")
+def read_replica_stats():
+    if hero_replica is None:
+        raise HTTPException(status_code=404, detail="The read replica is off (HERO_READ_REPLICA=1)")
+    return hero_replica.info()
+
+
+'''
+Read Many Heroes by id:
+When the frontend needs 50-200 specific heroes, one GET /heroes/{hero_id} per hero means a request, a session and a query each.
+GET /heroes/batch?ids=3&ids=1&ids=7 returns them all at once, in the order of the ids, with null for the ids that don't exist.
+Heroes already in hero_cache are taken from there, the rest come from one SELECT ... WHERE id IN (...),
+split in chunks of BATCH_CHUNK_SIZE ids so we stay far below SQLite's limit of bound parameters per statement.
+The heroes read from the database are put in the cache too, as the same JSON that GET /heroes/{hero_id} stores.
+It's declared before /heroes/{hero_id}, otherwise "batch" would be taken as a hero_id.
+Each id must fit in a SQLite integer (64 bit), a bigger one is a 422 instead of an OverflowError when it's bound.
+'''
+
+BATCH_MAX_IDS = 1000
+BATCH_CHUNK_SIZE = 500
+
+
+@app.get("/heroes/batch", response_model=list[HeroPublic | None])
+def read_heroes_batch(
+    session: ReadSessionDep,
+    ids: Annotated[list[Annotated[int, Field(ge=SQLITE_INT_MIN, le=SQLITE_INT_MAX)]], Query(min_length=1, max_length=BATCH_MAX_IDS)],
+):
+    payloads = {}
+    missing = []
+    for hero_id in dict.fromkeys(ids):
+        payload = hero_cache.get(hero_id)
+        if payload is None:
+            missing.append(hero_id)
+        else:
+            payloads[hero_id] = payload
+    if missing:
+        generation = hero_cache.get_generation()
+        for start in range(0, len(missing), BATCH_CHUNK_SIZE):
+            chunk = missing[start:start + BATCH_CHUNK_SIZE]
+            for row in session.execute(select(*hero_public_columns).where(hero_table.c.id.in_(chunk))):
+                payload = dumps(dict(zip(HERO_PUBLIC_FIELDS, row)))
+                hero_cache.set(row.id, payload, generation)
+                payloads[row.id] = payload
+        session.close()
+    content = b"[" + b",".join([payloads.get(hero_id, b"null") for hero_id in ids]) + b"]"
+    return Response(content=content, media_type="application/json")
+
+
 @app.get("/heroes/{hero_id}", response_model=HeroPublic)
-def read_hero(hero_id: int, session: SessionDep):
-    hero = session.get(Hero, hero_id)
-    if not hero:
-        raise HTTPException(status_code=404, detail="Hero not found")
-    return hero
+def read_hero(hero_id: int, session: HeroReadSessionDep):
+    payload = hero_cache.get(hero_id)
+    if payload is None:
+        generation = hero_cache.get_generation()
+        hero = session.get(Hero, hero_id)
+        session.close()
+        if not hero:
+            raise HTTPException(status_code=404, detail="Hero not found")
+        payload = HeroPublic.model_validate(hero).model_dump_json().encode()
+        if hero_replica is None:
+            hero_cache.set(hero_id, payload, generation)
+    return Response(content=payload, media_type="application/json")
 
 '''
 Update a Hero with HeroUpdate:
 We can update a hero. For this we use an HTTP PATCH operation.
 And in the code, we get a dict with all the data sent by the client, only the data sent by the client, excluding any values that would be there just for being the default values. To do it we use exclude_unset=True. This is the main trick.
-Then we use hero_db.sqlmodel_update(hero_data) to update the hero_db with the data from hero_data.
+Then we send only those columns in a single UPDATE ... RETURNING, instead of loading the hero, changing it and reloading it.
+If the client sent no fields at all there's nothing to update, we just read the hero.
 '''
 
-@app.patch("/heroes/{hero_id}", response_model=HeroPublic)
-def update_hero(hero_id: int, hero: HeroUpdate, session: SessionDep):
-    hero_db = session.get(Hero, hero_id)
-    if not hero_db:
-        raise HTTPException(status_code=404, detail="Hero not found")
+def change_hero(session: Session, hero_id: int, hero: HeroUpdate) -> HeroPublic:
     hero_data = hero.model_dump(exclude_unset=True)
-    hero_db.sqlmodel_update(hero_data)
-    session.add(hero_db)
-    session.commit()
-    session.refresh(hero_db)
-    return hero_db
+    if hero_data:
+        statement = update(hero_table).where(hero_table.c.id == hero_id).values(**hero_data)
+        row = session.execute(statement.returning(*hero_public_columns)).first()
+    else:
+        row = session.execute(select(*hero_public_columns).where(hero_table.c.id == hero_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    return HeroPublic.model_validate(row._mapping)
+
+
+@app.patch("/heroes/{hero_id}", response_model=HeroPublic)
+def update_hero(hero_id: int, hero: HeroUpdate, session: SessionDep, response: Response):
+    hero_public = run_write(session, partial(change_hero, hero_id=hero_id, hero=hero))
+    hero_cache.delete(hero_id)
+    remember_write(response)
+    return hero_public
 
 '''
 Delete a Hero Again:
 Deleting a hero stays pretty much the same.
 We won't satisfy the desire to refactor everything in this one.
+Except that we don't load the hero just to delete it: one DELETE, and its rowcount tells us if the hero was there.
 '''
 
+def remove_hero(session: Session, hero_id: int) -> dict:
+    result = session.execute(delete(hero_table).where(hero_table.c.id == hero_id))
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    return {"ok": True}
+
+
 @app.delete("/heroes/{hero_id}")
-def delete_hero(hero_id: int, session: SessionDep):
-    hero = session.get(Hero, hero_id)
+def delete_hero(hero_id: int, session: SessionDep, response: Response):
+    result = run_write(session, partial(remove_hero, hero_id=hero_id))
+    hero_cache.delete(hero_id)
+    remember_write(response)
+    return result
+
+
+'''
+Async Heroes:
+The same CRUD, but with an async engine (aiosqlite) and an AsyncSession, so the endpoints are `async def` and don't hold a threadpool worker while they wait for SQLite.
+They live under /async so you can compare both versions side by side (see benchmarks/bench_async_vs_threadpool.py).
+'''
+
+async_engine = create_async_sqlite_engine(sqlite_file_name)
+instrument_engine(async_engine.sync_engine)
+get_async_session = async_session_dependency(async_engine)
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+
+async_router = APIRouter(prefix="/async")
+
+
+@async_router.post("/heroes/", response_model=HeroPublic)
+async def create_hero_async(hero: HeroCreate, session: AsyncSessionDep):
+    db_hero = Hero.model_validate(hero)
+    session.add(db_hero)
+    await session.commit()
+    hero_changes.notify()
+    await session.refresh(db_hero)
+    return db_hero
+
+
+@async_router.get("/heroes/", response_model=list[HeroPublic])
+async def read_heroes_async(
+    session: AsyncSessionDep,
+    response: Response,
+    params: Annotated[HeroListParams, Query()],
+):
+    statement, order_by, descending = heroes_statement(params)
+    rows = (await session.exec(statement)).all()
+    response.headers.update(next_cursor_headers(rows, params.limit, order_by, descending))
+    return [row._mapping for row in rows]
+
+
+@async_router.get("/heroes/{hero_id}", response_model=HeroPublic)
+async def read_hero_async(hero_id: int, session: AsyncSessionDep):
+    hero = await session.get(Hero, hero_id)
     if not hero:
         raise HTTPException(status_code=404, detail="Hero not found")
-    session.delete(hero)
-    session.commit()
+    return hero
+
+
+@async_router.patch("/heroes/{hero_id}", response_model=HeroPublic)
+async def update_hero_async(hero_id: int, hero: HeroUpdate, session: AsyncSessionDep):
+    hero_db = await session.get(Hero, hero_id)
+    if not hero_db:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    hero_data = hero.model_dump(exclude_unset=True)
+    hero_db.sqlmodel_update(hero_data)
+    session.add(hero_db)
+    await session.commit()
+    hero_changes.notify()
+    await session.refresh(hero_db)
+    hero_cache.delete(hero_id)
+    return hero_db
+
+
+@async_router.delete("/heroes/{hero_id}")
+async def delete_hero_async(hero_id: int, session: AsyncSessionDep):
+    hero = await session.get(Hero, hero_id)
+    if not hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    await session.delete(hero)
+    await session.commit()
+    hero_changes.notify()
+    hero_cache.delete(hero_id)
     return {"ok": True}
+
+
+app.include_router(async_router)
@@ -0,0 +1,166 @@
+import heapq
+import os
+from contextlib import asynccontextmanager
+from typing import Annotated
+from fastapi import FastAPI, HTTPException, Query, Response
+from sqlalchemy import insert, text
+from sqlmodel import Session, select
+
+from heroes.db import warm_pool
+from heroes.encoding import rows_to_json
+from heroes.search import HERO_SEARCH_RANKED_SQL, fts_query
+from heroes.sharding import HashPlacement, RangePlacement, ShardSet, keyset_merge
+from sec_ver_SQLModel import (
+    HERO_MIGRATIONS,
+    HERO_PUBLIC_FIELDS,
+    HeroCreate,
+    HeroListParams,
+    HeroPublic,
+    HeroUpdate,
+    change_hero,
+    hero_public_columns,
+    hero_table,
+    heroes_statement,
+    next_cursor_headers,
+    remove_hero,
+)
+
+'''
+Sharded Heroes:
+The same hero API as sec_ver_SQLModel.py (same models, same queries, same cursors), but the heroes live in HERO_SHARDS SQLite files
+in HERO_SHARD_DIR instead of one database.db, so several writers can work at the same time (see heroes/sharding.py).
+Run it with: uvicorn sharded_SQLModel:app
+By default a hero's shard comes from a hash of its id. HERO_SHARD_RANGES=1000000,2000000 uses id ranges instead (3 shards here).
+Only the hero CRUD, the list and the search are sharded. The cache, the change feed, the stats and the bulk upload stay in the unsharded app.
+'''
+
+SHARD_DIRECTORY = os.getenv("HERO_SHARD_DIR", "shards")
+SHARD_RANGES = [int(bound) for bound in os.getenv("HERO_SHARD_RANGES", "").split(",") if bound]
+SHARD_COUNT = len(SHARD_RANGES) + 1 if SHARD_RANGES else int(os.getenv("HERO_SHARDS", "4"))
+
+shards = ShardSet(
+    SHARD_DIRECTORY,
+    SHARD_COUNT,
+    placement=RangePlacement(SHARD_RANGES) if SHARD_RANGES else HashPlacement(SHARD_COUNT),
+)
+
+'''
+On startup every shard gets the same migrations as database.db, and the id counter file is created.
+'''
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    shards.migrate(HERO_MIGRATIONS)
+    for writer, reader in shards.engines:
+        warm_pool(writer)
+        warm_pool(reader)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+'''
+Create a Hero:
+The id comes from the shared allocator first, the id decides the shard, and the INSERT goes to that shard's writer with the id set.
+'''
+
+def add_hero_with_id(session: Session, hero_id: int, hero: HeroCreate) -> HeroPublic:
+    hero_data = hero.model_dump()
+    session.execute(insert(hero_table).values(id=hero_id, **hero_data))
+    return HeroPublic(id=hero_id, name=hero_data["name"], age=hero_data["age"])
+
+
+@app.post("/heroes/", response_model=HeroPublic)
+def create_hero(hero: HeroCreate):
+    hero_id = shards.ids.allocate()
+    with Session(shards.writer(hero_id)) as session:
+        hero_public = add_hero_with_id(session, hero_id, hero)
+        session.commit()
+    return hero_public
+
+'''
+Read Heroes:
+Every shard runs the same statement as the unsharded list (filters, sort, keyset cursor), and we merge their sorted pages.
+With a cursor each shard only returns `limit` rows, so page 1000 costs what page 1 costs, like before.
+An offset has to be applied after the merge: each shard returns offset + limit rows. That gets expensive, so it's capped at MAX_OFFSET, use the cursor to go further.
+'''
+
+MAX_OFFSET = 10_000
+
+
+@app.get("/heroes/", response_model=list[HeroPublic])
+def read_heroes(params: Annotated[HeroListParams, Query()]):
+    # Checked here, before the shard statements: they get offset 0 and offset + limit, heroes_statement can't tell anymore.
+    if params.limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    if params.offset < 0:
+        raise HTTPException(status_code=400, detail="offset can't be negative")
+    if params.offset > MAX_OFFSET:
+        raise HTTPException(status_code=400, detail=f"offset can't be more than {MAX_OFFSET}, use the cursor")
+    if params.cursor is not None and params.offset:
+        raise HTTPException(status_code=400, detail="Use either offset or cursor, not both")
+    shard_params = params.model_copy(update={"offset": 0, "limit": params.offset + params.limit})
+    statement, order_by, descending = heroes_statement(shard_params)
+
+    def read_shard(reader):
+        with reader.connect() as connection:
+            return connection.execute(statement).all()
+
+    rows = keyset_merge(shards.scatter(read_shard), order_by, descending, params.offset + params.limit)[params.offset:]
+    return Response(
+        content=rows_to_json(rows, HERO_PUBLIC_FIELDS),
+        media_type="application/json",
+        headers=next_cursor_headers(rows, params.limit, order_by, descending),
+    )
+
+'''
+Search Heroes:
+Each shard searches its own hero_fts, and we keep the best ranked `limit` of all of them.
+The rank (bm25) uses word statistics of each shard, with heroes spread by hash they are close enough to compare.
+'''
+
+@app.get("/heroes/search", response_model=list[HeroPublic])
+def search_heroes(
+    q: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+):
+    query = fts_query(q)
+
+    def search_shard(reader):
+        with reader.connect() as connection:
+            return connection.execute(text(HERO_SEARCH_RANKED_SQL), {"query": query, "limit": limit}).all()
+
+    rows = heapq.merge(*shards.scatter(search_shard), key=lambda row: row.rank)
+    return Response(
+        content=rows_to_json([row for _, row in zip(range(limit), rows)], HERO_PUBLIC_FIELDS),
+        media_type="application/json",
+    )
+
+'''
+Read, Update and Delete One Hero:
+The id tells us the shard, so these only touch one file, with the same functions as the unsharded app.
+'''
+
+@app.get("/heroes/{hero_id}", response_model=HeroPublic)
+def read_hero(hero_id: int):
+    with shards.reader(hero_id).connect() as connection:
+        row = connection.execute(select(*hero_public_columns).where(hero_table.c.id == hero_id)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    return row._mapping
+
+
+@app.patch("/heroes/{hero_id}", response_model=HeroPublic)
+def update_hero(hero_id: int, hero: HeroUpdate):
+    with Session(shards.writer(hero_id)) as session:
+        hero_public = change_hero(session, hero_id, hero)
+        session.commit()
+    return hero_public
+
+
+@app.delete("/heroes/{hero_id}")
+def delete_hero(hero_id: int):
+    with Session(shards.writer(hero_id)) as session:
+        result = remove_hero(session, hero_id)
+        session.commit()
+    return result
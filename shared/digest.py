@@ -0,0 +1,10 @@
+import hashlib
+
+'''
+Short keys for long strings: the idempotency store keys on digest(Idempotency-Key), the claims cache on digest(token),
+so neither keeps the string itself. 16 bytes of blake2b, collisions don't happen in practice.
+'''
+
+
+def digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
@@ -0,0 +1,55 @@
+import threading
+from bisect import bisect_left
+
+'''
+Counters shared by the hero modules and the auth modules:
+CacheStats  hits, misses, evictions and invalidations of a cache, for the /stats endpoints
+Histogram   a Prometheus histogram with one series per label value, rendered in the text format for GET /metrics
+'''
+
+
+class CacheStats:
+    __slots__ = ("hits", "misses", "evictions", "invalidations")
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def as_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, label: str = "route"):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.label = label
+        # route -> [count per bucket..., +Inf count], sum
+        self._series: dict[str, tuple[list[int], list[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, value: float):
+        with self._lock:
+            counts, total = self._series.setdefault(route, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for route, (counts, total) in sorted(self._series.items()):
+                label = route.replace("\\", "\\\\").replace('"', '\\"')
+                cumulative = 0
+                for bound, count in zip((*self.buckets, "+Inf"), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{self.label}="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{{self.label}="{label}"}} {total[0]}')
+                lines.append(f'{self.name}_count{{{self.label}="{label}"}} {cumulative}')
+        return lines
@@ -0,0 +1,48 @@
+from collections.abc import Callable, Sequence
+
+from sqlalchemy import Connection, Engine, create_engine
+from sqlalchemy.pool import NullPool
+
+'''
+Versioned schema migrations:
+Instead of running create_all on every boot (it inspects every table, and many workers booting together fight over database.db),
+the schema version is stored in the file itself, in SQLite's PRAGMA user_version (an integer in the header, 0 for a new file).
+A migration is a function that takes a Connection, MIGRATIONS[0] takes the schema from version 0 to 1, MIGRATIONS[1] from 1 to 2, and so on.
+Only append to the list, never change a migration that already shipped.
+
+migrate() first reads user_version without any lock, when the schema is current (the normal boot) that's all it does.
+Otherwise it takes SQLite's write lock with BEGIN IMMEDIATE, that lock is held on the file so it works across processes:
+the first worker runs the migrations, the others wait (up to lock_timeout), then see the new version and do nothing.
+SQLite DDL is transactional and so is user_version, so a migration that fails leaves the file as it was.
+'''
+
+Migration = Callable[[Connection], None]
+
+
+def schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def migrate(engine: Engine, migrations: Sequence[Migration], *, lock_timeout: float = 60.0) -> int:
+    '''Brings the database of `engine` up to len(migrations), returns how many migrations ran here.'''
+    target = len(migrations)
+    # Its own short-lived connection: we run BEGIN/COMMIT ourselves, whatever the app engines do on begin.
+    migration_engine = create_engine(engine.url, poolclass=NullPool, connect_args={"timeout": lock_timeout})
+    try:
+        with migration_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            if schema_version(connection) >= target:
+                return 0
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated while we waited for the lock.
+                version = schema_version(connection)
+                for migration in migrations[version:]:
+                    migration(connection)
+                connection.exec_driver_sql(f"PRAGMA user_version = {max(version, target)}")
+                connection.exec_driver_sql("COMMIT")
+            except BaseException:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+            return max(target - version, 0)
+    finally:
+        migration_engine.dispose()
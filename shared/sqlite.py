@@ -0,0 +1,22 @@
+'''
+SQLite tuning profile:
+By default SQLite uses a rollback journal, so a writer locks the whole file and readers get "database is locked".
+In WAL (write-ahead log) mode readers keep reading the last committed data while one writer appends to the log.
+The pragmas below are applied to every new connection (journal_mode is stored in the file, the others are per connection):
+journal_mode=WAL      readers don't block the writer and the writer doesn't block readers
+synchronous=NORMAL    in WAL mode this is still safe against corruption, it only fsyncs on checkpoints
+cache_size=-16384     16 MiB page cache per connection (negative numbers are KiB)
+mmap_size=268435456   read the first 256 MiB of the file through mmap instead of read() calls
+busy_timeout=5000     wait up to 5s for a lock instead of failing right away
+temp_store=MEMORY     temporary tables and indices for sorting live in RAM
+The hero engines (heroes/db.py) and the auth stores (auth/users.py, auth/revocation.py) all use them.
+'''
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16384,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+}
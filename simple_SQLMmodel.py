@@ -1,6 +1,12 @@
+from contextlib import asynccontextmanager
 from typing import Annotated
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query
 from sqlmodel import Field, Session, SQLModel, create_engine, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from heroes.async_db import async_session_dependency, create_async_sqlite_engine, warm_async_pool
+from heroes.db import warm_pool
+from shared.migrations import migrate
 
 '''
 The Hero class is very similar to a Pydantic model (in fact, underneath, it actually is a Pydantic model).
@@ -35,10 +41,19 @@ engine = create_engine(sqlite_url, connect_args=connect_args)
 '''
 Create the Tables
 We then add a function that uses SQLModel.metadata.create_all(engine) to create the tables for all the table models.
+It runs as a versioned migration (see shared/migrations.py): the schema version is kept in database.db, and once it's current nothing is created or inspected again.
+sec_ver_SQLModel.py has the same first migration on the same file.
 '''
 
+def create_hero_table(connection):
+    SQLModel.metadata.create_all(connection, tables=[Hero.__table__])
+
+
+MIGRATIONS = [create_hero_table]
+
+
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    migrate(engine, MIGRATIONS)
 
 '''
 Create a Session Dependency:
@@ -55,17 +70,22 @@ SessionDep = Annotated[Session, Depends(get_session)]
 '''
 Create Database Tables on Startup:
 We will create the database tables when the application starts.
-Here we create the tables on an application startup event.
+Here we do it in a lifespan handler: the code before the yield runs before the app accepts requests (app.on_event is deprecated).
+We also open the pooled connections there, so the first requests don't pay the connection setup.
 For production you would probably use a migration script that runs before you start your app.
 Tip
 SQLModel will have migration utilities wrapping Alembic, but for now, you can use Alembic directly.
 '''
 
-app = FastAPI()
-#app.on_event("startup") on_even is deprecated, use life_span instead
-@app.on_event("startup")
-def on_startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     create_db_and_tables()
+    warm_pool(engine)
+    await warm_async_pool(async_engine)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 '''
@@ -123,4 +143,56 @@ def delete_hero(hero_id: int, session: SessionDep):
     session.commit()
     return {"ok": True}
 
-# Then go to the /docs UI, you will see that FastAPI is using these models to document the API, and it will use them to serialize and validate the data too.
\ No newline at end of file
+# Then go to the /docs UI, you will see that FastAPI is using these models to document the API, and it will use them to serialize and validate the data too.
+
+
+'''
+Async Heroes:
+The same endpoints with an async engine (aiosqlite) and an AsyncSession, mounted under /async.
+An `async def` endpoint awaits SQLite instead of blocking one of the threadpool workers.
+'''
+
+async_engine = create_async_sqlite_engine(sqlite_file_name)
+get_async_session = async_session_dependency(async_engine)
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
+
+async_router = APIRouter(prefix="/async")
+
+
+@async_router.post("/heroes/")
+async def create_hero_async(hero: Hero, session: AsyncSessionDep) -> Hero:
+    session.add(hero)
+    await session.commit()
+    await session.refresh(hero)
+    return hero
+
+
+@async_router.get("/heroes/")
+async def read_heroes_async(
+    session: AsyncSessionDep,
+    offset: int = 0,
+    limit: Annotated[int, Query(le=100)] = 100,
+) -> list[Hero]:
+    heroes = (await session.exec(select(Hero).offset(offset).limit(limit))).all()
+    return heroes
+
+
+@async_router.get("/heroes/{hero_id}")
+async def read_hero_async(hero_id: int, session: AsyncSessionDep) -> Hero:
+    hero = await session.get(Hero, hero_id)
+    if not hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    return hero
+
+
+@async_router.delete("/heroes/{hero_id}")
+async def delete_hero_async(hero_id: int, session: AsyncSessionDep):
+    hero = await session.get(Hero, hero_id)
+    if not hero:
+        raise HTTPException(status_code=404, detail="Hero not found")
+    await session.delete(hero)
+    await session.commit()
+    return {"ok": True}
+
+
+app.include_router(async_router)
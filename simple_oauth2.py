@@ -1,9 +1,12 @@
+import os
 from typing import Annotated
 
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 
+from auth.users import UserRecord, create_user_store
+
 fake_users_db = {
     "johndoe": {
         "username": "johndoe",
@@ -21,6 +24,9 @@ fake_users_db = {
     },
 }
 
+# The users behind a cache of compact records, fake_users_db unless USERS_DATABASE names a SQLite file (see auth/users.py).
+user_store = create_user_store(os.getenv("USERS_DATABASE"), fake_users_db)
+
 app = FastAPI()
 
 
@@ -42,16 +48,14 @@ class UserInDB(User):
     hashed_password: str
 
 
-def get_user(db, username: str):
-    if username in db:
-        user_dict = db[username]
-        return UserInDB(**user_dict)
+def get_user(username: str) -> UserRecord | None:
+    return user_store.get(username)
 
 
 def fake_decode_token(token):
     # This doesn't provide any security at all
     # Check the next version
-    user = get_user(fake_users_db, token)
+    user = get_user(token)
     return user
 
 
@@ -67,7 +71,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
 
 
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[UserRecord, Depends(get_current_user)],
 ):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -76,10 +80,9 @@ async def get_current_active_user(
 
 @app.post("/token")
 async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    user_dict = fake_users_db.get(form_data.username)
-    if not user_dict:
+    user = get_user(form_data.username)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
-    user = UserInDB(**user_dict)
     hashed_password = fake_hash_password(form_data.password)
     if not hashed_password == user.hashed_password:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
@@ -87,8 +90,8 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
     return {"access_token": user.username, "token_type": "bearer"}
 
 
-@app.get("/users/me")
+@app.get("/users/me", response_model=User)
 async def read_users_me(
-    current_user: Annotated[User, Depends(get_current_active_user)],
+    current_user: Annotated[UserRecord, Depends(get_current_active_user)],
 ):
-    return current_user
\ No newline at end of file
+    return User.model_validate(current_user, from_attributes=True)
\ No newline at end of file
@@ -0,0 +1,909 @@
+import itertools
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from heroes.changes import create_hero_changes
+from heroes.db import create_reader_writer_engines, warm_pool
+from heroes.instrumentation import RequestStats, current_stats, instrument_engine, report_n_plus_one
+from heroes.replica import ReadReplica
+from heroes.search import create_hero_fts
+import sec_ver_SQLModel
+from sec_ver_SQLModel import HERO_MIGRATIONS, Hero, HeroListParams, HeroPublic, app, get_read_session, get_replica_session, get_session, hero_cache, heroes_statement
+
+engine = create_engine(
+    "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+)
+instrument_engine(engine)
+
+
+def get_session_override():
+    with Session(engine) as session:
+        yield session
+
+
+app.dependency_overrides[get_session] = get_session_override
+app.dependency_overrides[get_read_session] = get_session_override
+client = TestClient(app)
+
+
+def reset_db():
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE IF EXISTS hero_fts")
+        connection.exec_driver_sql("DROP TABLE IF EXISTS hero_change")
+        create_hero_fts(connection)
+        create_hero_changes(connection)
+    hero_cache.clear()
+
+
+def create_heroes(*heroes):
+    return [client.post("/heroes/", json=hero).json() for hero in heroes]
+
+
+def test_read_heroes_with_cursor():
+    reset_db()
+    create_heroes(
+        {"name": "Deadpond", "secret_name": "Dive Wilson"},
+        {"name": "Rusty-Man", "secret_name": "Tommy Sharp", "age": 48},
+        {"name": "Spider-Boy", "secret_name": "Pedro Parqueador"},
+        {"name": "Black Lion", "secret_name": "Trevor Challa", "age": 35},
+        {"name": "Captain North", "secret_name": "Esteban Rogelios", "age": 93},
+    )
+
+    for order_by, order in itertools.product(("id", "name", "age"), ("asc", "desc")):
+        expected = client.get("/heroes/", params={"order_by": order_by, "order": order}).json()
+        seen = []
+        response = client.get("/heroes/", params={"order_by": order_by, "order": order, "limit": 2})
+        while True:
+            assert response.status_code == 200
+            seen.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            response = client.get("/heroes/", params={"cursor": cursor, "limit": 2})
+        assert seen == expected
+        assert len(seen) == 5
+
+
+
+def test_read_heroes_fast_path_matches_response_model():
+    reset_db()
+    create_heroes(
+        {"name": "Dormammu \u00e9\u4e2d\U0001f600", "secret_name": "x", "age": 9999},
+        {"name": 'Quote "\\ \n\t\u2028', "secret_name": "y"},
+    )
+    response = client.get("/heroes/")
+    assert response.headers["content-type"] == "application/json"
+    with Session(engine) as session:
+        heroes = [HeroPublic.model_validate(hero) for hero in session.exec(select(Hero))]
+    expected = TypeAdapter(list[HeroPublic]).dump_json(heroes)
+    assert response.content == expected
+
+
+def test_read_heroes_offset_still_works():
+    reset_db()
+    create_heroes(*({"name": f"Hero {i}", "secret_name": "x"} for i in range(3)))
+    response = client.get("/heroes/", params={"offset": 1, "limit": 1})
+    assert response.status_code == 200
+    assert [hero["name"] for hero in response.json()] == ["Hero 1"]
+
+
+def test_read_heroes_bad_cursor():
+    from heroes.pagination import encode_cursor
+
+    reset_db()
+    crafted = [
+        "not-a-cursor",
+        encode_cursor("name", False, ["Deadpond"], 1),
+        encode_cursor("age", True, {"age": 1}, 1),
+        encode_cursor("id", False, None, 1),
+        encode_cursor("age", False, 2**70, 1),
+        encode_cursor("name", False, "Deadpond", True),
+    ]
+    for cursor in crafted:
+        response = client.get("/heroes/", params={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Invalid cursor"}
+    assert client.get("/heroes/", params={"cursor": encode_cursor("age", False, None, 1)}).status_code == 200
+
+
+def async_heroes_engine(tmp_path, migrations):
+    from heroes.async_db import create_async_sqlite_engine
+    from shared.migrations import migrate
+
+    sqlite_file_name = str(tmp_path / "async.db")
+    sync_engine = create_engine(f"sqlite:///{sqlite_file_name}")
+    migrate(sync_engine, migrations)
+    sync_engine.dispose()
+    return create_async_sqlite_engine(sqlite_file_name)
+
+
+def test_async_heroes(tmp_path, monkeypatch):
+    from heroes.async_db import async_session_dependency
+
+    async_engine = async_heroes_engine(tmp_path, HERO_MIGRATIONS)
+    monkeypatch.setitem(app.dependency_overrides, sec_ver_SQLModel.get_async_session, async_session_dependency(async_engine))
+
+    created = [
+        client.post("/async/heroes/", json={"name": name, "secret_name": "x", "age": age}).json()
+        for name, age in (("Deadpond", None), ("Rusty-Man", 48), ("Spider-Boy", 16))
+    ]
+    assert [hero["name"] for hero in created] == ["Deadpond", "Rusty-Man", "Spider-Boy"]
+    assert "secret_name" not in created[0]
+    assert client.get(f"/async/heroes/{created[1]['id']}").json() == created[1]
+
+    response = client.get("/async/heroes/", params={"limit": 2})
+    assert response.json() == created[:2]
+    following = client.get("/async/heroes/", params={"cursor": response.headers["X-Next-Cursor"], "limit": 2})
+    assert following.json() == created[2:]
+    assert [hero["name"] for hero in client.get("/async/heroes/", params={"order_by": "age", "order": "desc"}).json()] == [
+        "Rusty-Man", "Spider-Boy", "Deadpond"
+    ]
+
+    patched = client.patch(f"/async/heroes/{created[2]['id']}", json={"age": 17}).json()
+    assert patched == {**created[2], "age": 17}
+    assert client.get(f"/async/heroes/{created[2]['id']}").json()["age"] == 17
+    assert client.patch("/async/heroes/999999", json={"age": 1}).status_code == 404
+
+    assert client.delete(f"/async/heroes/{created[0]['id']}").json() == {"ok": True}
+    assert client.get(f"/async/heroes/{created[0]['id']}").status_code == 404
+    assert client.delete(f"/async/heroes/{created[0]['id']}").status_code == 404
+    assert len(client.get("/async/heroes/").json()) == 2
+
+
+def import_simple_app():
+    # simple_SQLMmodel.py declares its own "hero" table, give it a MetaData of its own so it can live next to sec_ver_SQLModel.
+    from sqlalchemy import MetaData
+
+    metadata = SQLModel.metadata
+    SQLModel.metadata = MetaData()
+    try:
+        import simple_SQLMmodel
+    finally:
+        SQLModel.metadata = metadata
+    return simple_SQLMmodel
+
+
+def test_async_heroes_simple_app(tmp_path, monkeypatch):
+    from heroes.async_db import async_session_dependency
+
+    simple_SQLMmodel = import_simple_app()
+    async_engine = async_heroes_engine(tmp_path, simple_SQLMmodel.MIGRATIONS)
+    monkeypatch.setitem(
+        simple_SQLMmodel.app.dependency_overrides, simple_SQLMmodel.get_async_session, async_session_dependency(async_engine)
+    )
+    simple_client = TestClient(simple_SQLMmodel.app)
+
+    created = [
+        simple_client.post("/async/heroes/", json={"name": name, "secret_name": f"Secret {name}"}).json()
+        for name in ("Deadpond", "Rusty-Man", "Spider-Boy")
+    ]
+    assert [hero["id"] for hero in created] == [1, 2, 3]
+    assert created[0] == {"id": 1, "name": "Deadpond", "secret_name": "Secret Deadpond", "age": None}
+    assert simple_client.get("/async/heroes/2").json() == created[1]
+    assert simple_client.get("/async/heroes/", params={"offset": 1, "limit": 1}).json() == created[1:2]
+    assert simple_client.get("/async/heroes/").json() == created
+
+    assert simple_client.delete("/async/heroes/1").json() == {"ok": True}
+    assert simple_client.get("/async/heroes/1").status_code == 404
+    assert simple_client.delete("/async/heroes/1").status_code == 404
+    assert simple_client.get("/async/heroes/").json() == created[1:]
+
+
+def test_reader_writer_engines(tmp_path):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+
+    writer, reader = create_reader_writer_engines(str(tmp_path / "heroes.db"), readers=2)
+    with writer.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+        connection.commit()
+    with reader.connect() as connection:
+        # Reader connections are read-only.
+        with pytest.raises(OperationalError):
+            connection.execute(text("INSERT INTO t VALUES (1)"))
+    assert writer.pool.size() == 1
+    assert reader.pool.size() == 2
+
+
+def test_create_heroes_bulk():
+    reset_db()
+    heroes = [{"name": f"Hero {i}", "secret_name": f"Secret {i}", "age": i} for i in range(7)]
+    response = client.post("/heroes/bulk", json=heroes)
+    assert response.status_code == 200
+    assert response.json() == {"count": 7, "ids": [1, 2, 3, 4, 5, 6, 7]}
+
+    ndjson = "\n".join(json.dumps(hero) for hero in heroes[:2]) + "\n"
+    response = client.post(
+        "/heroes/bulk", content=ndjson, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.json() == {"count": 2, "ids": [8, 9]}
+    assert client.get("/heroes/9").json() == {"name": "Hero 1", "age": 1, "id": 9}
+
+
+def test_create_heroes_bulk_invalid_row():
+    reset_db()
+    response = client.post("/heroes/bulk", json=[{"name": "Deadpond", "secret_name": "Dive Wilson"}, {"name": "No Secret"}])
+    assert response.status_code == 422
+    assert response.json()["detail"]["error"][0]["loc"] == ["body", 1, "secret_name"]
+    assert client.get("/heroes/").json() == []
+
+
+def test_group_commit_writer(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from fastapi import HTTPException
+
+    from heroes.writer import GroupCommitWriter
+    from sec_ver_SQLModel import Hero, HeroCreate, add_hero, remove_hero
+
+    writer_engine, _ = create_reader_writer_engines(str(tmp_path / "heroes.db"), readers=1)
+    SQLModel.metadata.create_all(writer_engine)
+    writer = GroupCommitWriter(writer_engine, max_batch=50, max_delay_ms=20)
+
+    def create(i):
+        return writer.run(lambda session: add_hero(session, HeroCreate(name=f"Hero {i}", secret_name="x")))
+
+    with ThreadPoolExecutor(20) as pool:
+        heroes = list(pool.map(create, range(100)))
+        missing = pool.submit(writer.run, lambda session: remove_hero(session, 10_000))
+    writer.stop()
+
+    assert sorted(hero.id for hero in heroes) == list(range(1, 101))
+    with pytest.raises(HTTPException) as error:
+        missing.result()
+    assert error.value.status_code == 404
+    assert writer.batches < writer.operations
+    with Session(writer_engine) as session:
+        assert len(session.exec(select(Hero)).all()) == 100
+
+
+def test_group_commit_writer_failures(tmp_path, monkeypatch):
+    import threading
+
+    import heroes.writer
+    from heroes.writer import GroupCommitWriter
+
+    writer_engine, _ = create_reader_writer_engines(str(tmp_path / "heroes.db"), readers=1)
+    writer = GroupCommitWriter(writer_engine, max_batch=10, max_delay_ms=100)
+
+    # A writer thread that died is replaced by the next submit().
+    writer._thread = threading.Thread(target=lambda: None)
+    writer._thread.start()
+    writer._thread.join()
+    assert writer.run(lambda session: "ran") == "ran"
+
+    # An operation that fails after writing: the batch runs again with savepoints, only that operation is undone.
+    from sec_ver_SQLModel import Hero, HeroCreate, add_hero
+
+    SQLModel.metadata.create_all(writer_engine)
+
+    def half_done(session):
+        add_hero(session, HeroCreate(name="Half Done", secret_name="x"))
+        raise ValueError("broken")
+
+    futures = [
+        writer.submit(lambda session: add_hero(session, HeroCreate(name="First", secret_name="x"))),
+        writer.submit(half_done),
+        writer.submit(lambda session: add_hero(session, HeroCreate(name="Last", secret_name="x"))),
+    ]
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert futures[0].result().name == "First" and futures[2].result().name == "Last"
+    assert writer.retried_batches == 1
+    with Session(writer_engine) as session:
+        assert sorted(hero.name for hero in session.exec(select(Hero))) == ["First", "Last"]
+
+    # The batch fails before any operation ran: every caller gets the error instead of waiting forever.
+    def broken_session(*args, **kwargs):
+        raise RuntimeError("no connection")
+
+    monkeypatch.setattr(heroes.writer, "Session", broken_session)
+    futures = [writer.submit(lambda session: "never") for _ in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="no connection"):
+            future.result(timeout=5)
+    writer.stop()
+
+
+def test_endpoints_with_group_commit(monkeypatch):
+    import sec_ver_SQLModel
+    from heroes.writer import GroupCommitWriter
+
+    reset_db()
+    writer = GroupCommitWriter(engine)
+    monkeypatch.setattr(sec_ver_SQLModel, "group_commit_writer", writer)
+    try:
+        hero = client.post("/heroes/", json={"name": "Deadpond", "secret_name": "Dive Wilson"}).json()
+        assert hero == {"name": "Deadpond", "age": None, "id": 1}
+        response = client.patch("/heroes/1", json={"age": 30})
+        assert response.json() == {"name": "Deadpond", "age": 30, "id": 1}
+        assert client.patch("/heroes/2", json={"age": 30}).status_code == 404
+        assert client.delete("/heroes/2").status_code == 404
+        assert client.delete("/heroes/1").json() == {"ok": True}
+    finally:
+        writer.stop()
+
+
+def test_read_hero_cache():
+    reset_db()
+    hero = client.post("/heroes/", json={"name": "Deadpond", "secret_name": "Dive Wilson"}).json()
+    before = hero_cache.info()
+    first = client.get(f"/heroes/{hero['id']}")
+    second = client.get(f"/heroes/{hero['id']}")
+    assert first.content == second.content == b'{"name":"Deadpond","age":null,"id":1}'
+    after = hero_cache.info()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    client.patch(f"/heroes/{hero['id']}", json={"age": 28})
+    assert client.get(f"/heroes/{hero['id']}").json()["age"] == 28
+    client.delete(f"/heroes/{hero['id']}")
+    assert client.get(f"/heroes/{hero['id']}").status_code == 404
+
+
+def test_cache_limits():
+    import time
+
+    from heroes.cache import InMemoryRemote, LRUCache, RemoteCache, create_cache
+
+    cache = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.set(1, b"aaaa")
+    cache.set(2, b"bbbb")
+    cache.get(1)
+    cache.set(3, b"cccc")
+    assert cache.get(2) is None
+    assert cache.get(1) == b"aaaa"
+    cache.set(4, b"dddddd")
+    assert cache.size_bytes <= 10
+    assert cache.info()["evictions"] == 2
+
+    generation = cache.get_generation()
+    cache.delete(1)
+    cache.set(1, b"old", generation)
+    assert cache.get(1) is None
+
+    cache = LRUCache(ttl=0.01)
+    cache.set(1, b"x")
+    time.sleep(0.02)
+    assert cache.get(1) is None
+
+    shared = InMemoryRemote()
+    worker_a, worker_b = RemoteCache(shared), RemoteCache(shared)
+    worker_a.set(1, b"hero")
+    assert worker_b.get(1) == b"hero"
+    worker_b.delete(1)
+    assert worker_a.get(1) is None
+
+    # A slow miss on worker A can't store the hero that worker B changed in the meantime.
+    generation = worker_a.get_generation()
+    worker_b.delete(2)
+    worker_a.set(2, b"old", generation)
+    assert worker_b.get(2) is None
+    worker_a.set(2, b"new", worker_a.get_generation())
+    assert worker_b.get(2) == b"new"
+
+    assert isinstance(create_cache(None, max_entries=5), LRUCache)
+    with pytest.raises(ValueError, match="max_entries"):
+        create_cache("memory://", max_entries=5, ttl=1)
+
+
+def test_export_heroes(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(sec_ver_SQLModel, "export_engine", engine)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(sec_ver_SQLModel, "export_slots", slots)
+    reset_db()
+    create_heroes(
+        {"name": "Deadpond", "secret_name": "Dive Wilson"},
+        {"name": "Rusty-Man, Jr.", "secret_name": "Tommy Sharp", "age": 48},
+    )
+    response = client.get("/heroes/export")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == client.get("/heroes/").json()
+
+    response = client.get("/heroes/export", params={"format": "csv"})
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text == 'name,age,id\nDeadpond,,1\n"Rusty-Man, Jr.",48,2\n'
+
+    # Every export gave its slot back, and when none is free the next one is refused right away.
+    assert slots.acquire(blocking=False)
+    response = client.get("/heroes/export")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "10"
+
+
+def query_plan(**params) -> str:
+    statement, _, _ = heroes_statement(HeroListParams(**params))
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as connection:
+        return " ".join(row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+
+
+def test_filters_use_indexes():
+    reset_db()
+    assert query_plan(name="Deadpond") == "SEARCH hero USING INDEX ix_hero_name (name=?)"
+    assert query_plan(name_prefix="Spi", order_by="name") == "SEARCH hero USING INDEX ix_hero_name (name>? AND name<?)"
+    assert query_plan(age_min=20, age_max=40, order_by="age") == "SEARCH hero USING INDEX ix_hero_age (age>? AND age<?)"
+    assert query_plan(order_by="age", order="desc") == "SCAN hero USING INDEX ix_hero_age"
+    assert "TEMP B-TREE" not in query_plan(order_by="name", name_prefix="S", order="desc")
+
+
+def test_filter_heroes():
+    reset_db()
+    create_heroes(
+        {"name": "Spider-Boy", "secret_name": "Pedro Parqueador", "age": 16},
+        {"name": "Spider-Girl", "secret_name": "Maria", "age": 25},
+        {"name": "Spiderella", "secret_name": "Ella", "age": 40},
+        {"name": "Deadpond", "secret_name": "Dive Wilson"},
+    )
+    names = lambda **params: [hero["name"] for hero in client.get("/heroes/", params=params).json()]
+    assert names(name="Deadpond") == ["Deadpond"]
+    assert names(name_prefix="Spider-", order_by="name", order="desc") == ["Spider-Girl", "Spider-Boy"]
+    assert names(age_min=16, age_max=25) == ["Spider-Boy", "Spider-Girl"]
+    assert names(name_prefix="Spider", age_min=20, order_by="age") == ["Spider-Girl", "Spiderella"]
+
+    # The character after U+D7FF is U+E000, the surrogates in between can't be bound.
+    from heroes.pagination import prefix_upper_bound
+
+    assert prefix_upper_bound("a\ud7ff") == "a\ue000" and prefix_upper_bound("a\U0010ffff") == "b"
+    create_heroes({"name": "\ud7ffMan", "secret_name": "x"})
+    assert names(name_prefix="\ud7ff") == ["\ud7ffMan"]
+
+    # limit=-1 would mean no limit to SQLite.
+    assert client.get("/heroes/", params={"limit": -1}).status_code == 422
+    assert client.get("/heroes/", params={"limit": 0}).status_code == 422
+    assert client.get("/heroes/search", params={"q": "man", "limit": -1}).status_code == 422
+
+
+def test_search_heroes():
+    reset_db()
+    create_heroes(
+        {"name": "Spider-Boy", "secret_name": "Pedro Parqueador"},
+        {"name": "Rusty-Man", "secret_name": "Tommy Sharp"},
+        {"name": "Captain North", "secret_name": "Esteban Rogelios"},
+    )
+    search = lambda q: [hero["name"] for hero in client.get("/heroes/search", params={"q": q}).json()]
+    assert search("boy") == ["Spider-Boy"]
+    assert search("capt") == ["Captain North"]
+    assert search('man" *:(') == ["Rusty-Man"]
+
+    client.patch("/heroes/1", json={"name": "Spider-Man"})
+    assert search("boy") == []
+    assert sorted(search("man")) == ["Rusty-Man", "Spider-Man"]
+    client.delete("/heroes/2")
+    assert search("man") == ["Spider-Man"]
+
+    from sqlalchemy import text
+    from heroes.search import HERO_SEARCH_SQL
+
+    with engine.connect() as connection:
+        plan = " ".join(row[3] for row in connection.execute(
+            text("EXPLAIN QUERY PLAN " + HERO_SEARCH_SQL), {"query": "man", "limit": 10}
+        ))
+    assert "SCAN hero_fts VIRTUAL TABLE INDEX" in plan
+    assert "SEARCH hero USING INTEGER PRIMARY KEY" in plan
+
+
+def test_server_timing_and_metrics():
+    reset_db()
+    (hero,) = create_heroes({"name": "Deadpond", "secret_name": "Dive Wilson"})
+    hero_cache.clear()
+
+    def samples():
+        # The metrics are the app's, other tests add to them too: compare what this request adds.
+        lines = client.get("/metrics").text.splitlines()
+        return dict(line.rsplit(" ", 1) for line in lines if line and not line.startswith("#"))
+
+    before = samples()
+    response = client.get(f"/heroes/{hero['id']}")
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=") and 'desc="1 statements"' in timing and "app;dur=" in timing
+
+    after = samples()
+    added = lambda name: float(after[name]) - float(before.get(name, 0))
+    assert added('hero_request_statements_bucket{route="/heroes/{hero_id}",le="0"}') == 0
+    assert added('hero_request_statements_bucket{route="/heroes/{hero_id}",le="1"}') == 1
+    assert added('hero_request_db_seconds_count{route="/heroes/{hero_id}"}') == 1
+
+
+def test_n_plus_one_detector(caplog):
+    reset_db()
+    heroes = create_heroes(*({"name": f"Hero {i}", "secret_name": "x"} for i in range(6)))
+    stats = RequestStats(track_call_sites=True)
+    token = current_stats.set(stats)
+    try:
+        with Session(engine) as session:
+            for hero in heroes:
+                session.exec(select(Hero).where(Hero.id == hero["id"])).one()
+    finally:
+        current_stats.reset(token)
+
+    assert stats.statements == 6
+    (suspect,) = report_n_plus_one("GET /test", stats, threshold=5)
+    statement, count, sites = suspect
+    assert count == 6 and statement.startswith("SELECT hero.")
+    assert sites[0].startswith(__file__) and sites[0].endswith("test_n_plus_one_detector")
+    assert "Possible N+1 in GET /test" in caplog.text
+    assert report_n_plus_one("GET /test", stats, threshold=6) == []
+
+
+def test_migrations_run_once(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from shared.migrations import migrate, schema_version
+
+    writer, reader = create_reader_writer_engines(str(tmp_path / "heroes.db"), readers=2)
+    calls = []
+    migrations = [lambda connection, migration=migration: calls.append(1) or migration(connection) for migration in HERO_MIGRATIONS]
+
+    with ThreadPoolExecutor(4) as pool:
+        applied = list(pool.map(lambda _: migrate(writer, migrations), range(4)))
+    assert sorted(applied) == [0, 0, 0, len(HERO_MIGRATIONS)]
+    assert len(calls) == len(HERO_MIGRATIONS)
+    assert migrate(writer, migrations) == 0
+    with reader.connect() as connection:
+        assert schema_version(connection) == len(HERO_MIGRATIONS)
+        tables = connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'").scalars().all()
+    assert {"hero", "hero_fts"} <= set(tables)
+
+    def broken(connection):
+        connection.exec_driver_sql("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        migrate(writer, [*migrations, broken])
+    with reader.connect() as connection:
+        assert schema_version(connection) == len(HERO_MIGRATIONS)
+        assert connection.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'half_done'").first() is None
+
+    warm_pool(reader)
+    assert reader.pool.checkedin() == 2
+
+
+def test_read_heroes_batch(monkeypatch):
+    import sec_ver_SQLModel
+
+    reset_db()
+    heroes = create_heroes(*({"name": f"Hero {i}", "secret_name": "x", "age": i} for i in range(5)))
+    ids = [hero["id"] for hero in heroes]
+    monkeypatch.setattr(sec_ver_SQLModel, "BATCH_CHUNK_SIZE", 2)
+
+    requested = [ids[3], 999, ids[0], ids[3], ids[4], ids[1]]
+    response = client.get("/heroes/batch", params={"ids": requested})
+    assert response.status_code == 200
+    assert response.json() == [heroes[3], None, heroes[0], heroes[3], heroes[4], heroes[1]]
+    # 5 different ids in chunks of 2: 3 queries.
+    assert 'desc="3 statements"' in response.headers["Server-Timing"]
+
+    client.patch(f"/heroes/{ids[0]}", json={"name": "Renamed"})
+    response = client.get("/heroes/batch", params={"ids": [ids[0], ids[4]]})
+    assert response.json() == [{**heroes[0], "name": "Renamed"}, heroes[4]]
+    # Only the hero that changed is read again, the other one comes from the cache.
+    assert 'desc="1 statements"' in response.headers["Server-Timing"]
+    assert client.get(f"/heroes/{ids[0]}").json()["name"] == "Renamed"
+
+    assert client.get("/heroes/batch").status_code == 422
+    assert client.get("/heroes/batch", params={"ids": list(range(1001))}).status_code == 422
+    assert client.get("/heroes/batch", params={"ids": [1, 2**63]}).status_code == 422
+    assert client.get("/heroes/batch", params={"ids": [-2**63, 2**63 - 1]}).json() == [None, None]
+
+
+def test_create_hero_idempotency_key(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from fastapi import HTTPException
+
+    import sec_ver_SQLModel
+    from heroes.idempotency import IdempotencyStore
+
+    reset_db()
+    monkeypatch.setattr(sec_ver_SQLModel, "idempotency_store", IdempotencyStore(max_entries=2))
+    hero = {"name": "Deadpond", "secret_name": "Dive Wilson"}
+
+    first = client.post("/heroes/", json=hero, headers={"Idempotency-Key": "a"})
+    retry = client.post("/heroes/", json=hero, headers={"Idempotency-Key": "a"})
+    assert first.status_code == retry.status_code == 200
+    assert retry.content == first.content
+    assert retry.headers["Idempotent-Replayed"] == "true" and "Idempotent-Replayed" not in first.headers
+    assert client.post("/heroes/", json={**hero, "age": 3}, headers={"Idempotency-Key": "a"}).status_code == 422
+    assert len(client.get("/heroes/").json()) == 1
+
+    # Duplicates in flight wait for the first one instead of inserting again.
+    started, release = threading.Event(), threading.Event()
+    add_hero = sec_ver_SQLModel.add_hero
+
+    def slow_add_hero(session, hero):
+        started.set()
+        release.wait(5)
+        return add_hero(session, hero)
+
+    monkeypatch.setattr(sec_ver_SQLModel, "add_hero", slow_add_hero)
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(client.post, "/heroes/", json=hero, headers={"Idempotency-Key": "b"})
+        started.wait(5)
+        retries = [pool.submit(client.post, "/heroes/", json=hero, headers={"Idempotency-Key": "b"}) for _ in range(3)]
+        release.set()
+        responses = [first.result(), *(retry.result() for retry in retries)]
+    assert {response.content for response in responses} == {responses[0].content}
+    assert len(client.get("/heroes/").json()) == 2
+
+    # A failed request doesn't keep its key.
+    def failing_add_hero(session, hero):
+        raise HTTPException(status_code=503, detail="try again")
+
+    monkeypatch.setattr(sec_ver_SQLModel, "add_hero", failing_add_hero)
+    assert client.post("/heroes/", json=hero, headers={"Idempotency-Key": "c"}).status_code == 503
+    monkeypatch.setattr(sec_ver_SQLModel, "add_hero", add_hero)
+    assert "Idempotent-Replayed" not in client.post("/heroes/", json=hero, headers={"Idempotency-Key": "c"}).headers
+
+    # Bounded: max_entries=2, so "a" is gone and would insert again.
+    assert sec_ver_SQLModel.idempotency_store.info()["keys"] == 2
+
+    # Keys still in progress aren't evicted, a retry of one must still wait for it.
+    store = IdempotencyStore(max_entries=1)
+    _, pending, _ = store.claim("x", b"{}")
+    _, done, _ = store.claim("y", b"{}")
+    store.complete(done, 200, b"{}")
+    store.claim("z", b"{}")
+    assert store.claim("x", b"{}")[1:] == (pending, False)
+    assert store.claim("y", b"{}")[2] is True
+
+
+def test_hero_change_feed():
+    import asyncio
+
+    from heroes.changes import HEARTBEAT, RESET, RETRY, ChangeFeed
+
+    reset_db()
+    # The test engine is one shared connection, so the pump only reads when we notify it, after the writes.
+    feed = ChangeFeed(engine, engine, poll_interval=3600, heartbeat_interval=3600, retention=2)
+
+    async def frames(stream, count):
+        return [await asyncio.wait_for(anext(stream), 5) for _ in range(count)]
+
+    async def scenario():
+        live = feed.stream()
+        assert await frames(live, 1) == [RETRY]
+        (hero,) = await asyncio.to_thread(create_heroes, {"name": "Deadpond", "secret_name": "Dive Wilson"})
+        await asyncio.to_thread(client.patch, f"/heroes/{hero['id']}", json={"age": 30})
+        await asyncio.to_thread(client.delete, f"/heroes/{hero['id']}")
+        feed.notify()
+        created, updated, deleted = await frames(live, 3)
+        assert created == b'id: 1\nevent: create\ndata: {"name":"Deadpond","age":null,"id":%d}\n\n' % hero["id"]
+        assert updated.startswith(b"id: 2\nevent: update\n") and b'"age":30' in updated
+        assert deleted == b'id: 3\nevent: delete\ndata: {"id":%d}\n\n' % hero["id"]
+
+        # Resume: everything after Last-Event-ID comes back from hero_change.
+        resumed = feed.stream(last_event_id=1)
+        assert await frames(resumed, 3) == [RETRY, updated, deleted]
+
+        feed.hub.publish(0, HEARTBEAT)
+        assert await frames(live, 1) == [HEARTBEAT]
+        assert await frames(resumed, 1) == [HEARTBEAT]
+
+        # Rows older than the retention are pruned, resuming from before them is a reset.
+        await asyncio.to_thread(create_heroes, {"name": "Rusty-Man", "secret_name": "Tommy Sharp"})
+        await asyncio.to_thread(feed.prune)
+        assert await frames(feed.stream(last_event_id=1), 2) == [RETRY, RESET]
+
+        await live.aclose()
+        await resumed.aclose()
+        await feed.stop()
+
+    asyncio.run(scenario())
+    assert feed.info()["subscribers"] == 0
+
+
+def test_change_hub_drops_slow_subscribers():
+    import asyncio
+
+    from heroes.changes import HEARTBEAT, ChangeHub
+
+    async def scenario():
+        hub = ChangeHub(queue_size=2)
+        fast, slow = hub.subscribe(), hub.subscribe()
+        for change_id in (1, 2):
+            hub.publish(change_id, b"frame")
+            await fast.queue.get()
+        hub.publish(0, HEARTBEAT)  # heartbeats never drop anyone
+        assert not slow.dropped
+        await fast.queue.get()
+        hub.publish(3, b"frame")
+        assert slow.dropped and not fast.dropped
+        assert hub.subscribers == {fast} and hub.dropped == 1
+
+    asyncio.run(scenario())
+
+
+def test_hero_stats(monkeypatch):
+    import numpy as np
+
+    import sec_ver_SQLModel
+    from heroes.analytics import HeroSnapshot
+
+    reset_db()
+    monkeypatch.setattr(sec_ver_SQLModel, "hero_snapshot", HeroSnapshot(engine))
+    ages = [5, 12, 18, 23, 35, 35, 48, 93, None]
+    heroes = create_heroes(*({"name": f"Hero {i % 3}", "secret_name": "x", "age": age} for i, age in enumerate(ages)))
+
+    def expected():
+        rows = client.get("/heroes/").json()
+        known = np.array([hero["age"] for hero in rows if hero["age"] is not None])
+        return len(rows), known
+
+    stats = client.get("/heroes/stats", params={"percentile": [50, 90], "bucket_width": 20}).json()
+    count, known = expected()
+    assert stats["count"] == count == 9 and stats["with_age"] == 8 and stats["distinct_names"] == 3
+    assert stats["age"]["min"] == 5 and stats["age"]["max"] == 93 and stats["age"]["mean"] == known.mean()
+    assert stats["age"]["percentiles"] == {"p50": np.percentile(known, 50), "p90": np.percentile(known, 90)}
+    assert stats["age"]["histogram"] == [
+        {"from": 0, "to": 20, "count": 3},
+        {"from": 20, "to": 40, "count": 3},
+        {"from": 40, "to": 60, "count": 1},
+        {"from": 80, "to": 100, "count": 1},
+    ]
+
+    # Changes are applied from hero_change, not by reloading the table.
+    snapshot = sec_ver_SQLModel.hero_snapshot
+    monkeypatch.setattr(snapshot, "load", None)
+    client.patch(f"/heroes/{heroes[0]['id']}", json={"age": 60, "name": "New"})
+    for hero in heroes[1:4]:
+        client.delete(f"/heroes/{hero['id']}")
+    create_heroes({"name": "Hero 0", "secret_name": "x", "age": 1})
+    stats = client.get("/heroes/stats").json()
+    count, known = expected()
+    assert stats["count"] == count == 7 and stats["with_age"] == known.size
+    assert stats["age"]["min"] == 1 and stats["age"]["mean"] == known.mean()
+    assert stats["distinct_names"] == 4
+    # 3 dead rows out of 10 is more than a quarter, so they were compacted.
+    assert snapshot.info()["rows"] == 7 and list(snapshot.ids) == sorted(hero["id"] for hero in client.get("/heroes/").json())
+
+    # Ages past int32 fit, and the histogram only lists buckets that have heroes, not the 3e9 between the extremes.
+    create_heroes({"name": "Old One", "secret_name": "x", "age": 3_000_000_000})
+    stats = client.get("/heroes/stats", params={"bucket_width": 1}).json()
+    count, known = expected()
+    assert stats["count"] == count == 8 and stats["age"]["max"] == 3_000_000_000
+    assert stats["age"]["mean"] == pytest.approx(known.mean())
+    assert [bucket["from"] for bucket in stats["age"]["histogram"]] == sorted(set(known.tolist()))
+
+    assert client.get("/heroes/stats", params={"percentile": 101}).status_code == 422
+
+
+def test_autocomplete_hero_names(monkeypatch):
+    from heroes.analytics import HeroSnapshot
+    from heroes.autocomplete import NameIndex
+
+    reset_db()
+    snapshot = HeroSnapshot(engine)
+    monkeypatch.setattr(sec_ver_SQLModel, "hero_snapshot", snapshot)
+    monkeypatch.setattr(sec_ver_SQLModel, "hero_name_index", NameIndex(snapshot, max_pending=2))
+    heroes = create_heroes(*(
+        {"name": name, "secret_name": "x"}
+        for name in ("Spider-Boy", "spider-girl", "Spider-Boy", "Spectre", "Rusty-Man", "Ümit", "umbra")
+    ))
+
+    def complete(prefix, **params):
+        return client.get("/heroes/autocomplete", params={"prefix": prefix, **params}).json()
+
+    assert complete("SPI") == ["Spider-Boy", "spider-girl"]
+    assert complete("sp", limit=2) == ["Spectre", "Spider-Boy"]
+    assert complete("u") == ["umbra", "Ümit"]
+    assert complete("x") == []
+
+    # New names go to pending (and trigger a rebuild past max_pending), renamed and deleted ones disappear.
+    create_heroes({"name": "Spidey", "secret_name": "x"}, {"name": "Sparrow", "secret_name": "x"}, {"name": "Spin", "secret_name": "x"})
+    client.patch(f"/heroes/{heroes[1]['id']}", json={"name": "Web-Girl"})
+    client.delete(f"/heroes/{heroes[0]['id']}")
+    assert complete("sp") == ["Sparrow", "Spectre", "Spider-Boy", "Spidey", "Spin"]
+    client.delete(f"/heroes/{heroes[2]['id']}")
+    assert complete("spi") == ["Spidey", "Spin"]
+    assert complete("w") == ["Web-Girl"]
+
+    stats = client.get("/autocomplete/stats").json()
+    assert stats["names"] == 10 and stats["bytes_per_name"] > 0
+    assert client.get("/heroes/autocomplete", params={"prefix": ""}).status_code == 422
+
+
+def test_sharded_heroes(tmp_path, monkeypatch):
+    import sharded_SQLModel
+    from heroes.sharding import ShardSet, sort_key
+
+    shards = ShardSet(str(tmp_path), 3, readers=2, id_block_size=7)
+    shards.migrate(HERO_MIGRATIONS)
+    monkeypatch.setattr(sharded_SQLModel, "shards", shards)
+    sharded_client = TestClient(sharded_SQLModel.app)
+    try:
+        names = ["Deadpond", "Rusty-Man", "Spider-Boy", "Black Lion"]
+        heroes = [
+            sharded_client.post(
+                "/heroes/", json={"name": names[i % 4], "secret_name": "x", "age": None if i % 5 == 0 else i % 7 * 10}
+            ).json()
+            for i in range(40)
+        ]
+        assert sorted(hero["id"] for hero in heroes) == list(range(1, 41))
+        def count_heroes(reader):
+            with reader.connect() as connection:
+                return connection.exec_driver_sql("SELECT count(*) FROM hero").scalar_one()
+
+        per_shard = shards.scatter(count_heroes)
+        assert sum(per_shard) == 40 and all(per_shard)
+
+        for order_by, order in itertools.product(("id", "name", "age"), ("asc", "desc")):
+            expected = sorted(heroes, key=lambda hero: sort_key(hero[order_by], hero["id"]), reverse=order == "desc")
+            seen = []
+            response = sharded_client.get("/heroes/", params={"order_by": order_by, "order": order, "limit": 7})
+            while True:
+                assert response.status_code == 200
+                seen.extend(response.json())
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+                response = sharded_client.get("/heroes/", params={"cursor": cursor, "limit": 7})
+            assert seen == expected
+            page = sharded_client.get("/heroes/", params={"order_by": order_by, "order": order, "offset": 10, "limit": 5})
+            assert page.json() == expected[10:15]
+
+        filtered = sharded_client.get("/heroes/", params={"name": "Deadpond", "age_min": 10}).json()
+        assert filtered == [hero for hero in heroes if hero["name"] == "Deadpond" and (hero["age"] or 0) >= 10]
+
+        results = sharded_client.get("/heroes/search", params={"q": "spider", "limit": 4}).json()
+        assert len(results) == 4 and all(hero["name"] == "Spider-Boy" for hero in results)
+
+        hero_id = heroes[3]["id"]
+        assert sharded_client.get(f"/heroes/{hero_id}").json() == heroes[3]
+        updated = sharded_client.patch(f"/heroes/{hero_id}", json={"age": 99}).json()
+        assert updated == {**heroes[3], "age": 99}
+        assert sharded_client.get(f"/heroes/{hero_id}").json() == updated
+        assert sharded_client.delete(f"/heroes/{hero_id}").json() == {"ok": True}
+        assert sharded_client.get(f"/heroes/{hero_id}").status_code == 404
+        assert sharded_client.delete(f"/heroes/{hero_id}").status_code == 404
+        assert sharded_client.get("/heroes/", params={"offset": 10_001}).status_code == 400
+        assert sharded_client.get("/heroes/", params={"offset": -5}).status_code == 400
+        assert sharded_client.get("/heroes/", params={"limit": -1}).status_code == 422
+        assert sharded_client.get("/heroes/search", params={"q": "spider", "limit": -1}).status_code == 422
+        first_page = sharded_client.get("/heroes/", params={"limit": 5})
+        next_page = {"cursor": first_page.headers["X-Next-Cursor"], "offset": 5}
+        assert sharded_client.get("/heroes/", params=next_page).status_code == 400
+    finally:
+        shards.dispose()
+
+
+def test_read_replica_reads_your_writes(monkeypatch):
+    reset_db()
+    create_heroes({"name": "Deadpond", "secret_name": "Dive Wilson"})
+    replica = ReadReplica(engine, max_staleness=3600, readers=2)
+    monkeypatch.setattr(sec_ver_SQLModel, "hero_replica", replica)
+    monkeypatch.setitem(app.dependency_overrides, get_read_session, get_replica_session)
+    writer, other = TestClient(app), TestClient(app)
+    try:
+        replica.refresh()
+        assert [hero["name"] for hero in other.get("/heroes/").json()] == ["Deadpond"]
+
+        hero = writer.post("/heroes/", json={"name": "Rusty-Man", "secret_name": "Tommy Sharp", "age": 48}).json()
+        assert int(writer.cookies["hero_change"]) == replica.source_position() > replica.last_change_id
+        # Within the staleness bound the others may read the old copy, the writer reads its own write.
+        assert other.get(f"/heroes/{hero['id']}").status_code == 404
+        assert writer.get(f"/heroes/{hero['id']}").json() == hero
+        assert other.get(f"/heroes/{hero['id']}").json() == hero
+
+        writer.patch(f"/heroes/{hero['id']}", json={"age": 49})
+        writer.delete("/heroes/1")
+        assert writer.get("/heroes/").json() == [{**hero, "age": 49}]
+
+        replica.max_staleness = 0
+        client.post("/heroes/", json={"name": "Spider-Boy", "secret_name": "Pedro Parqueador"})
+        assert [hero["name"] for hero in other.get("/heroes/").json()] == ["Rusty-Man", "Spider-Boy"]
+        assert replica.info()["full_loads"] == 1
+    finally:
+        replica.close()
@@ -0,0 +1,237 @@
+import time
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import full_oauth2
+from full_oauth2 import app, claims_cache, create_access_token, user_store
+
+client = TestClient(app)
+
+
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_verified_tokens_are_cached_until_revoked_or_disabled(monkeypatch):
+    monkeypatch.setitem(full_oauth2.fake_users_db, "johndoe", dict(full_oauth2.fake_users_db["johndoe"]))
+    claims_cache.clear()
+    user_store.clear()
+    token = create_access_token({"sub": "johndoe"}, timedelta(minutes=5))
+    other = create_access_token({"sub": "johndoe"}, timedelta(minutes=6))
+
+    assert client.get("/users/me/", headers=auth(token)).json()["username"] == "johndoe"
+    # Cached: neither the signature nor the user is checked again.
+    with monkeypatch.context() as patched:
+        patched.setattr(full_oauth2.jwt, "decode", None)
+        patched.setattr(full_oauth2, "get_user", None)
+        assert client.get("/users/me/", headers=auth(token)).json()["username"] == "johndoe"
+    assert claims_cache.info()["hits"] == 1
+
+    # Logging out revokes the claims verified for the token, it isn't decoded again.
+    with monkeypatch.context() as patched:
+        patched.setattr(full_oauth2.jwt, "decode", None)
+        assert client.post("/logout", headers=auth(token)).json() == {"ok": True}
+    assert client.get("/users/me/", headers=auth(token)).status_code == 401
+    assert client.get("/users/me/", headers=auth(other)).status_code == 200
+
+    full_oauth2.disable_user("johndoe")
+    assert client.get("/users/me/", headers=auth(other)).json() == {"detail": "Inactive user"}
+    assert claims_cache.info()["entries"] == 1
+
+    expired = create_access_token({"sub": "johndoe"}, timedelta(seconds=-1))
+    assert client.get("/users/me/", headers=auth(expired)).status_code == 401
+    assert client.get("/users/me/", headers=auth("not-a-token")).status_code == 401
+    user_store.clear()
+
+
+def test_claims_cache_is_bounded():
+    from auth.claims import ClaimsCache
+
+    cache = ClaimsCache(max_entries=2)
+    far = 4_000_000_000
+    for token in ("a", "b", "c"):
+        cache.put(token, f"user-{token}", token.upper(), far)
+    assert cache.get("a") is None and cache.get("b") == "B" and cache.get("c") == "C"
+    cache.put("d", "user-d", "D", far)  # "b" was used before "c", but "c" was used last
+    assert cache.get("b") is None and cache.get("c") == "C"
+
+    generation = cache.get_generation()
+    cache.invalidate_user("user-c")
+    cache.put("c", "user-c", "C", far, generation)
+    assert cache.get("c") is None
+    cache.put("e", "user-e", "E", 1)
+    assert cache.get("e") is None
+    assert cache.info()["evictions"] == 2
+
+
+def test_sqlite_user_store(tmp_path):
+    from auth.users import UserRecord, create_user_store
+
+    store = create_user_store(str(tmp_path / "users.db"), max_entries=2)
+    store.repository.add_many(
+        UserRecord(f"user-{i}", f"user-{i}@example.com", None, False, f"hash-{i}") for i in range(1000)
+    )
+    assert store.get("nobody") is None
+    user = store.get("user-7")
+    assert (user.username, user.email, user.full_name, user.disabled, user.hashed_password) == (
+        "user-7", "user-7@example.com", None, False, "hash-7"
+    )
+    assert store.get("user-7") is user
+    plan = store.repository._local.connection.execute("EXPLAIN QUERY PLAN SELECT * FROM user WHERE username = ?", ("x",)).fetchall()
+    assert "USING PRIMARY KEY (username=?)" in plan[0][-1]
+
+    assert store.set_disabled("user-7") and store.get("user-7").disabled is True
+    store.get("user-8"), store.get("user-9")
+    assert store.info()["cached"] == 2 and store.info()["evictions"] == 1
+    assert store.info()["users"] == 1000
+    store.repository.close()
+
+
+def test_logins_are_limited_before_hashing(monkeypatch):
+    from auth.ratelimit import LoginLimiter, TokenBuckets
+
+    checked = []
+    monkeypatch.setattr(full_oauth2, "verify_password", lambda password, hashed: checked.append(password) or False)
+    limiter = LoginLimiter(TokenBuckets(0.001, 5), TokenBuckets(0.001, 2), full_oauth2.password_pool)
+    monkeypatch.setattr(full_oauth2, "login_limiter", limiter)
+
+    def login(username):
+        return client.post("/token", data={"username": username, "password": "wrong"})
+
+    assert [login("johndoe").status_code for _ in range(3)] == [401, 401, 429]
+    assert checked == ["wrong", "wrong"]
+    assert int(login("johndoe").headers["Retry-After"]) > 900
+    assert login("alice").status_code == 401
+    assert login("alice").status_code == 429  # the IP's bucket is empty now
+    monkeypatch.setattr(full_oauth2.password_pool, "in_flight", 10_000)
+    assert login("bob").status_code == 429
+    assert limiter.info()["limited"] == {"pool": 1, "ip": 1, "user": 2} and len(checked) == 2
+
+    buckets = TokenBuckets(1000, 1, max_keys=4)
+    assert buckets.acquire("a") == 0 and buckets.acquire("a") > 0
+    time.sleep(0.002)
+    assert buckets.acquire("a") == 0
+    for key in "bcdef":
+        buckets.acquire(key)
+    assert buckets.info()["keys"] <= 4
+
+
+def test_refresh_tokens_rotate_and_can_be_revoked(tmp_path, monkeypatch):
+    from auth.revocation import create_revocation_list
+
+    revocations = create_revocation_list(str(tmp_path / "revoked.db"))
+    monkeypatch.setattr(full_oauth2, "revocations", revocations)
+    monkeypatch.setattr(claims_cache, "revocations", revocations)
+    monkeypatch.setitem(full_oauth2.fake_users_db, "johndoe", dict(full_oauth2.fake_users_db["johndoe"]))
+    user_store.clear()
+    tokens = full_oauth2.issue_tokens("johndoe")
+
+    # Each kind of token only works where it belongs.
+    assert client.get("/users/me/", headers=auth(tokens.refresh_token)).status_code == 401
+    assert client.post("/token/refresh", data={"refresh_token": tokens.access_token}).status_code == 401
+
+    refreshed = client.post("/token/refresh", data={"refresh_token": tokens.refresh_token}).json()
+    assert client.get("/users/me/", headers=auth(refreshed["access_token"])).json()["username"] == "johndoe"
+    assert client.post("/token/refresh", data={"refresh_token": tokens.refresh_token}).status_code == 401  # used once already
+
+    assert client.post("/token/revoke", data={"token": refreshed["refresh_token"]}).json() == {"ok": True}
+    assert client.post("/token/refresh", data={"refresh_token": refreshed["refresh_token"]}).status_code == 401
+    assert client.post("/token/revoke", data={"token": "not-a-token"}).json() == {"ok": True}
+
+    latest = full_oauth2.issue_tokens("johndoe")
+    full_oauth2.disable_user("johndoe")
+    assert client.post("/token/refresh", data={"refresh_token": latest.refresh_token}).status_code == 401
+    user_store.clear()
+    revocations.stop()
+    revocations.store.close()
+
+
+def test_revocation_list_forgets_expired_jtis(monkeypatch):
+    from auth.revocation import RevocationList
+
+    revocations = RevocationList(capacity=4)
+    now = time.time()
+    for i in range(10):
+        revocations.revoke(f"jti-{i}", now + 60 + i)
+    assert all(revocations.is_revoked(f"jti-{i}") for i in range(10))
+    assert sum(revocations.is_revoked(f"other-{i}") for i in range(1000)) <= 20
+    assert revocations.info()["capacity"] == 16 and revocations.info()["revoked"] == 10
+
+    monkeypatch.setattr(time, "time", lambda: now + 65)
+    revocations.prune()
+    assert revocations.info()["revoked"] == 4 and revocations.info()["rebuilds"] == 3
+    assert not any(revocations.is_revoked(f"jti-{i}") for i in range(6))
+    assert all(revocations.is_revoked(f"jti-{i}") for i in range(6, 10))
+
+
+def test_revocations_are_shared_and_survive_restarts(tmp_path, monkeypatch):
+    from auth.revocation import create_revocation_list
+
+    def eventually(check):
+        deadline = time.monotonic() + 5
+        while not check() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return check()
+
+    path = str(tmp_path / "revoked.db")
+    worker, other = create_revocation_list(path, sync_interval=0.01), create_revocation_list(path, sync_interval=60)
+    now = time.time()
+    assert worker.revoke("jti-1", now + 60) is True
+    assert other.revoke("jti-1", now + 60) is False  # a refresh token replayed on another worker
+    worker.revoke("jti-2", now + 3600)
+    # The check never reads the file, what other workers revoked comes in with the sync thread.
+    with monkeypatch.context() as patched:
+        patched.setattr(other.store, "since", None)
+        assert not other.is_revoked("jti-2")
+    other.sync()
+    assert other.is_revoked("jti-2")
+    other.revoke("jti-3", now + 3600)
+    assert eventually(lambda: worker.is_revoked("jti-3"))
+
+    restarted = create_revocation_list(path, sync_interval=0.01)
+    assert all(restarted.is_revoked(f"jti-{i}") for i in (1, 2, 3))
+    assert restarted.info()["revoked"] == 3 and restarted.info()["backend"]["backend"] == "sqlite"
+
+    # Expired jtis are dropped from the file too, a new worker doesn't load them.
+    monkeypatch.setattr(time, "time", lambda: now + 65)
+    restarted.prune()
+    assert not restarted.is_revoked("jti-1") and restarted.is_revoked("jti-2")
+    assert eventually(lambda: [row[1] for row in restarted.store.since(0)] == ["jti-2", "jti-3"])
+    fresh = create_revocation_list(path)
+    assert fresh.info()["revoked"] == 2
+    for revocations in (worker, other, restarted, fresh):
+        revocations.stop()
+        revocations.store.close()
+
+
+def test_hashing_pool_rejects_beyond_its_queue():
+    import asyncio
+    import threading
+
+    from fastapi import HTTPException
+
+    from auth.hashing import HashingPool
+
+    pool = HashingPool(workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(pool.run("verify", release.wait))
+        queued = asyncio.ensure_future(pool.run("verify", lambda: "done"))
+        await asyncio.sleep(0.05)
+        # The event loop is free while the job runs, and the third job doesn't fit.
+        assert pool.info()["in_flight"] == 2 and not running.done()
+        with pytest.raises(HTTPException) as refused:
+            await pool.run("verify", lambda: "too many")
+        assert refused.value.status_code == 503 and int(refused.value.headers["Retry-After"]) >= 1
+        release.set()
+        assert await running is True and await queued == "done"
+
+    asyncio.run(scenario())
+    assert pool.info() == {"workers": 1, "max_queue": 1, "in_flight": 0, "rejected": 1, "completed": 2}
+    metrics = pool.render()
+    assert "password_hashing_rejected_total 1" in metrics
+    assert 'password_hashing_run_seconds_count{job="verify"} 2' in metrics
+    pool.shutdown()